@@ -46,8 +46,8 @@ from telegram.ext import (
     filters,
 )
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.interval import IntervalTrigger
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.events import EVENT_JOB_SUBMITTED
 import jdatetime
 
 
@@ -81,9 +81,34 @@ def _configure_telegram_poll_log_throttle(interval_sec: float = 90.0):
 
 
 # Local imports
-from loadConfig import configBot
-from curds import curdCommands, CreateDB
-from dapi import api, nardeban
+from loadConfig import configBot, get_config, update_config, get_config_version
+from curds import curdCommands, subscribe_state_change
+from dapi import api, get_nardeban, drop_nardeban
+from dapi_async import (
+    get_nardeban_async,
+    drop_nardeban_async,
+    close_async_client,
+    fetch_tokens_for_logins,
+    promote_tokens_bulk,
+    BRAND_TOKEN_ERROR,
+)
+from post_index import drop_post_index, invalidate_snapshot
+from pending_index import (
+    pending_index_stats,
+    reconcile_pending_index,
+    pick_oldest_token,
+    pick_natural_flow_token,
+    pick_random_token,
+    pick_round_robin_token,
+    pending_count,
+)
+from plan_cache import plan_cache_stats
+from promotion_journal import stage_latency_rollup, login_failure_rollup
+from ladder_dispatcher import LadderDispatcher, LADDER, STOP
+from sqlite_jobstore import SqliteJobStore
+from outbound import MessageCoalescer, PrioritySendQueue, INTERACTIVE, OPERATIONAL, BULK
+import metrics
+from loop_monitor import start_loop_monitor, stop_loop_monitor, note_tick_lag
 
 # منطقه زمانی مرجع برای تمام محاسبات زمان‌بندی
 try:
@@ -152,17 +177,16 @@ def effective_private_chat_id(update: Update) -> int | None:
 def get_stop_time_from_config():
     """خواندن ساعت و دقیقه توقف خودکار از configs.json - برمی‌گرداند (hour, minute) یا None"""
     try:
-        with open('configs.json', 'r', encoding='utf-8') as f:
-            config = json.load(f)
-            # پشتیبانی از فرمت قدیمی (فقط hour)
-            if 'stop_hour' in config and 'stop_minute' not in config:
-                return (config.get('stop_hour'), 0)
-            # فرمت جدید (hour و minute)
-            stop_hour = config.get('stop_hour')
-            stop_minute = config.get('stop_minute', 0)
-            if stop_hour is not None:
-                return (stop_hour, stop_minute)
-            return None
+        config = get_config()
+        # پشتیبانی از فرمت قدیمی (فقط hour)
+        if 'stop_hour' in config and 'stop_minute' not in config:
+            return (config.get('stop_hour'), 0)
+        # فرمت جدید (hour و minute)
+        stop_hour = config.get('stop_hour')
+        stop_minute = config.get('stop_minute', 0)
+        if stop_hour is not None:
+            return (stop_hour, stop_minute)
+        return None
     except Exception as e:
         print(f"❌ خطا در خواندن stop_time از configs.json: {e}")
         return None
@@ -170,12 +194,7 @@ def get_stop_time_from_config():
 def set_stop_time_in_config(hour, minute=0):
     """ذخیره ساعت و دقیقه توقف خودکار در configs.json"""
     try:
-        with open('configs.json', 'r', encoding='utf-8') as f:
-            config = json.load(f)
-        config['stop_hour'] = hour
-        config['stop_minute'] = minute
-        with open('configs.json', 'w', encoding='utf-8') as f:
-            json.dump(config, f, ensure_ascii=False, indent=2)
+        update_config({'stop_hour': hour, 'stop_minute': minute})
         print(f"✅ ساعت توقف خودکار ({hour:02d}:{minute:02d}) در configs.json ذخیره شد.")
         return True
     except Exception as e:
@@ -185,17 +204,16 @@ def set_stop_time_in_config(hour, minute=0):
 def get_start_time_from_config():
     """خواندن ساعت و دقیقه شروع خودکار از configs.json - برمی‌گرداند (hour, minute) یا None"""
     try:
-        with open('configs.json', 'r', encoding='utf-8') as f:
-            config = json.load(f)
-            # پشتیبانی از فرمت قدیمی (فقط hour)
-            if 'start_hour' in config and 'start_minute' not in config:
-                return (config.get('start_hour'), 0)
-            # فرمت جدید (hour و minute)
-            start_hour = config.get('start_hour')
-            start_minute = config.get('start_minute', 0)
-            if start_hour is not None:
-                return (start_hour, start_minute)
-            return None
+        config = get_config()
+        # پشتیبانی از فرمت قدیمی (فقط hour)
+        if 'start_hour' in config and 'start_minute' not in config:
+            return (config.get('start_hour'), 0)
+        # فرمت جدید (hour و minute)
+        start_hour = config.get('start_hour')
+        start_minute = config.get('start_minute', 0)
+        if start_hour is not None:
+            return (start_hour, start_minute)
+        return None
     except Exception as e:
         print(f"❌ خطا در خواندن start_time از configs.json: {e}")
         return None
@@ -203,12 +221,7 @@ def get_start_time_from_config():
 def set_start_time_in_config(hour, minute=0):
     """ذخیره ساعت و دقیقه شروع خودکار در configs.json"""
     try:
-        with open('configs.json', 'r', encoding='utf-8') as f:
-            config = json.load(f)
-        config['start_hour'] = hour
-        config['start_minute'] = minute
-        with open('configs.json', 'w', encoding='utf-8') as f:
-            json.dump(config, f, ensure_ascii=False, indent=2)
+        update_config({'start_hour': hour, 'start_minute': minute})
         print(f"✅ ساعت شروع خودکار ({hour:02d}:{minute:02d}) در configs.json ذخیره شد.")
         return True
     except Exception as e:
@@ -237,9 +250,7 @@ def set_start_hour_in_config(hour):
 def get_repeat_days_from_config():
     """خواندن تعداد روزهای تکرار از configs.json"""
     try:
-        with open('configs.json', 'r', encoding='utf-8') as f:
-            config = json.load(f)
-            return config.get('repeat_days', 365)  # پیش‌فرض 365 روز
+        return get_config().get('repeat_days', 365)  # پیش‌فرض 365 روز
     except Exception as e:
         print(f"❌ خطا در خواندن repeat_days از configs.json: {e}")
         return 365
@@ -252,14 +263,11 @@ def set_repeat_days_in_config(days, reset_start_date=False):
         reset_start_date: اگر True باشد، تاریخ شروع را به امروز تنظیم می‌کند
     """
     try:
-        with open('configs.json', 'r', encoding='utf-8') as f:
-            config = json.load(f)
-        config['repeat_days'] = days
+        values = {'repeat_days': days}
         # ذخیره یا به‌روزرسانی تاریخ شروع تکرار
-        if reset_start_date or 'repeat_start_date' not in config:
-            config['repeat_start_date'] = now_tehran().strftime('%Y-%m-%d')
-        with open('configs.json', 'w', encoding='utf-8') as f:
-            json.dump(config, f, ensure_ascii=False, indent=2)
+        if reset_start_date or 'repeat_start_date' not in get_config():
+            values['repeat_start_date'] = now_tehran().strftime('%Y-%m-%d')
+        update_config(values)
         print(f"✅ تعداد روزهای تکرار ({days}) در configs.json ذخیره شد.")
         return True
     except Exception as e:
@@ -269,12 +277,10 @@ def set_repeat_days_in_config(days, reset_start_date=False):
 def get_repeat_start_date_from_config():
     """خواندن تاریخ شروع تکرار از configs.json"""
     try:
-        with open('configs.json', 'r', encoding='utf-8') as f:
-            config = json.load(f)
-            date_str = config.get('repeat_start_date')
-            if date_str:
-                return datetime.strptime(date_str, '%Y-%m-%d').date()
-            return now_tehran().date()
+        date_str = get_config().get('repeat_start_date')
+        if date_str:
+            return datetime.strptime(date_str, '%Y-%m-%d').date()
+        return now_tehran().date()
     except Exception as e:
         print(f"❌ خطا در خواندن repeat_start_date از configs.json: {e}")
         return now_tehran().date()
@@ -294,13 +300,11 @@ def is_repeat_period_active():
 def get_active_weekdays_from_config():
     """خواندن روزهای فعال هفته از configs.json - برمی‌گرداند لیست اعداد (0=شنبه تا 6=جمعه)"""
     try:
-        with open('configs.json', 'r', encoding='utf-8') as f:
-            config = json.load(f)
-            weekdays = config.get('active_weekdays', [0, 1, 2, 3, 4, 5, 6])  # پیش‌فرض همه روزها
-            # اطمینان از اینکه لیست است
-            if isinstance(weekdays, list):
-                return weekdays
-            return [0, 1, 2, 3, 4, 5, 6]  # در صورت خطا، همه روزها
+        weekdays = get_config().get('active_weekdays', [0, 1, 2, 3, 4, 5, 6])  # پیش‌فرض همه روزها
+        # اطمینان از اینکه لیست است (کپی تا کش مشترک تغییر نکند)
+        if isinstance(weekdays, list):
+            return list(weekdays)
+        return [0, 1, 2, 3, 4, 5, 6]  # در صورت خطا، همه روزها
     except Exception as e:
         print(f"❌ خطا در خواندن active_weekdays از configs.json: {e}")
         return [0, 1, 2, 3, 4, 5, 6]  # در صورت خطا، همه روزها
@@ -318,11 +322,7 @@ def set_active_weekdays_in_config(weekdays):
             print("⚠️ هیچ روز معتبری انتخاب نشده - همه روزها فعال می‌شوند")
             valid_weekdays = [0, 1, 2, 3, 4, 5, 6]
         
-        with open('configs.json', 'r', encoding='utf-8') as f:
-            config = json.load(f)
-        config['active_weekdays'] = sorted(list(set(valid_weekdays)))  # حذف تکراری‌ها و مرتب‌سازی
-        with open('configs.json', 'w', encoding='utf-8') as f:
-            json.dump(config, f, ensure_ascii=False, indent=2)
+        update_config({'active_weekdays': sorted(list(set(valid_weekdays)))})  # حذف تکراری‌ها و مرتب‌سازی
         
         weekday_names = ['شنبه', 'یکشنبه', 'دوشنبه', 'سه‌شنبه', 'چهارشنبه', 'پنج‌شنبه', 'جمعه']
         active_names = [weekday_names[d] for d in sorted(valid_weekdays)]
@@ -434,19 +434,22 @@ from tokens_manager import (
     get_tokens_from_json,
     get_all_pending_tokens_from_json,
     has_pending_tokens_in_json,
-    load_tokens_json,
     update_token_status,
     get_token_stats,
     reset_tokens_for_chat,
     reset_tokens_for_phone,
+    import_tokens_json_to_db,
+    get_pending_counts,
+    get_chat_token_set,
+    add_tokens_batch,
 )
 
-# ایجاد فایل JSON در صورت عدم وجود
+# ساخت جدول token_states و انتقال یک‌بارهٔ tokens.json قدیمی (در صورت وجود)
 try:
-    load_tokens_json()  # این تابع خودش فایل را ایجاد می‌کند اگر وجود نداشته باشد
-    print("✅ فایل tokens.json آماده است.")
+    import_tokens_json_to_db()
+    print("✅ جدول وضعیت توکن‌ها آماده است.")
 except Exception as e:
-    print(f"⚠️ خطا در ایجاد فایل tokens.json: {e}")
+    print(f"⚠️ خطا در آماده‌سازی جدول توکن‌ها: {e}")
 # ==================== پایان مدیریت توکن‌ها در فایل JSON ====================
 
 # Initialize configuration and database
@@ -464,7 +467,6 @@ try:
     print(f"✅ توکن بله و ادمین بارگذاری شد. admin={Datas.admin}")
     
     curd = curdCommands(Datas)
-    db = CreateDB(Datas)
     divarApi = api()
 except FileNotFoundError as e:
     print(f"❌ خطا: فایل پیکربندی یافت نشد: {e}")
@@ -481,14 +483,45 @@ except Exception as e:
     sys.exit(1)
 
 application_instance: Application | None = None
-scheduler = AsyncIOScheduler(
-    timezone=TEHRAN_TZ,
-    job_defaults={
-        # اگر برای چند ثانیه/دقیقه event loop شلوغ بود، همان اجرای کران از دست نرود
+SCHEDULER_OPTIONS = {
+    "timezone": TEHRAN_TZ,
+    "job_defaults": {
+        # اگر برای چند ثانیه/دقیقه event loop شلوغ بود (یا ری‌استارت شد)، همان اجرای کران از دست نرود
         "misfire_grace_time": 300,
         "coalesce": True,
     },
-)
+}
+scheduler = AsyncIOScheduler(**SCHEDULER_OPTIONS)
+# مالک jobهای پایدار این پروسه ("bot" یا "worker")؛ در start_scheduler تنظیم می‌شود
+scheduler_owner = "bot"
+# فاصلهٔ اولین نردبان پس از ری‌استارت وقتی نوبت ذخیره‌شده در گذشته باشد (ثانیه)
+LADDER_RESUME_DELAY = 30
+
+
+def _persist_ladder_due(chatid, kind, due):
+    """ثبت نوبت بعدی نردبان در جدول jobs تا پس از ری‌استارت همان چرخه ادامه یابد"""
+    if kind == LADDER and due is not None:
+        curd.setJobNextRun(chatid=chatid, next_run=due)
+
+
+def _observe_ladder_lag(chatid, kind, lag):
+    metrics.observe("probot_scheduler_tick_lag_seconds", lag, kind=kind)
+    note_tick_lag(f"{kind}:{chatid}", lag)
+
+
+def _observe_job_lag(event):
+    """تأخیر اجرای jobهای APScheduler (کران شروع/توقف خودکار ...) نسبت به زمان برنامه‌ریزی‌شده"""
+    try:
+        scheduled = event.scheduled_run_times[0]
+        lag = (datetime.now(scheduled.tzinfo) - scheduled).total_seconds()
+        metrics.observe("probot_scheduler_tick_lag_seconds", lag, kind="apscheduler")
+        note_tick_lag(f"job:{event.job_id}", lag)
+    except Exception as e:
+        print(f"⚠️ [metrics] خطا در ثبت تأخیر job {getattr(event, 'job_id', '')}: {e}")
+
+
+# همهٔ نوبت‌های نردبان و توقف خودکار ادمین‌ها در یک heap مرکزی (به جای یک job به ازای هر چت)
+ladder_dispatcher = LadderDispatcher(on_due_change=_persist_ladder_due, on_lag=_observe_ladder_lag)
 aux_processes: list[subprocess.Popen] = []
 BOT_LOCK_FILE = os.path.join(_PROJECT_ROOT, ".bot.lock")
 BALE_STATUS_FILE = os.path.join(_PROJECT_ROOT, "bale_status.json")
@@ -694,36 +727,41 @@ def start_aux_services():
         print(f"❌ خطا در اجرای worker: {e}")
 
 
-async def bot_send_message(chat_id, text, *, bot=None, **kwargs):
+# صف ارسال خروجی با سه خط: interactive (پاسخ منو)، operational (اعلان‌های نردبان)، bulk (گزارش‌های حجیم)
+outbox = PrioritySendQueue()
+
+
+async def bot_send_message(chat_id, text, *, bot=None, lane=OPERATIONAL, **kwargs):
     """ارسال پیام با retry mechanism برای مدیریت خطاهای timeout.
-    اگر bot داده شود (مثلاً context.bot) همان استفاده می‌شود؛ وگرنه از نمونهٔ سراسری اپ."""
-    # ثبت لاگ پیام‌های ارسالی برای نمایش در پنل وب
+    اگر bot داده شود (مثلاً context.bot) همان استفاده می‌شود؛ وگرنه از نمونهٔ سراسری اپ.
+    اعلان‌های بافرشدهٔ همین چت قبل از این پیام فرستاده می‌شوند تا ترتیب حفظ شود.
+    lane خط صف ارسال است (INTERACTIVE / OPERATIONAL / BULK)."""
     try:
-        log_path = "web_message_logs.json"
-        logs = []
-        if os.path.exists(log_path):
-            try:
-                with open(log_path, "r", encoding="utf-8") as f:
-                    logs = json.load(f)
-                if not isinstance(logs, list):
-                    logs = []
-            except Exception:
-                logs = []
+        await notifications.flush(chat_id)
+    except Exception as e:
+        print(f"⚠️ ارسال اعلان‌های بافرشده ناموفق بود: {e}")
+    await outbox.submit(lane, lambda: _bot_send_now(chat_id, text, bot=bot, **kwargs))
+
+
+async def _send_coalesced(chat_id, text, parse_mode):
+    kwargs = {"parse_mode": parse_mode} if parse_mode else {}
+    await outbox.submit(OPERATIONAL, lambda: _bot_send_now(chat_id, text, **kwargs))
 
+
+async def notify_chat(chat_id, text, parse_mode=None):
+    """اعلان غیرفوری (نتیجهٔ نردبان، شمارنده، ریست چرخه ...) که با اعلان‌های هم‌زمان همان چت یکی می‌شود"""
+    await notifications.notify(chat_id, text, parse_mode=parse_mode)
+
+
+async def _bot_send_now(chat_id, text, *, bot=None, **kwargs):
+    # ثبت لاگ پیام‌های ارسالی برای نمایش در پنل وب (جدول message_logs؛ یک INSERT)
+    try:
         msg = str(text or "").replace("\x00", "").strip()
-        logs.append(
-            {
-                "ts": now_tehran().strftime("%Y-%m-%d %H:%M:%S"),
-                "chat_id": int(chat_id) if chat_id is not None else None,
-                "text": msg,
-            }
+        curd.addMessageLog(
+            chatid=chat_id,
+            text=msg,
+            ts=now_tehran().strftime("%Y-%m-%d %H:%M:%S"),
         )
-        # فقط لاگ‌های جدید نگه داشته شوند
-        logs = logs[-300:]
-        tmp_path = log_path + ".tmp"
-        with open(tmp_path, "w", encoding="utf-8") as f:
-            json.dump(logs, f, ensure_ascii=False, indent=2)
-        os.replace(tmp_path, log_path)
     except Exception:
         pass
 
@@ -734,21 +772,25 @@ async def bot_send_message(chat_id, text, *, bot=None, **kwargs):
     
     max_retries = 3
     retry_delay = 2  # ثانیه
+    started = time.perf_counter()
     
     for attempt in range(max_retries):
         try:
             await eff_bot.send_message(chat_id=chat_id, text=text, **kwargs)
+            metrics.observe("probot_bale_send_seconds", time.perf_counter() - started, outcome="sent")
             return  # اگر موفق بود، از تابع خارج شو
         except (TimedOut, NetworkError) as e:
             # خطاهای timeout یا network - retry کن
             if attempt < max_retries - 1:
                 print(f"⚠️ خطا در ارسال پیام (تلاش {attempt + 1}/{max_retries}): {type(e).__name__} - صبر {retry_delay} ثانیه...")
+                metrics.inc("probot_bale_send_retries_total")
                 await asyncio.sleep(retry_delay)
                 retry_delay *= 2  # exponential backoff
                 continue
             else:
                 # آخرین تلاش هم ناموفق بود
                 print(f"❌ خطا در ارسال پیام بعد از {max_retries} تلاش: {type(e).__name__} - {str(e)}")
+                metrics.observe("probot_bale_send_seconds", time.perf_counter() - started, outcome="failed")
                 # خطا را log کن اما crash نکن
                 import traceback
                 traceback.print_exc()
@@ -757,49 +799,15 @@ async def bot_send_message(chat_id, text, *, bot=None, **kwargs):
             # سایر خطاها - retry نکن، فقط log کن
             error_name = type(e).__name__
             print(f"❌ خطا در ارسال پیام: {error_name} - {str(e)}")
+            metrics.observe("probot_bale_send_seconds", time.perf_counter() - started, outcome="failed")
             # برای خطاهای غیر timeout، خطا را log کن اما crash نکن
             import traceback
             traceback.print_exc()
             return
 
+# ساخت/ارتقای جداول با مهاجرت‌های نسخه‌دار (schema_version) در یک تراکنش
 try:
-    db.create()
-except Exception as e:
-    print(e)
-try:
-    curd.cTable_manage()
-except Exception as e:
-    print(e)
-try:
-    curd.cTable_adminp()
-except Exception as e:
-    print(e)
-try:
-    curd.cTable_logins()
-except Exception as e:
-    print(e)
-try:
-    curd.cTable_sents()
-except Exception as e:
-    print(e)
-try:
-    curd.cTable_admins()
-except Exception as e:
-    print(e)
-try:
-    curd.cTable_jobs()
-except Exception as e:
-    print(e)
-try:
-    curd.cTable_tokens()
-except Exception as e:
-    print(e)
-try:
-    curd.cTable_web_commands()
-except Exception as e:
-    print(e)
-try:
-    curd.cTable_web_panel_auth()
+    curd.migrate()
 except Exception as e:
     print(e)
 
@@ -821,66 +829,21 @@ except Exception as e:
 
 # تابع helper برای چک کردن ادمین بودن (شامل ادمین پیش‌فرض)
 def isAdmin(chatid):
-    """بررسی می‌کند که آیا کاربر ادمین است (شامل ادمین پیش‌فرض)"""
+    """بررسی می‌کند که آیا کاربر ادمین است (شامل ادمین پیش‌فرض) — از کش مجموعهٔ ادمین‌ها، بدون کوئری در حالت عادی"""
     try:
-        # بررسی اولیه
         if chatid is None:
-            print(f"❌ [isAdmin] chatid None است")
             return False
-        
-        # تبدیل chatid به int (ممکن است string یا int باشد)
         try:
-            if isinstance(chatid, str):
-                chatid_int = int(chatid.strip())
-            else:
-                chatid_int = int(chatid)
-        except (ValueError, TypeError) as e:
-            print(f"❌ [isAdmin] خطا در تبدیل chatid به int: {e} (chatid: {chatid}, type: {type(chatid)})")
+            chatid_int = int(str(chatid).strip())
+        except (ValueError, TypeError):
+            print(f"❌ [isAdmin] chatid نامعتبر: {chatid!r}")
             return False
-        
-        # بررسی ادمین پیش‌فرض
-        if Datas.admin is not None:
-            try:
-                # Datas.admin ممکن است int یا string باشد
-                if isinstance(Datas.admin, str):
-                    admin_int = int(Datas.admin.strip())
-                else:
-                    admin_int = int(Datas.admin)
-                
-                # بررسی ادمین پیش‌فرض
-                if chatid_int == admin_int:
-                    print(f"✅ [isAdmin] کاربر {chatid_int} ادمین پیش‌فرض است - بازگشت True")
-                    return True
-                else:
-                    print(f"⚠️ [isAdmin] کاربر {chatid_int} ادمین پیش‌فرض نیست (admin: {admin_int})")
-            except (ValueError, TypeError) as e:
-                print(f"⚠️ [isAdmin] خطا در تبدیل Datas.admin: {e} (Datas.admin: {Datas.admin}, type: {type(Datas.admin)})")
-        else:
-            print(f"⚠️ [isAdmin] Datas.admin None است!")
-        
-        # بررسی ادمین‌های دیتابیس
-        try:
-            admins_list = curd.getAdmins()
-            if admins_list:
-                admins_list_int = []
-                for admin_id in admins_list:
-                    try:
-                        if isinstance(admin_id, str):
-                            admins_list_int.append(int(admin_id.strip()))
-                        else:
-                            admins_list_int.append(int(admin_id))
-                    except (ValueError, TypeError):
-                        continue  # نادیده گرفتن مقادیر نامعتبر
-                
-                if chatid_int in admins_list_int:
-                    print(f"✅ [isAdmin] کاربر {chatid_int} در لیست ادمین‌ها است - بازگشت True")
-                    return True
-        except Exception as e:
-            print(f"⚠️ [isAdmin] خطا در بررسی ادمین‌های دیتابیس: {e}")
-        
+        if chatid_int == get_default_admin_id():
+            return True
+        if chatid_int in curd.getAdminSet():
+            return True
         print(f"❌ [isAdmin] کاربر {chatid_int} ادمین نیست - بازگشت False")
         return False
-        
     except Exception as e:
         print(f"❌ [isAdmin] خطای غیرمنتظره: {e}")
         import traceback
@@ -993,65 +956,127 @@ async def addadmin(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except:
             pass
 
+# ==================== کش مدل منوی ادمین ====================
+# داده‌های منو (manage، آمار توکن‌ها، job، تنظیمات) به ازای هر چت نگه داشته می‌شوند و با رویداد تغییر وضعیت
+# curds/tokens_manager، تغییر نسخهٔ config یا انقضای TTL (برای نوشتن‌های worker / پنل وب) دوباره ساخته می‌شوند.
+DEFAULT_MENU_CACHE_TTL = 20.0
+_menu_models = {}
+_menu_seeded = set()
+
+
+def invalidate_menu_model(chatid=None):
+    """باطل کردن مدل منوی یک چت (یا همه با chatid=None)"""
+    if chatid is None:
+        _menu_models.clear()
+        return
+    try:
+        _menu_models.pop(int(chatid), None)
+    except (TypeError, ValueError):
+        _menu_models.clear()
+
+
+subscribe_state_change(invalidate_menu_model)
+
+
+def _menu_cache_ttl():
+    try:
+        return max(0.0, float(get_config().get("menu_cache_ttl", DEFAULT_MENU_CACHE_TTL)))
+    except Exception:
+        return DEFAULT_MENU_CACHE_TTL
+
+
+def _build_menu_model(cid):
+    if cid not in _menu_seeded:
+        curd.addAdmin(chatid=cid)
+        curd.addManage(chatid=cid)
+        _menu_seeded.add(cid)
+    mngDetail = curd.getManage(chatid=cid)
+    stats = curd.getStats(chatid=cid)
+    return {
+        "is_active": mngDetail[0] == 1,
+        "nardeban_type": mngDetail[3] if len(mngDetail) > 3 else 1,
+        "interval_minutes": mngDetail[5] if len(mngDetail) > 5 else 5,
+        "stats": {
+            "total_nardeban": stats['total_nardeban'],
+            "total_tokens": stats['total_tokens'],
+            "total_pending": stats['total_pending'],
+            "total_failed": stats.get('total_failed', 0),
+        },
+        "has_job": curd.getJob(chatid=cid) is not None,
+        # ساعت توقف/شروع خودکار، روزهای تکرار و روزهای فعال هفته - از configs.json
+        "stop_time": get_stop_time_from_config(),
+        "start_time": get_start_time_from_config(),
+        "repeat_days": get_repeat_days_from_config(),
+        "weekdays_text": format_weekdays_display(get_active_weekdays_from_config()),
+    }
+
+
+def get_menu_model(cid):
+    """مدل منوی ادمین از کش؛ فقط در صورت تغییر وضعیت/config یا انقضای TTL از دیتابیس ساخته می‌شود"""
+    # get_config (درون _menu_cache_ttl) تغییر فایل را با stat تشخیص می‌دهد و نسخه را جلو می‌برد
+    ttl = _menu_cache_ttl()
+    version = get_config_version()
+    now = time.monotonic()
+    cached = _menu_models.get(cid)
+    if cached is not None and cached[0] == version and now - cached[1] < ttl:
+        return cached[2]
+    model = _build_menu_model(cid)
+    _menu_models[cid] = (version, now, model)
+    return model
+# ==================== پایان کش مدل منوی ادمین ====================
+
+
 def format_admin_menu(chat_id):
     """
     ساخت متن و دکمه‌های منوی اصلی ادمین.
     این تابع برای جلوگیری از تکرار کد در بخش‌های مختلف استفاده می‌شود.
+    متن هر بار از مدل کش‌شده ساخته می‌شود (خط تاریخ و ساعت همیشه به‌روز است).
     """
     try:
         cid = int(chat_id)
     except (TypeError, ValueError):
         cid = 0
-    curd.addAdmin(chatid=cid)
-    curd.addManage(chatid=cid)
-    mngDetail = curd.getManage(chatid=cid)
-    stats = curd.getStats(chatid=cid)
+    model = get_menu_model(cid)
+    stats = model["stats"]
 
     # وضعیت کلی
-    is_active = mngDetail[0] == 1
+    is_active = model["is_active"]
     status_emoji = "🟢" if is_active else "🔴"
     status_text = "فعال" if is_active else "غیرفعال"
 
     # نوع نردبان
-    nardeban_type = mngDetail[3] if len(mngDetail) > 3 else 1
+    nardeban_type = model["nardeban_type"]
     type_names = {1: "ترتیبی کامل", 2: "تصادفی", 3: "ترتیبی نوبتی", 4: "جریان طبیعی"}
     type_name = type_names.get(nardeban_type, "ترتیبی کامل")
     
     # فاصله بین نردبان‌ها
-    interval_minutes = mngDetail[5] if len(mngDetail) > 5 else 5
-    
-    # ساعت و دقیقه توقف و شروع خودکار - از configs.json خوانده می‌شود
-    stop_time = get_stop_time_from_config()
-    start_time = get_start_time_from_config()
-    
-    # تعداد روزهای تکرار - از configs.json خوانده می‌شود
-    repeat_days = get_repeat_days_from_config()
+    interval_minutes = model["interval_minutes"]
     
-    # روزهای فعال هفته - از configs.json خوانده می‌شود
-    active_weekdays = get_active_weekdays_from_config()
-    weekdays_text = format_weekdays_display(active_weekdays)
+    stop_time = model["stop_time"]
+    start_time = model["start_time"]
+    repeat_days = model["repeat_days"]
+    weekdays_text = model["weekdays_text"]
 
     # وضعیت job و فاصله نردبان
-    job_id = curd.getJob(chatid=cid)
-    has_job = job_id is not None
+    has_job = model["has_job"]
     job_status = "🔄 در حال اجرا" if has_job else "⏸️ متوقف"
 
     interval_text = "در انتظار شروع"
     if nardeban_type == 4:
         interval_text = "نامنظم (۳ تا ۱۵ دقیقه)"
     elif has_job:
-        job = scheduler.get_job(job_id) if scheduler else None
-        if job and isinstance(job.trigger, IntervalTrigger):
-            seconds = job.trigger.interval.total_seconds()
+        entry = ladder_dispatcher.get(cid, LADDER)
+        if entry and entry.interval:
+            seconds = entry.interval
             if seconds >= 60:
                 minutes = max(1, round(seconds / 60))
                 interval_text = f"هر {minutes} دقیقه"
             else:
                 interval_text = f"هر {int(seconds)} ثانیه"
-        elif job:
-            interval_text = "ثبت شده (Trigger نامشخص)"
+        elif entry:
+            interval_text = "نوبت یک‌باره ثبت شده"
         else:
-            interval_text = "job در scheduler یافت نشد"
+            interval_text = "نوبت نردبان در زمان‌بند یافت نشد"
     
     # نمایش ساعت و دقیقه توقف و شروع خودکار
     stop_time_text = "تنظیم نشده"
@@ -1073,7 +1098,7 @@ def format_admin_menu(chat_id):
    ✅ نردبان شده: <b>{stats['total_nardeban']}</b>
    📦 کل استخراج: <b>{stats['total_tokens']}</b>
    ⏳ در انتظار: <b>{stats['total_pending']}</b>
-   ❌ ناموفق: <b>{stats.get('total_failed', 0)}</b>
+   ❌ ناموفق: <b>{stats['total_failed']}</b>
 
 ⚙️ <b>تنظیمات جاری:</b>
    ⏱️ فاصله بین نردبان‌ها: <b>{interval_minutes} دقیقه</b>
@@ -1115,7 +1140,7 @@ def format_admin_menu(chat_id):
     ]
 
     # منوی مدیریت ادمین‌ها فقط برای ادمین پیش‌فرض
-    if Datas.admin is not None and cid == int(Datas.admin):
+    if cid == get_default_admin_id():
         btns.append([InlineKeyboardButton('👥 مدیریت ادمین‌ها', callback_data='manageAdmins')])
 
     # دکمه‌های کمکی
@@ -1173,6 +1198,31 @@ def _chunk_lines_for_message(lines, limit=3500):
     return chunks
 
 
+# اعلان‌های کوتاه هر چت در پنجرهٔ notify_coalesce_seconds یکی می‌شوند
+notifications = MessageCoalescer(send=_send_coalesced, chunker=_chunk_lines_for_message)
+
+
+def _runtime_metrics():
+    """gaugeهای لحظه‌ای این پروسه برای snapshot متریک‌ها (صف ارسال، کش پلن، زمان‌بند نردبان، نمایهٔ pending)"""
+    samples = []
+    for lane, v in outbox.stats().items():
+        samples.append(("probot_send_queue_depth", {"lane": lane}, v["queued"] + v["inflight"]))
+        samples.append(("probot_send_queue_sent_total", {"lane": lane}, v["sent"]))
+    samples.append(("probot_notifications_total", {"kind": "notice"}, notifications.coalesced_notices))
+    samples.append(("probot_notifications_total", {"kind": "message"}, notifications.sent_messages))
+    plan_stats = plan_cache_stats()
+    for result in ("hits", "misses", "fallbacks"):
+        samples.append(("probot_plan_cache_total", {"result": result}, plan_stats[result]))
+    dispatcher_stats = ladder_dispatcher.stats()
+    samples.append(("probot_ladder_entries", {"kind": LADDER}, dispatcher_stats["ladders"]))
+    samples.append(("probot_ladder_entries", {"kind": STOP}, dispatcher_stats["stops"]))
+    samples.append(("probot_pending_index_tokens", {}, pending_index_stats()["tokens"]))
+    return samples
+
+
+metrics.register_collector(_runtime_metrics)
+
+
 async def report_ads_by_status(chatid, heading, empty_text, fetch_func):
     """گزارش وضعیت آگهی‌ها بر اساس تابع fetch_func (مثل تمدید یا منقضی)."""
     logins = curd.getLogins(chatid=chatid)
@@ -1189,7 +1239,7 @@ async def report_ads_by_status(chatid, heading, empty_text, fetch_func):
     total_found = 0
 
     for phone, cookie, _ in active_logins:
-        nardeban_api = nardeban(apiKey=cookie)
+        nardeban_api = get_nardeban(chatid, phone, cookie)
 
         try:
             tokens_info = await asyncio.to_thread(fetch_func, nardeban_api)
@@ -1229,6 +1279,7 @@ async def report_ads_by_status(chatid, heading, empty_text, fetch_func):
         await bot_send_message(
             chat_id=chatid,
             text=chunk,
+            lane=BULK,
             parse_mode='HTML',
             disable_web_page_preview=False
         )
@@ -1269,56 +1320,73 @@ async def renew_ads_by_status(chatid, heading, fetch_func):
     total_success = 0
     total_failed = 0
 
+    # مرحلهٔ ۱: لیست آگهی‌های هر لاگین (از snapshot مشترک post-list)
+    jobs = []
+    phone_lines = {}
     for phone, cookie, _ in active_logins:
-        nardeban_api = nardeban(apiKey=cookie)
+        nardeban_api = get_nardeban(chatid, phone, cookie)
 
         try:
             tokens_info = await asyncio.to_thread(fetch_func, nardeban_api)
         except Exception as e:
             err_text = html.escape((str(e).strip() or "خطای نامشخص")[:120])
-            lines.append(f"📱 <b>{phone}</b>: ❌ خطا در دریافت لیست ({err_text})")
-            lines.append("")
+            phone_lines[phone] = [f"📱 <b>{phone}</b>: ❌ خطا در دریافت لیست ({err_text})"]
             continue
 
         if not tokens_info:
-            lines.append(f"📱 <b>{phone}</b>: هیچ آگهی مطابق معیار یافت نشد.")
-            lines.append("")
+            phone_lines[phone] = [f"📱 <b>{phone}</b>: هیچ آگهی مطابق معیار یافت نشد."]
             continue
 
-        phone_success = 0
-        phone_failed = 0
-
+        phone_lines[phone] = None
         for info in tokens_info:
             token = info.get('token')
-            if not token:
-                continue
+            if token:
+                jobs.append((phone, cookie, token))
 
-            total_attempted += 1
-            try:
-                result = await asyncio.to_thread(
-                    nardeban_api.sendNardebanWithToken,
-                    int(phone),
-                    chatid,
-                    token,
-                    False
-                )
-            except Exception as e:
-                phone_failed += 1
-                total_failed += 1
-                err_text = html.escape((str(e).strip() or "خطای نامشخص")[:80])
-                lines.append(f"   • {token[:8]}...: ❌ خطا ({err_text})")
-                continue
+    # مرحلهٔ ۲: نردبان هم‌زمان همهٔ آگهی‌ها (سقف هر لاگین + timeout هر مرحله) با گزارش پیشرفت
+    progress_state = {"message": None}
+    eff_bot = get_bot()
 
-            if result and result[0] == 1:
-                phone_success += 1
-                total_success += 1
-            else:
-                phone_failed += 1
-                total_failed += 1
-                err_msg = result[2] if result and len(result) > 2 else "نامشخص"
-                lines.append(f"   • {token[:8]}...: ❌ {html.escape(err_msg[:100])}")
+    async def _report_progress(done, total, success, failed):
+        if eff_bot is None:
+            return
+        text = f"⏳ تمدید گروهی: {done}/{total} | ✅ {success} | ❌ {failed}"
+        if progress_state["message"] is None:
+            progress_state["message"] = await outbox.submit(
+                BULK, lambda: eff_bot.send_message(chat_id=chatid, text=text)
+            )
+        else:
+            await outbox.submit(BULK, lambda: eff_bot.edit_message_text(
+                chat_id=chatid,
+                message_id=progress_state["message"].message_id,
+                text=text,
+            ))
+
+    results = await promote_tokens_bulk(chatid, jobs, progress=_report_progress) if jobs else []
 
-        lines.append(f"📱 <b>{phone}</b>: ✅ {phone_success} | ❌ {phone_failed}")
+    per_phone = {}
+    for (phone, _, token), result in zip(jobs, results):
+        stats = per_phone.setdefault(phone, {"success": 0, "failed": 0, "errors": []})
+        total_attempted += 1
+        if result and result[0] == 1:
+            stats["success"] += 1
+            total_success += 1
+        else:
+            stats["failed"] += 1
+            total_failed += 1
+            err_msg = result[2] if result and len(result) > 2 else "نامشخص"
+            stats["errors"].append(f"   • {token[:8]}...: ❌ {html.escape(str(err_msg)[:100])}")
+
+    for phone, _, _ in active_logins:
+        if phone_lines.get(phone):
+            lines.extend(phone_lines[phone])
+            lines.append("")
+            continue
+        stats = per_phone.get(phone, {"success": 0, "failed": 0, "errors": []})
+        lines.extend(stats["errors"])
+        # برچسب آگهی‌های تمدیدشده عوض شده؛ گزارش بعدی باید از دیوار تازه خوانده شود
+        invalidate_snapshot(chatid, phone)
+        lines.append(f"📱 <b>{phone}</b>: ✅ {stats['success']} | ❌ {stats['failed']}")
         lines.append("")
 
     lines.append("━━━━━━━━━━━━━━━━")
@@ -1330,6 +1398,7 @@ async def renew_ads_by_status(chatid, heading, fetch_func):
         await bot_send_message(
             chat_id=chatid,
             text=chunk,
+            lane=BULK,
             parse_mode='HTML',
             disable_web_page_preview=True
         )
@@ -1436,6 +1505,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         chat_id=chat_id,
                         text="🤖 ربات آماده است. لطفاً دوباره /start را ارسال کنید.",
                         bot=context.bot,
+                        lane=INTERACTIVE,
                     )
                 except:
                     pass
@@ -1563,15 +1633,7 @@ async def auto_start_nardeban(chatid):
 async def setup_auto_start_job(chatid, start_hour, start_minute=0):
     """تنظیم job برای شروع خودکار در ساعت و دقیقه مشخص شده با در نظر گیری روزهای هفته"""
     try:
-        # حذف job قبلی شروع خودکار (اگر وجود داشته باشد)
-        all_jobs = scheduler.get_jobs() if scheduler else []
-        for job in all_jobs:
-            if job.id and str(job.id) == f"auto_start_{int(chatid)}":
-                try:
-                    scheduler.remove_job(job.id)
-                except:
-                    pass
-        
+        # job قبلی شروع خودکار با replace_existing جایگزین می‌شود (بدون پیمایش همهٔ jobها)
         # دریافت روزهای فعال هفته
         active_weekdays_iran = get_active_weekdays_from_config()
         
@@ -1615,39 +1677,55 @@ async def setup_auto_start_job(chatid, start_hour, start_minute=0):
         import traceback
         traceback.print_exc()
 
+def _next_auto_stop_ts(stop_hour, stop_minute=0):
+    """زمان epoch نوبت بعدی توقف خودکار در روزهای فعال هفته (منطقهٔ تهران) یا None"""
+    trigger = CronTrigger(
+        hour=stop_hour,
+        minute=stop_minute,
+        timezone=TEHRAN_TZ,
+        **_cron_weekday_kwargs_tehran(),
+    )
+    fire_time = trigger.get_next_fire_time(None, now_tehran())
+    return fire_time.timestamp() if fire_time else None
+
+
+def arm_auto_stop(chatid, callback, stop_hour, stop_minute=0):
+    """ثبت نوبت توقف خودکار یک چت در dispatcher مرکزی (جایگزین cronهای auto_stop_{chatid}_*)"""
+    due = _next_auto_stop_ts(stop_hour, stop_minute)
+    if due is None:
+        return False
+    ladder_dispatcher.schedule(chatid, STOP, callback, due)
+    return True
+
+
+def cancel_ladder(chatid):
+    """لغو نوبت‌های نردبان و توقف خودکار یک چت در O(1) و حذف marker جدول jobs"""
+    ladder_dispatcher.cancel(chatid)
+    curd.removeJob(chatid=chatid)
+
+
+async def stop_natural_flow(chatid):
+    """توقف خودکار نوع ۴: فقط یادآوری؛ نوبت برای روز فعال بعدی دوباره ثبت می‌شود"""
+    await bot_send_message(chat_id=chatid, text="🕐 ساعت توقف خودکار رسیده است. لطفاً در صورت نیاز دستی توقف کنید.")
+    stop_time = get_stop_time_from_config()
+    if stop_time and curd.getJob(chatid=chatid):
+        arm_auto_stop(chatid, stop_natural_flow, *stop_time)
+
+
 async def setup_auto_stop_job(chatid, stop_hour, stop_minute=0):
     """
-    بروزرسانی زمان اجرای jobهای توقف خودکار (cron) برای یک chatid.
-    jobها در startNardebanDasti ساخته می‌شوند؛ با تغییر ساعت توقف در تنظیمات باید reschedule شوند.
+    بروزرسانی زمان نوبت توقف خودکار یک chatid در dispatcher.
+    نوبت در startNardebanDasti ساخته می‌شود؛ با تغییر ساعت توقف در تنظیمات باید جابه‌جا شود.
     """
-    if not scheduler:
-        return
     try:
         chatid_int = int(chatid)
-        extras = _cron_weekday_kwargs_tehran()
-        prefix = f"auto_stop_{chatid_int}_"
-        updated = 0
-        for j in scheduler.get_jobs():
-            jid = str(getattr(j, "id", "") or "")
-            if not jid.startswith(prefix):
-                continue
-            trigger = CronTrigger(
-                hour=stop_hour,
-                minute=stop_minute,
-                timezone=TEHRAN_TZ,
-                **extras,
-            )
-            try:
-                scheduler.reschedule_job(j.id, trigger=trigger)
-                updated += 1
-            except Exception as e:
-                print(f"⚠️ setup_auto_stop_job: reschedule {jid} ناموفق: {e}")
-        if updated:
+        due = _next_auto_stop_ts(stop_hour, stop_minute)
+        if due is not None and ladder_dispatcher.reschedule(chatid_int, STOP, due):
             print(
-                f"✅ setup_auto_stop_job: {updated} job توقف برای chatid={chatid_int} → {stop_hour:02d}:{stop_minute:02d}"
+                f"✅ setup_auto_stop_job: توقف chatid={chatid_int} → {stop_hour:02d}:{stop_minute:02d}"
             )
         else:
-            print(f"ℹ️ setup_auto_stop_job: job توقف فعالی برای chatid={chatid_int} یافت نشد (نردبان در جریان نیست)")
+            print(f"ℹ️ setup_auto_stop_job: نوبت توقف فعالی برای chatid={chatid_int} یافت نشد (نردبان در جریان نیست)")
     except Exception as e:
         print(f"❌ setup_auto_stop_job: {e}")
         import traceback
@@ -1655,24 +1733,12 @@ async def setup_auto_stop_job(chatid, stop_hour, stop_minute=0):
 
 
 async def refresh_all_auto_stop_jobs_from_config():
-    """بعد از تغییر روزهای هفته یا ساعت توقف سراسری: همهٔ auto_stopهای ثبت‌شده را با configs هماهنگ کن."""
+    """بعد از تغییر روزهای هفته یا ساعت توقف سراسری: همهٔ نوبت‌های توقف ثبت‌شده را با configs هماهنگ کن."""
     stop_time = get_stop_time_from_config()
     if not stop_time:
         return
     sh, sm = stop_time
-    chat_ids = set()
-    try:
-        for j in scheduler.get_jobs() if scheduler else []:
-            jid = str(getattr(j, "id", "") or "")
-            if not jid.startswith("auto_stop_"):
-                continue
-            rest = jid[len("auto_stop_") :]
-            cid_str = rest.split("_", 1)[0]
-            chat_ids.add(int(cid_str))
-    except Exception as e:
-        print(f"⚠️ refresh_all_auto_stop_jobs_from_config: {e}")
-        return
-    for cid in sorted(chat_ids):
+    for cid in sorted(ladder_dispatcher.chats(STOP)):
         await setup_auto_stop_job(cid, sh, sm)
 
 async def mainMenu(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -2007,8 +2073,46 @@ async def qrycall(update: Update, context: ContextTypes.DEFAULT_TYPE):
             stats_msg += f"   📦 کل استخراج: <b>{stats['total_tokens']}</b>\n"
             stats_msg += f"   ⏳ در انتظار: <b>{stats['total_pending']}</b>\n"
             if stats.get('total_failed', 0) > 0:
-                stats_msg += f"   ❌ ناموفق: <b>{stats['total_failed']}</b>"
-            
+                stats_msg += f"   ❌ ناموفق: <b>{stats['total_failed']}</b>\n"
+
+            # کش پلن‌های هزینه (درخواست‌های costs صرفه‌جویی‌شده)
+            plan_stats = plan_cache_stats()
+            if plan_stats['hits'] or plan_stats['misses']:
+                stats_msg += (
+                    f"\n💳 کش پلن‌ها: ✅ {plan_stats['hits']} | ⬇️ {plan_stats['misses']}"
+                    f" | 🛟 {plan_stats['fallbacks']} ({plan_stats['hit_rate']}%)"
+                )
+
+            # ژورنال تلاش‌های نردبان: p50/p95 هر مرحله و نرخ شکست هر لاگین (پنجرهٔ promotion_rollup_hours)
+            stage_stats = stage_latency_rollup(chatid=chatid)
+            if stage_stats:
+                stats_msg += "\n\n⏱️ <b>زمان مراحل نردبان (p50 / p95):</b>\n"
+                stats_msg += "\n".join(
+                    f"   {stage}: {v['p50']}s / {v['p95']}s ({v['count']}"
+                    + (f"، ❌ {v['failed']}" if v['failed'] else "")
+                    + ")"
+                    for stage, v in stage_stats.items()
+                )
+            login_failures = [r for r in login_failure_rollup(chatid=chatid) if r["failed"]]
+            if login_failures:
+                stats_msg += "\n📉 نرخ شکست لاگین‌ها: " + " | ".join(
+                    f"{r['phone']} {r['failure_rate']}% ({r['failed']}/{r['attempts']})" for r in login_failures[:5]
+                )
+
+            # صف ارسال: تعداد و میانگین انتظار هر خط
+            lane_stats = outbox.stats()
+            if any(v["sent"] for v in lane_stats.values()):
+                stats_msg += "\n🚦 صف ارسال: " + " | ".join(
+                    f"{name} {v['sent']} ({v['avg_wait']}s)" for name, v in lane_stats.items()
+                )
+
+            # اعلان‌های یکی‌شده (تعداد اعلان در برابر پیام واقعی ارسال‌شده)
+            if notifications.coalesced_notices:
+                stats_msg += (
+                    f"\n📨 اعلان‌ها: {notifications.coalesced_notices} اعلان در "
+                    f"{notifications.sent_messages} پیام"
+                )
+
             # ساخت منوی فرعی برای آمار
             stats_menu_buttons = [
                 [InlineKeyboardButton('📋 لیست اگهی‌ها', callback_data='listAds')],
@@ -2150,21 +2254,21 @@ async def qrycall(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         current_part += f"📊 <b>جمع کل: {total_count} اگهی</b>"
                         parts.append(current_part)
                     
-                    # ارسال هر بخش
+                    # ارسال هر بخش (خط bulk تا پاسخ دکمه‌های دیگر عقب نیفتد)
                     for part in parts:
-                        await context.bot.send_message(
+                        await outbox.submit(BULK, lambda part=part: context.bot.send_message(
                             chat_id=chatid,
                             text=part,
                             parse_mode='HTML',
                             disable_web_page_preview=False
-                        )
+                        ))
                 else:
-                    await context.bot.send_message(
+                    await outbox.submit(BULK, lambda: context.bot.send_message(
                         chat_id=chatid,
                         text=message,
                         parse_mode='HTML',
                         disable_web_page_preview=False
-                    )
+                    ))
                 
                 print(f"✅ [listAds] لیست اگهی‌ها برای کاربر {chatid} ارسال شد ({total_count} اگهی)")
             except Exception as e:
@@ -2223,8 +2327,8 @@ async def qrycall(update: Update, context: ContextTypes.DEFAULT_TYPE):
    اجرای بعدی می‌رود سراغ لاگین بعدی تا به همین ترتیب نوبت‌ها بچرخد.
 
 <b>🎢 4️⃣ جریان طبیعی:</b>
-   آگهی‌های قدیمی‌تر اولویت می‌گیرند
-   آگهی‌هایی که بازدید کمتر دارند زودتر نردبان می‌شوند
+   آگهی‌ای که مدت بیشتری است تازه دیده یا نردبان نشده اولویت می‌گیرد
+   آگهی‌هایی که بارها نردبان شده‌اند دیرتر نوبت می‌گیرند
    فاصله زمانی بین نردبان‌ها کاملاً نامنظم است"""
             
             await context.bot.send_message(
@@ -2260,6 +2364,7 @@ async def qrycall(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await qry.answer(text="منو بروزرسانی شد ✅", show_alert=False)
             except Exception as e:
                 print(f"⚠️ [qrycall] خطا در پاسخ به callback query (احتمالاً قدیمی است): {e}")
+            invalidate_menu_model(chatid)
             curd.setStatus(q="scode", v=0, chatid=chatid)
             if qry.message:
                 await send_admin_menu(chat_id=chatid, message_id=qry.message.message_id, bot=context.bot)
@@ -2599,6 +2704,12 @@ async def qrycall(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await send_admin_menu(chat_id=chatid, bot=context.bot)
         elif data.startswith("del"):
             if curd.delLogin(phone=data.split(":")[1], chatid=chatid) == 1:
+                try:
+                    drop_nardeban(chatid, data.split(":")[1])
+                    drop_nardeban_async(chatid, data.split(":")[1])
+                    drop_post_index(chatid, data.split(":")[1])
+                except (TypeError, ValueError):
+                    pass
                 await qry.answer(text="با موفقیت حذف شد")
             else:
                 await qry.answer(text="مشکلی در حذف شدن وحود دارد")
@@ -2717,8 +2828,8 @@ async def qrycall(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
 
             try:
-                n_api = nardeban(apiKey=selected_login[1])
-                plans = n_api.get_cost_plans(token_value)
+                n_api = get_nardeban(chatid, selected_login[0], selected_login[1])
+                plans = n_api.get_cost_plans(token_value, allow_fallback=True)
             except Exception as e:
                 await context.bot.send_message(chat_id=chatid, text=f"❌ خطا در دریافت پلن‌ها: {str(e)}")
                 return
@@ -2906,6 +3017,7 @@ async def qrycall(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     chat_id=chatid,
                     text=txt,
                     bot=context.bot,
+                    lane=INTERACTIVE,
                     reply_markup=keyboard,
                     parse_mode="HTML",
                 )
@@ -2921,41 +3033,8 @@ async def qrycall(update: Update, context: ContextTypes.DEFAULT_TYPE):
             job_id = curd.getJob(chatid=chatid)
             if job_id:
                 try:
-                    # حذف job نردبان
-                    scheduler.remove_job(job_id=job_id)
-                    
-                    # حذف job توقف خودکار مربوطه (اگر وجود داشته باشد)
-                    try:
-                        stop_job_id = f"auto_stop_{chatid}_{job_id}"
-                        scheduler.remove_job(stop_job_id)
-                    except:
-                        pass  # اگر job توقف وجود نداشت، مشکلی نیست
-
-                    # حذف همه jobهای توقف خودکار مربوط به این چت
-                    try:
-                        for j in scheduler.get_jobs():
-                            jid = str(getattr(j, "id", "") or "")
-                            if jid.startswith(f"auto_stop_{chatid}"):
-                                scheduler.remove_job(jid)
-                    except Exception:
-                        pass
-
-                    # پاکسازی jobهای باقیمانده sendNardeban برای این چت
-                    try:
-                        for j in scheduler.get_jobs():
-                            try:
-                                j_args = list(getattr(j, "args", []) or [])
-                                if not j_args or int(j_args[0]) != int(chatid):
-                                    continue
-                                func_ref = str(getattr(j, "func_ref", "") or "")
-                                if "sendNardeban" in func_ref:
-                                    scheduler.remove_job(j.id)
-                            except Exception:
-                                continue
-                    except Exception:
-                        pass
-                    
-                    curd.removeJob(chatid=chatid)
+                    # لغو نوبت نردبان و توقف خودکار این چت در dispatcher مرکزی
+                    cancel_ladder(chatid)
                     refreshUsed(chatid=chatid)
                     txtResult = f"✅ عملیات نردبان با موفقیت متوقف شد."
                 except Exception as e:
@@ -3132,35 +3211,18 @@ async def startNardebanDasti(chatid, end: int):
         await bot_send_message(chat_id=chatid, text="🔄 هیچ اگهی pending از فرایند قبلی یافت نشد. در حال استخراج اولیه...")
         active_logins = [l for l in logins if l[2] == 0]
         if active_logins:
-            for l in active_logins:
-                try:
-                    nardebanAPI = nardeban(apiKey=l[1])
-                    brandToken = nardebanAPI.getBranToken()
-                    
-                    if not brandToken:
-                        await bot_send_message(chat_id=chatid, text=f"❌ خطا در دریافت brand token برای شماره {l[0]}")
-                        continue
-                    
-                    tokens = nardebanAPI.get_all_tokens(brand_token=brandToken)
-                    
-                    if tokens:
-                        new_count = add_tokens_to_json(chatid=chatid, phone=int(l[0]), tokens=tokens)
-                        
-                        if new_count > 0:
-                            existing_tokens = curd.get_tokens_by_phone(phone=int(l[0]))
-                            new_tokens = [t for t in tokens if t not in existing_tokens]
-                            if new_tokens:
-                                curd.insert_tokens_by_phone(phone=int(l[0]), tokens=new_tokens)
-                            
-                            await bot_send_message(chat_id=chatid, text=f"✅ از شماره {l[0]}: {new_count} اگهی استخراج شد.")
-                        else:
-                            await bot_send_message(chat_id=chatid, text=f"ℹ️ از شماره {l[0]}: همه اگهی‌ها قبلاً استخراج شده بودند.")
-                    else:
-                        await bot_send_message(chat_id=chatid, text=f"⚠️ از شماره {l[0]}: هیچ اگهی‌ای یافت نشد.")
-                        
-                except Exception as e:
-                    print(f"Error extracting tokens for phone {l[0]}: {e}")
-                    await bot_send_message(chat_id=chatid, text=f"❌ خطا در استخراج برای شماره {l[0]}: {str(e)}")
+            results = await extract_tokens_parallel(chatid, active_logins)
+            for phone, tokens, new_count, error in results:
+                if error == BRAND_TOKEN_ERROR:
+                    await bot_send_message(chat_id=chatid, text=f"❌ خطا در دریافت brand token برای شماره {phone}")
+                elif error:
+                    await bot_send_message(chat_id=chatid, text=f"❌ خطا در استخراج برای شماره {phone}: {error}")
+                elif not tokens:
+                    await bot_send_message(chat_id=chatid, text=f"⚠️ از شماره {phone}: هیچ اگهی‌ای یافت نشد.")
+                elif new_count > 0:
+                    await bot_send_message(chat_id=chatid, text=f"✅ از شماره {phone}: {new_count} اگهی استخراج شد.")
+                else:
+                    await bot_send_message(chat_id=chatid, text=f"ℹ️ از شماره {phone}: همه اگهی‌ها قبلاً استخراج شده بودند.")
             
             await bot_send_message(chat_id=chatid, text="✅ استخراج اولیه به پایان رسید.")
     
@@ -3168,17 +3230,8 @@ async def startNardebanDasti(chatid, end: int):
     interval_minutes = manageDetails[5] if len(manageDetails) > 5 else 5
     nardeban_type = manageDetails[3] if len(manageDetails) > 3 else 1
     
-    # حذف job توقف خودکار قبلی (اگر وجود داشته باشد) - برای همه انواع
-    try:
-        all_jobs = scheduler.get_jobs() if scheduler else []
-        for existing_job in all_jobs:
-            if existing_job.id and f"auto_stop_{chatid}" in str(existing_job.id):
-                try:
-                    scheduler.remove_job(existing_job.id)
-                except:
-                    pass
-    except Exception as e:
-        print(f"⚠️ خطا در حذف job توقف قبلی: {e}")
+    # لغو نوبت توقف خودکار قبلی (اگر وجود داشته باشد) - برای همه انواع
+    ladder_dispatcher.cancel(chatid, STOP)
     
     # استفاده از ساعت و دقیقه توقف از configs.json یا استفاده از end که از دستور /end آمده
     stop_time_config = get_stop_time_from_config()
@@ -3191,96 +3244,27 @@ async def startNardebanDasti(chatid, end: int):
     if nardeban_type == 4:
         await bot_send_message(chat_id=chatid, text="🎢 نوع نردبان: جریان طبیعی - زمان‌بندی نامنظم فعال است.")
         # marker برای جلوگیری از شروع تکراری در نوع 4
-        curd.addJob(chatid=chatid, job=f"natural_{chatid}")
+        curd.addJob(chatid=chatid, job=f"natural_{chatid}", owner=scheduler_owner)
         
-        # برای نوع 4، یک job توقف خودکار تنظیم می‌کنیم (بدون job interval)
-        # اما باید job_id را از دیتابیس بگیریم یا یک ID موقت بسازیم
-        # در واقع برای نوع 4، job توقف باید job نردبان را متوقف کند
-        # اما چون job interval نداریم، باید یک flag در دیتابیس ذخیره کنیم
-        
-        # ایجاد یک job توقف که فقط یک بار اجرا می‌شود (در ساعت توقف)
-        # این job باید یک flag را تنظیم کند که sendNardeban آن را بررسی کند
-        # یا می‌توانیم job توقف را به گونه‌ای تنظیم کنیم که فقط یک پیام بفرستد
-        
-        # برای سادگی، job توقف را تنظیم می‌کنیم که در ساعت مشخص شده یک پیام بفرستد
-        # و کاربر می‌تواند دستی توقف کند
-        stop_job_id = f"auto_stop_{chatid}_natural"
-        
-        # دریافت روزهای فعال هفته
-        active_weekdays_iran = get_active_weekdays_from_config()
-        active_weekdays_apscheduler = [iran_weekday_to_apscheduler_cron_dow(day) for day in active_weekdays_iran]
-        day_of_week_expr = ",".join(str(d) for d in sorted(active_weekdays_apscheduler))
-        
-        async def stop_natural_flow(chatid):
-            """تابع برای توقف جریان طبیعی"""
-            await bot_send_message(chat_id=chatid, text="🕐 ساعت توقف خودکار رسیده است. لطفاً در صورت نیاز دستی توقف کنید.")
-        
-        if len(active_weekdays_apscheduler) == 7:
-            scheduler.add_job(
-                stop_natural_flow,
-                trigger="cron",
-                args=[chatid],
-                hour=final_stop_hour,
-                minute=final_stop_minute,
-                timezone=TEHRAN_TZ,
-                id=stop_job_id,
-                replace_existing=True
-            )
-        else:
-            scheduler.add_job(
-                stop_natural_flow,
-                trigger="cron",
-                args=[chatid],
-                hour=final_stop_hour,
-                minute=final_stop_minute,
-                day_of_week=day_of_week_expr,
-                timezone=TEHRAN_TZ,
-                id=stop_job_id,
-                replace_existing=True
-            )
+        # نوع ۴ نوبت تکراری ندارد؛ توقف خودکار فقط یادآوری می‌فرستد (stop_natural_flow)
+        arm_auto_stop(chatid, stop_natural_flow, final_stop_hour, final_stop_minute)
         
         await bot_send_message(chat_id=chatid, text=f"🕐 توقف خودکار در ساعت {final_stop_hour:02d}:{final_stop_minute:02d} تنظیم شد.")
         await sendNardeban(chatid)
     else:
         await bot_send_message(chat_id=chatid, text=f"⏱️ فاصله بین نردبان‌ها: {str(interval_minutes)} دقیقه")
         
-        # ایجاد job نردبان
-        job = scheduler.add_job(sendNardeban, "interval", args=[chatid], minutes=interval_minutes)
-        curd.addJob(chatid=chatid, job=job.id)
-        
-        # ایجاد job توقف خودکار با ID منحصر به فرد
-        stop_job_id = f"auto_stop_{chatid}_{job.id}"
-        
-        # دریافت روزهای فعال هفته برای job توقف (باید در همان روزهایی که شروع فعال است، توقف هم فعال باشد)
-        active_weekdays_iran = get_active_weekdays_from_config()
-        active_weekdays_apscheduler = [iran_weekday_to_apscheduler_cron_dow(day) for day in active_weekdays_iran]
-        day_of_week_expr = ",".join(str(d) for d in sorted(active_weekdays_apscheduler))
+        # ثبت نوبت تکراری نردبان در dispatcher مرکزی؛ marker جدول jobs برای جلوگیری از شروع تکراری
+        interval_seconds = int(interval_minutes) * 60
+        entry = ladder_dispatcher.schedule(
+            chatid, LADDER, sendNardeban,
+            due=time.time() + interval_seconds,
+            interval=interval_seconds,
+        )
+        curd.addJob(chatid=chatid, job=f"ladder_{chatid}", owner=scheduler_owner, next_run=entry.due)
         
-        # اگر همه روزها فعال هستند، day_of_week را تنظیم نکنیم
-        if len(active_weekdays_apscheduler) == 7:
-            scheduler.add_job(
-                remJob,
-                trigger="cron",
-                args=[scheduler, job.id, chatid],
-                hour=final_stop_hour,
-                minute=final_stop_minute,
-                timezone=TEHRAN_TZ,
-                id=stop_job_id,
-                replace_existing=True
-            )
-        else:
-            # توقف فقط در روزهایی که شروع فعال است
-            scheduler.add_job(
-                remJob,
-                trigger="cron",
-                args=[scheduler, job.id, chatid],
-                hour=final_stop_hour,
-                minute=final_stop_minute,
-                day_of_week=day_of_week_expr,
-                timezone=TEHRAN_TZ,
-                id=stop_job_id,
-                replace_existing=True
-            )
+        # توقف خودکار (فقط در روزهای فعال هفته)
+        arm_auto_stop(chatid, remJob, final_stop_hour, final_stop_minute)
         
         await bot_send_message(chat_id=chatid, text=f"🕐 توقف خودکار در ساعت {final_stop_hour:02d}:{final_stop_minute:02d} تنظیم شد.")
         
@@ -3303,22 +3287,10 @@ def shouldExtractTokens(chatid, available_logins):
         if has_pending:
             return False
         
-        # بررسی وجود توکن‌ها در JSON
-        tokens_data = load_tokens_json()
-        if chatid not in tokens_data:
-            # اولین بار - هیچ توکنی وجود ندارد
-            print(f"ℹ️ [shouldExtractTokens] اولین استخراج برای chatid={chatid}")
-            return True
-        
-        # شمارش توکن‌های موجود
-        total_tokens = 0
-        for phone_data in tokens_data[chatid].values():
-            if isinstance(phone_data, dict):
-                total_tokens += len(phone_data.get("pending", []))
-                total_tokens += len(phone_data.get("success", []))
-                total_tokens += len(phone_data.get("failed", []))
+        # شمارش توکن‌های موجود (یک کوئری تجمیعی، بدون بارگذاری همهٔ توکن‌ها)
+        total_tokens = get_token_stats(chatid=chatid).get("total", 0)
         
-        # اگر هیچ توکنی وجود ندارد، استخراج کن
+        # اگر هیچ توکنی وجود ندارد (اولین بار یا پس از ریست)، استخراج کن
         if total_tokens == 0:
             print(f"ℹ️ [shouldExtractTokens] هیچ توکنی در JSON وجود ندارد، استخراج انجام می‌شود")
             return True
@@ -3332,6 +3304,26 @@ def shouldExtractTokens(chatid, available_logins):
         print(f"Error in shouldExtractTokens: {e}")
         return False
 
+async def extract_tokens_parallel(chatid, logins, *, exclude=None):
+    """
+    استخراج موازی آگهی‌های چند لاگین (سقف extract_concurrency و محدودیت نرخ هر host)
+    و ذخیرهٔ یکجای نتایج در token_states و جدول tokens.
+    خروجی به ترتیب logins: [(phone, tokens یا None, new_count, error یا None), ...]
+    """
+    results = await fetch_tokens_for_logins(chatid, logins)
+    batch = {}
+    for phone, tokens, error in results:
+        if not tokens:
+            continue
+        fresh = [t for t in tokens if t not in exclude] if exclude is not None else tokens
+        if fresh:
+            batch[int(phone)] = fresh
+    new_counts = add_tokens_batch(chatid, batch) if batch else {}
+    # همچنین در دیتابیس هم ذخیره کن (برای سازگاری) — فقط شماره‌هایی که توکن جدید داشتند
+    curd.insert_tokens_batch({phone: tokens for phone, tokens in batch.items() if new_counts.get(phone)})
+    return [(phone, tokens, new_counts.get(int(phone), 0), error) for phone, tokens, error in results]
+
+
 async def extractTokensIfNeeded(chatid, available_logins, *, after_reset=False):
     """استخراج توکن‌ها وقتی shouldExtractTokens True باشد (اولین بار، JSON خالی، یا پس از ریست کامل)."""
     try:
@@ -3350,59 +3342,27 @@ async def extractTokensIfNeeded(chatid, available_logins, *, after_reset=False):
                 text="📥 در حال دریافت / به‌روزرسانی لیست آگهی‌ها از دیوار...",
             )
         
-        # بهینه‌سازی: یک بار بارگذاری همه توکن‌های موجود از JSON
-        tokens_data = load_tokens_json()
-        all_existing_tokens = set()
-        if chatid in tokens_data:
-            for phone_data in tokens_data[chatid].values():
-                if isinstance(phone_data, dict):
-                    all_existing_tokens.update(phone_data.get("pending", []))
-                    all_existing_tokens.update(phone_data.get("success", []))
-                    all_existing_tokens.update(phone_data.get("failed", []))
+        # بهینه‌سازی: یک بار خواندن همه توکن‌های موجود همین chatid
+        all_existing_tokens = get_chat_token_set(chatid)
         
         # جمع‌آوری پیام‌ها برای ارسال یکجا
         messages = []
         total_extracted = 0
         
-        for l in available_logins:
-            try:
-                nardebanAPI = nardeban(apiKey=l[1])
-                brandToken = nardebanAPI.getBranToken()
-                
-                if not brandToken:
-                    messages.append(f"❌ شماره {l[0]}: خطا در دریافت brand token")
-                    continue
-                
-                # استخراج توکن‌های جدید
-                tokens = nardebanAPI.get_all_tokens(brand_token=brandToken)
-                
-                if tokens:
-                    # فیلتر کردن توکن‌های جدید (بهینه‌سازی: استفاده از set)
-                    new_tokens = [t for t in tokens if t not in all_existing_tokens]
-                    
-                    if new_tokens:
-                        # ذخیره توکن‌ها در JSON
-                        new_count = add_tokens_to_json(chatid=chatid, phone=int(l[0]), tokens=new_tokens)
-                        
-                        if new_count > 0:
-                            # به‌روزرسانی set برای بررسی سریع‌تر در آینده
-                            all_existing_tokens.update(new_tokens)
-                            
-                            # همچنین در دیتابیس هم ذخیره کن (برای سازگاری)
-                            curd.insert_tokens_by_phone(phone=int(l[0]), tokens=new_tokens)
-                            
-                            total_extracted += new_count
-                            messages.append(f"✅ شماره {l[0]}: {new_count} اگهی جدید")
-                        else:
-                            messages.append(f"ℹ️ شماره {l[0]}: همه اگهی‌ها قبلاً استخراج شده بودند")
-                    else:
-                        messages.append(f"ℹ️ شماره {l[0]}: همه اگهی‌ها قبلاً استخراج شده بودند")
-                else:
-                    messages.append(f"⚠️ شماره {l[0]}: هیچ اگهی‌ای یافت نشد")
-                    
-            except Exception as e:
-                print(f"Error extracting tokens for phone {l[0]}: {e}")
-                messages.append(f"❌ شماره {l[0]}: خطا - {str(e)[:50]}")
+        # استخراج موازی همهٔ لاگین‌ها و ذخیرهٔ یکجا (فقط توکن‌هایی که در store نیستند)
+        results = await extract_tokens_parallel(chatid, available_logins, exclude=all_existing_tokens)
+        for phone, tokens, new_count, error in results:
+            if error == BRAND_TOKEN_ERROR:
+                messages.append(f"❌ شماره {phone}: خطا در دریافت brand token")
+            elif error:
+                messages.append(f"❌ شماره {phone}: خطا - {error[:50]}")
+            elif not tokens:
+                messages.append(f"⚠️ شماره {phone}: هیچ اگهی‌ای یافت نشد")
+            elif new_count > 0:
+                total_extracted += new_count
+                messages.append(f"✅ شماره {phone}: {new_count} اگهی جدید")
+            else:
+                messages.append(f"ℹ️ شماره {phone}: همه اگهی‌ها قبلاً استخراج شده بودند")
         
         # ارسال پیام‌های جمع‌آوری شده
         if messages:
@@ -3438,11 +3398,11 @@ async def reset_and_extract_for_single_login(chatid, login_info):
     """
     phone = int(login_info[0])
     try:
-        nardebanAPI = nardeban(apiKey=login_info[1])
-        brand_token = nardebanAPI.getBranToken()
+        nardebanAPI = get_nardeban_async(chatid, login_info[0], login_info[1])
+        brand_token = await nardebanAPI.getBranToken()
         if not brand_token:
-            await bot_send_message(
-                chat_id=chatid,
+            await notify_chat(
+                chatid,
                 text=(
                     f"❌ شماره {phone}: دریافت brand token ناموفق بود؛ "
                     f"آگهی‌های فعلی در صف حفظ شدند. بعداً دوباره امتحان کنید."
@@ -3450,13 +3410,13 @@ async def reset_and_extract_for_single_login(chatid, login_info):
             )
             return
 
-        tokens = nardebanAPI.get_all_tokens(brand_token=brand_token)
+        tokens = await nardebanAPI.get_all_tokens(brand_token=brand_token)
         if tokens is None:
             tokens = []
     except Exception as e:
         print(f"Error in reset_and_extract_for_single_login pre-fetch ({phone}): {e}")
-        await bot_send_message(
-            chat_id=chatid,
+        await notify_chat(
+            chatid,
             text=(
                 f"❌ شماره {phone}: خطا قبل از ریست چرخه ({str(e)[:120]}). "
                 f"دادهٔ آگهی‌های شما دست‌نخورده ماند."
@@ -3467,8 +3427,8 @@ async def reset_and_extract_for_single_login(chatid, login_info):
     try:
         ok, removed_tokens = reset_tokens_for_phone(chatid=chatid, phone=phone)
         if not ok:
-            await bot_send_message(
-                chat_id=chatid,
+            await notify_chat(
+                chatid,
                 text=f"❌ شماره {phone}: ریست دادهٔ آگهی در JSON انجام نشد.",
             )
             return
@@ -3476,8 +3436,8 @@ async def reset_and_extract_for_single_login(chatid, login_info):
         curd.delete_tokens_by_phone(phone=phone)
         curd.reset_nardeban_count(phone=phone, chatid=chatid)
         if not tokens:
-            await bot_send_message(
-                chat_id=chatid,
+            await notify_chat(
+                chatid,
                 text=(
                     f"♻️ شماره {phone}: چرخهٔ آگهی‌ها ریست شد؛ "
                     f"در پاسخ دیوار فعلاً آگهی فعالی برای این اکانت برنگردانده شد."
@@ -3492,8 +3452,8 @@ async def reset_and_extract_for_single_login(chatid, login_info):
         )
     except Exception as e:
         print(f"Error in reset_and_extract_for_single_login ({phone}): {e}")
-        await bot_send_message(
-            chat_id=chatid,
+        await notify_chat(
+            chatid,
             text=f"❌ خطا در ریست و استخراج مجدد شماره {phone}: {str(e)}",
         )
 
@@ -3515,30 +3475,30 @@ async def extract_tokens_for_single_login(
         if prefetched_tokens is not None:
             tokens = list(prefetched_tokens)
         else:
-            nardebanAPI = nardeban(apiKey=login_info[1])
-            brand_token = nardebanAPI.getBranToken()
+            nardebanAPI = get_nardeban_async(chatid, login_info[0], login_info[1])
+            brand_token = await nardebanAPI.getBranToken()
             if not brand_token:
-                await bot_send_message(
-                    chat_id=chatid,
+                await notify_chat(
+                    chatid,
                     text=f"❌ شماره {phone}: خطا در دریافت brand token برای استخراج تکی",
                 )
                 return
-            tokens = nardebanAPI.get_all_tokens(brand_token=brand_token)
+            tokens = await nardebanAPI.get_all_tokens(brand_token=brand_token)
             if tokens is None:
                 tokens = []
 
         if not tokens:
             if after_cycle_reset:
-                await bot_send_message(
-                    chat_id=chatid,
+                await notify_chat(
+                    chatid,
                     text=(
                         f"♻️ شماره {phone}: چرخهٔ آگهی‌ها ریست شد؛ "
                         f"در پاسخ دیوار فعلاً آگهی فعالی برای این اکانت برنگردانده شد."
                     ),
                 )
             else:
-                await bot_send_message(
-                    chat_id=chatid,
+                await notify_chat(
+                    chatid,
                     text=f"ℹ️ شماره {phone}: آگهی جدیدی برای استخراج یافت نشد.",
                 )
             return
@@ -3552,39 +3512,39 @@ async def extract_tokens_for_single_login(
 
         if after_cycle_reset:
             if new_count > 0:
-                await bot_send_message(
-                    chat_id=chatid,
+                await notify_chat(
+                    chatid,
                     text=(
                         f"♻️ شماره {phone}: پس از اتمام چرخه، داده ریست شد و "
                         f"{new_count} آگهی دوباره به صف pending اضافه شد."
                     ),
                 )
             else:
-                await bot_send_message(
-                    chat_id=chatid,
+                await notify_chat(
+                    chatid,
                     text=(
                         f"♻️ شماره {phone}: چرخه ریست شد؛ همهٔ توکن‌های برگشتی از دیوار "
                         f"قبلاً در JSON ثبت شده بودند و ردیف جدیدی اضافه نشد."
                     ),
                 )
         elif new_count > 0:
-            await bot_send_message(
-                chat_id=chatid,
+            await notify_chat(
+                chatid,
                 text=(
                     f"🔄 شماره {phone}: pending این لاگین تمام شد و بلافاصله "
                     f"{new_count} آگهی جدید استخراج شد."
                 ),
             )
         else:
-            await bot_send_message(
-                chat_id=chatid,
+            await notify_chat(
+                chatid,
                 text=(
                     f"ℹ️ شماره {phone}: pending تمام شد اما آگهی جدیدی نسبت به قبل اضافه نشد."
                 ),
             )
     except Exception as e:
         print(f"Error in extract_tokens_for_single_login ({phone}): {e}")
-        await bot_send_message(chat_id=chatid, text=f"❌ خطا در استخراج تکی شماره {phone}: {str(e)}")
+        await notify_chat(chatid, text=f"❌ خطا در استخراج تکی شماره {phone}: {str(e)}")
 
 async def trigger_extract_if_done(chatid):
     """اگر pending سراسری نباشد، برای هر لاگینی که هنوز success/failed دارد ریست و استخراج مجزا انجام می‌شود."""
@@ -3616,17 +3576,9 @@ def are_all_ads_processed(chatid):
         if has_pending:
             return False
         
-        # بررسی وجود اگهی‌های پردازش شده
-        tokens_data = load_tokens_json()
-        if chatid not in tokens_data:
-            return False
-        
         # شمارش اگهی‌های پردازش شده
-        total_processed = 0
-        for phone_data in tokens_data[chatid].values():
-            if isinstance(phone_data, dict):
-                total_processed += len(phone_data.get("success", []))
-                total_processed += len(phone_data.get("failed", []))
+        stats = get_token_stats(chatid=chatid)
+        total_processed = stats.get("success", 0) + stats.get("failed", 0)
         
         # اگر حداقل یک اگهی پردازش شده باشد و هیچ pending نباشد
         return total_processed > 0
@@ -3649,19 +3601,14 @@ async def auto_reset_and_extract_if_all_done(chatid):
             return False
         
         # شمارش اگهی‌های پردازش شده برای نمایش
-        tokens_data = load_tokens_json()
-        total_processed = 0
-        if chatid in tokens_data:
-            for phone_data in tokens_data[chatid].values():
-                if isinstance(phone_data, dict):
-                    total_processed += len(phone_data.get("success", []))
-                    total_processed += len(phone_data.get("failed", []))
+        stats = get_token_stats(chatid=chatid)
+        total_processed = stats.get("success", 0) + stats.get("failed", 0)
         
         print(f"✅ [auto_reset] همه اگهی‌ها ({total_processed}) پردازش شده‌اند. شروع ریست و استخراج مجدد...")
         
         # ارسال پیام اطلاع‌رسانی
-        await bot_send_message(
-            chat_id=chatid, 
+        await notify_chat(
+            chatid,
             text=f"🔄 <b>ریست خودکار اگهی‌ها</b>\n\n"
                  f"✅ همه اگهی‌ها ({total_processed}) پردازش شدند\n"
                  f"🔄 در حال ریست فایل اگهی‌ها و استخراج مجدد...",
@@ -3672,7 +3619,7 @@ async def auto_reset_and_extract_if_all_done(chatid):
         reset_success = reset_tokens_for_chat(chatid)
         if not reset_success:
             print(f"❌ [auto_reset] خطا در ریست توکن‌ها از JSON")
-            await bot_send_message(chat_id=chatid, text="❌ خطا در ریست فایل اگهی‌ها")
+            await notify_chat(chatid, text="❌ خطا در ریست فایل اگهی‌ها")
             return False
         
         # حذف توکن‌ها از دیتابیس نیز
@@ -3695,8 +3642,8 @@ async def auto_reset_and_extract_if_all_done(chatid):
             await extractTokensIfNeeded(chatid, logins, after_reset=True)
             # شمارندهٔ used همین‌جا با refreshUsed صفر شده؛ نیازی به reset تکراری per-phone نیست
             
-            await bot_send_message(
-                chat_id=chatid, 
+            await notify_chat(
+                chatid,
                 text="✅ <b>ریست و استخراج مجدد با موفقیت انجام شد</b>\n\n"
                      "🎯 اگهی‌های جدید آماده نردبان هستند\n"
                      "♻️ شمارندهٔ نردبان همهٔ لاگین‌ها صفر شد",
@@ -3704,14 +3651,14 @@ async def auto_reset_and_extract_if_all_done(chatid):
             )
             return True
         else:
-            await bot_send_message(chat_id=chatid, text="⚠️ هیچ لاگین فعالی برای استخراج مجدد یافت نشد")
+            await notify_chat(chatid, text="⚠️ هیچ لاگین فعالی برای استخراج مجدد یافت نشد")
             return False
             
     except Exception as e:
         print(f"❌ [auto_reset] خطا در auto_reset_and_extract_if_all_done: {e}")
         import traceback
         traceback.print_exc()
-        await bot_send_message(chat_id=chatid, text=f"❌ خطا در ریست خودکار: {str(e)}")
+        await notify_chat(chatid, text=f"❌ خطا در ریست خودکار: {str(e)}")
         return False
 
 async def sendNardeban(chatid):
@@ -3720,6 +3667,7 @@ async def sendNardeban(chatid):
         # این حالت مخصوصاً برای نردبان نوع 4 مهم است که jobهای date جانبی ایجاد می‌کند.
         current_job_id = curd.getJob(chatid=chatid)
         if not current_job_id:
+            ladder_dispatcher.cancel(chatid, LADDER)
             return
 
         logins = curd.getCookies(chatid=chatid)  # 0 : Phone , 1:Cookie , 2 : used
@@ -3735,6 +3683,10 @@ async def sendNardeban(chatid):
         # فیلتر کردن لاگین‌هایی که:
         # 1. به سقف نرسیده‌اند (l[2] < climit)، یا
         # 2. اگهی pending دارند (حتی اگر به سقف رسیده باشند)
+        # تعداد pending همهٔ شماره‌ها با یک کوئری خوانده می‌شود (نه یک بار به ازای هر لاگین)
+        pending_counts = get_pending_counts(chatid)
+        # نسخهٔ token_store_meta نمایهٔ درون‌حافظه‌ای pending را با نوشتن‌های پروسه‌های دیگر هم‌خوان نگه می‌دارد
+        reconcile_pending_index(chatid)
         available_logins = []
         for l in logins:
             # بررسی اینکه آیا به سقف نرسیده است
@@ -3743,9 +3695,8 @@ async def sendNardeban(chatid):
             # بررسی اینکه آیا اگهی pending دارد
             has_pending = False
             try:
-                pending_tokens = get_tokens_from_json(chatid=chatid, phone=int(l[0]), status="pending")
-                has_pending = len(pending_tokens) > 0
-            except:
+                has_pending = pending_counts.get(int(l[0]), 0) > 0
+            except (TypeError, ValueError):
                 pass
             
             # اگر به سقف نرسیده یا اگهی pending دارد، در دسترس است
@@ -3775,14 +3726,20 @@ async def sendNardeban(chatid):
         # رفتار: هر لاگین → همه آگهی‌هاش کامل نردبان می‌شود → بعد لاگین بعدی
         # در هر اجرا فقط یک نردبان انجام می‌شود (از آخرین توکن pending)
         if nardeban_type == 1:
+            attempted = False
             for l in available_logins:
+                # قدیمی‌ترین توکن pending همین شماره از نمایه (بدون کوئری)
+                token = pick_oldest_token(chatid, l[0])
+                if not token:
+                    continue
+                attempted = True
                 try:
-                    nardebanAPI = nardeban(apiKey=l[1])
-                    # sendNardeban از آخر لیست توکن‌ها شروع می‌کند و اولین توکن pending را پیدا می‌کند
+                    nardebanAPI = get_nardeban_async(chatid, l[0], l[1])
                     # استخراج خودکار در ابتدای فرایند حذف شد - فقط زمانی استخراج می‌شود که همه اگهی‌ها نردبان شده باشند
-                    result = nardebanAPI.sendNardeban(
+                    result = await nardebanAPI.sendNardebanWithToken(
                         number=int(l[0]),
                         chatid=chatid,
+                        token=token,
                         priority_1=cost_priority_1,
                         priority_2=cost_priority_2,
                     )
@@ -3795,20 +3752,21 @@ async def sendNardeban(chatid):
                 except Exception as e:
                     print(f"Error in nardeban process for phone {l[0]}: {e}")
                     await bot_send_message(chat_id=chatid, text=f"خطا در فرآیند نردبان برای شماره {l[0]}: {str(e)}")
+            if not attempted:
+                await bot_send_message(chat_id=chatid, text="⚠️ هیچ اگهی pending برای نردبان وجود ندارد.")
         
         # نوع 2: تصادفی
         # رفتار: در هر بار اجرای ربات، یک آگهی کاملاً تصادفی از بین همه لاگین‌ها انتخاب و نردبان می‌شود
         elif nardeban_type == 2:
-            # دریافت تمام توکن‌های pending از JSON
-            all_pending = get_all_pending_tokens_from_json(chatid=chatid)
+            # انتخاب تصادفی یکنواخت یک توکن از بین همه توکن‌های pending (از نمایه، O(1))
+            picked = pick_random_token(chatid)
             
-            if not all_pending:
+            if not picked:
                 # اگر توکن pending وجود نداشت
                 await bot_send_message(chat_id=chatid, text="⚠️ هیچ اگهی pending برای نردبان وجود ندارد.")
                 return
             
-            # انتخاب تصادفی یک توکن از بین همه توکن‌های pending
-            selected_phone, selected_token = random.choice(all_pending)
+            selected_phone, selected_token = picked
             
             # پیدا کردن لاگین مربوطه
             selected_login = next((l for l in available_logins if str(l[0]) == str(selected_phone)), None)
@@ -3817,8 +3775,8 @@ async def sendNardeban(chatid):
                 return
             
             try:
-                nardebanAPI = nardeban(apiKey=selected_login[1])
-                result = nardebanAPI.sendNardebanWithToken(
+                nardebanAPI = get_nardeban_async(chatid, selected_login[0], selected_login[1])
+                result = await nardebanAPI.sendNardebanWithToken(
                     number=int(selected_phone),
                     chatid=chatid,
                     token=selected_token,
@@ -3834,111 +3792,58 @@ async def sendNardeban(chatid):
         # رفتار: در هر اجرای sendNardeban فقط یک لاگین در نوبت بررسی و از همان حداکثر یک آگهی pending نردبان می‌شود.
         # اجرای بعدی از لاگین بعدی ادامه می‌یابد.
         elif nardeban_type == 3:
-            phones_order = list(available_logins)
-            if not phones_order:
+            if not available_logins:
                 await bot_send_message(chat_id=chatid, text="⚠️ هیچ لاگین در دسترسی برای نوبتی وجود ندارد.")
                 return
 
+            # شمارهٔ بعدی دارای pending پس از مکان‌نمای نوبتی نمایه؛ ستون last_round_robin_phone فقط برای شروع پس از ری‌استارت
             last_used_phone = manageDetails[4] if len(manageDetails) > 4 and manageDetails[4] is not None else None
-            start_index = 0
-            if last_used_phone is not None:
-                for i, l in enumerate(phones_order):
-                    if str(l[0]) == str(last_used_phone):
-                        start_index = (i + 1) % len(phones_order)
-                        break
-
-            for step in range(len(phones_order)):
-                idx = (start_index + step) % len(phones_order)
-                phone_ref = phones_order[idx][0]
-
-                fresh_rows = curd.getCookies(chatid=chatid) or []
-                l_cur = next((x for x in fresh_rows if str(x[0]) == str(phone_ref)), None)
-                if not l_cur:
-                    continue
-
-                under_limit = climit == 0 or int(l_cur[2]) < int(climit)
-                tokens_from_json = get_tokens_from_json(chatid=chatid, phone=int(l_cur[0]), status="pending")
-                if not tokens_from_json:
-                    continue
-                if not under_limit:
-                    # در available به‌خاطر pending مانده؛ یک تلاش برای خالی کردن صف همان شماره
-                    pass
-
-                token = tokens_from_json[0]
-                try:
-                    nardebanAPI = nardeban(apiKey=l_cur[1])
-                    result = nardebanAPI.sendNardebanWithToken(
-                        number=int(l_cur[0]),
-                        chatid=chatid,
-                        token=token,
-                        priority_1=cost_priority_1,
-                        priority_2=cost_priority_2,
-                    )
-                    await handleNardebanResult(result, l_cur, chatid, nardebanAPI)
-                except Exception as e:
-                    print(f"Error in round-robin nardeban: {e}")
-                    await bot_send_message(
-                        chat_id=chatid,
-                        text=f"خطا در نردبان نوبتی ({l_cur[0]}): {str(e)}",
-                    )
-                curd.setStatusManage(q="last_round_robin_phone", v=int(l_cur[0]), chatid=chatid)
+            picked = pick_round_robin_token(chatid, [l[0] for l in available_logins], last_phone=last_used_phone)
+            if not picked:
+                await bot_send_message(
+                    chat_id=chatid,
+                    text="⚠️ هیچ اگهی pending برای نردبان نوبتی یافت نشد.",
+                )
                 return
 
-            await bot_send_message(
-                chat_id=chatid,
-                text="⚠️ هیچ اگهی pending برای نردبان نوبتی یافت نشد.",
-            )
+            phone_ref, token = picked
+            l_cur = _login_row_for_phone(available_logins, phone_ref)
+            try:
+                nardebanAPI = get_nardeban_async(chatid, l_cur[0], l_cur[1])
+                result = await nardebanAPI.sendNardebanWithToken(
+                    number=int(l_cur[0]),
+                    chatid=chatid,
+                    token=token,
+                    priority_1=cost_priority_1,
+                    priority_2=cost_priority_2,
+                )
+                await handleNardebanResult(result, l_cur, chatid, nardebanAPI)
+            except Exception as e:
+                print(f"Error in round-robin nardeban: {e}")
+                await bot_send_message(
+                    chat_id=chatid,
+                    text=f"خطا در نردبان نوبتی ({l_cur[0]}): {str(e)}",
+                )
+            curd.setStatusManage(q="last_round_robin_phone", v=int(l_cur[0]), chatid=chatid)
         
         # نوع 4: جریان طبیعی (Natural Flow)
-        # رفتار: آگهی‌های قدیمی‌تر اولویت می‌گیرند، آگهی‌هایی که بازدید کمتر دارند زودتر نردبان می‌شوند
+        # رفتار: آگهی‌هایی که مدت بیشتری از انتشار/آخرین نردبانشان گذشته و کمتر نردبان شده‌اند اولویت می‌گیرند
         # فاصله زمانی بین نردبان‌ها کاملاً نامنظم است (3 تا 15 دقیقه)
         elif nardeban_type == 4:
-            # دریافت تمام توکن‌های pending از JSON
-            all_pending = get_all_pending_tokens_from_json(chatid=chatid)
+            # انتخاب از heap اولویت روی فرادادهٔ token_meta (natural_flow_key)
+            picked = pick_natural_flow_token(chatid, [l[0] for l in available_logins])
             
-            if not all_pending:
+            if not picked:
                 # اگر توکن pending وجود نداشت
                 await bot_send_message(chat_id=chatid, text="⚠️ هیچ اگهی pending برای نردبان وجود ندارد.")
                 return
             
-            # انتخاب آگهی بر اساس اولویت:
-            # 1. آگهی‌های قدیمی‌تر (اولین توکن‌های pending = قدیمی‌تر)
-            # 2. آگهی‌هایی که بازدید کمتر دارند (فرض: توکن‌های قدیمی‌تر = بازدید کمتر)
-            
-            # گروه‌بندی بر اساس شماره تلفن
-            tokens_by_phone = {}
-            for phone, token in all_pending:
-                if phone not in tokens_by_phone:
-                    tokens_by_phone[phone] = []
-                tokens_by_phone[phone].append(token)
-            
-            # انتخاب قدیمی‌ترین توکن از هر لاگین (اولین توکن در لیست = قدیمی‌ترین)
-            # توجه: get_pending_tokens_by_phone توکن‌ها را به ترتیب ذخیره‌سازی برمی‌گرداند
-            # که معمولاً قدیمی‌ترین توکن‌ها اول هستند
-            selected_candidates = []
-            for phone, tokens in tokens_by_phone.items():
-                if tokens:
-                    # اولین توکن = قدیمی‌ترین (فرض: ترتیب ذخیره‌سازی حفظ شده)
-                    selected_candidates.append((phone, tokens[0]))
-            
-            if not selected_candidates:
-                await bot_send_message(chat_id=chatid, text="⚠️ هیچ آگهی مناسب برای نردبان یافت نشد.")
-                return
-            
-            # انتخاب قدیمی‌ترین آگهی از بین همه لاگین‌ها
-            # از اولین کاندیدا استفاده می‌کنیم (قدیمی‌ترین توکن از اولین لاگین)
-            # برای طبیعی‌تر شدن، می‌توان از بین چند کاندیدای اول انتخاب تصادفی کرد
-            selected_phone, selected_token = selected_candidates[0]
-            
-            # پیدا کردن لاگین مربوطه
-            selected_login = next((l for l in available_logins if str(l[0]) == str(selected_phone)), None)
-            if not selected_login:
-                await bot_send_message(chat_id=chatid, text=f"لاگین برای شماره {selected_phone} یافت نشد.")
-                return
+            selected_phone, selected_token = picked
+            selected_login = _login_row_for_phone(available_logins, selected_phone)
             
             try:
-                nardebanAPI = nardeban(apiKey=selected_login[1])
-                result = nardebanAPI.sendNardebanWithToken(
+                nardebanAPI = get_nardeban_async(chatid, selected_login[0], selected_login[1])
+                result = await nardebanAPI.sendNardebanWithToken(
                     number=int(selected_phone),
                     chatid=chatid,
                     token=selected_token,
@@ -3951,17 +3856,12 @@ async def sendNardeban(chatid):
                 if success:
                     # زمان‌بندی نامنظم: بین 3 تا 15 دقیقه
                     next_interval = random.randint(3, 15)
-                    # برنامه‌ریزی برای نردبان بعدی با فاصله نامنظم
-                    # استفاده از scheduler global
-                    global scheduler
-                    scheduler.add_job(
-                        sendNardeban,
-                        "date",
-                        args=[chatid],
-                        run_date=now_tehran() + timedelta(minutes=next_interval)
+                    # برنامه‌ریزی برای نردبان بعدی با فاصله نامنظم (نوبت یک‌باره در dispatcher)
+                    ladder_dispatcher.schedule(
+                        chatid, LADDER, sendNardeban,
+                        due=time.time() + next_interval * 60,
                     )
-                    await bot_send_message(chat_id=chatid, 
-                                     text=f"⏰ نردبان بعدی در {next_interval} دقیقه انجام می‌شود.")
+                    await notify_chat(chatid, text=f"⏰ نردبان بعدی در {next_interval} دقیقه انجام می‌شود.")
             except Exception as e:
                 print(f"Error in natural flow nardeban: {e}")
                 await bot_send_message(chat_id=chatid, text=f"خطا در نردبان جریان طبیعی: {str(e)}")
@@ -3986,8 +3886,7 @@ async def handleNardebanResult(result, login_info, chatid, nardebanAPI):
             if updated:
                 print(f"✅ توکن {token} به وضعیت success تغییر یافت (نردبان موفق)")
                 
-                remaining_pending = has_pending_tokens_in_json(chatid=chatid)
-                if not remaining_pending:
+                if not pending_count(chatid):
                     print(f"🎯 [handleNardebanResult] هیچ pending در هیچ لاگینی باقی نمانده (chatid={chatid})")
             else:
                 print(f"⚠️ توکن {token} در JSON یافت نشد یا به‌روزرسانی نشد")
@@ -4001,24 +3900,21 @@ async def handleNardebanResult(result, login_info, chatid, nardebanAPI):
             updated_logins, login_info[0]
         ) or login_info
         
-        # اگر موفقیت‌آمیز بود
+        # اگر موفقیت‌آمیز بود (با اعلان‌های ریست/نوبت بعدی همین دور در یک پیام)
         try:
-            bot = get_bot()
-            if bot:
-                await bot.send_message(
-                    chat_id=chatid,
-                    text=(
-                        f"✅ آگهی با توکن {str(result[1])} از شماره {str(result[2])} نردبان شد.\n"
-                        f"📊 از شماره {str(result[2])} تا به حال {str(updated_login[2])} آگهی نردبان شده است."
-                    ),
-                )
+            await notify_chat(
+                chatid,
+                text=(
+                    f"✅ آگهی با توکن {str(result[1])} از شماره {str(result[2])} نردبان شد.\n"
+                    f"📊 از شماره {str(result[2])} تا به حال {str(updated_login[2])} آگهی نردبان شده است."
+                ),
+            )
         except Exception as e:
             print(f"Error sending message: {e}")
 
         # اگر pending همین شماره تمام شده باشد، ریست+استخراج مجدد فقط برای همان لاگین
         try:
-            phone_pending = get_tokens_from_json(chatid=chatid, phone=int(phone), status="pending")
-            if not phone_pending:
+            if not pending_count(chatid, phone):
                 login_for_cycle = _login_row_for_phone(updated_logins, phone) or login_info
                 await reset_and_extract_for_single_login(chatid, login_for_cycle)
         except Exception as e:
@@ -4037,13 +3933,12 @@ async def handleNardebanResult(result, login_info, chatid, nardebanAPI):
                 print(f"⚠️ توکن {error_token} به وضعیت failed تغییر یافت")
         
         print(f"Failed to nardeban ad with token {error_token}: {error_msg}")
-        await bot_send_message(chat_id=chatid,
-                         text=f"نردبان آگهی با توکن {str(error_token)} با مشکل مواجه شد.\nخطا: {str(error_msg)}")
+        await notify_chat(chatid,
+                          text=f"نردبان آگهی با توکن {str(error_token)} با مشکل مواجه شد.\nخطا: {str(error_msg)}")
 
         # اگر pending همین شماره با خطاها تمام شد، ریست+استخراج مجدد همان لاگین
         try:
-            phone_pending = get_tokens_from_json(chatid=chatid, phone=int(phone), status="pending")
-            if not phone_pending:
+            if not pending_count(chatid, phone):
                 rows = curd.getCookies(chatid=chatid) or []
                 login_for_cycle = _login_row_for_phone(rows, phone) or login_info
                 await reset_and_extract_for_single_login(chatid, login_for_cycle)
@@ -4054,59 +3949,18 @@ async def handleNardebanResult(result, login_info, chatid, nardebanAPI):
     elif result[0] == 2:
         # اگر هیچ پستی موجود نبود
         error_msg = result[1] if len(result) > 1 else "هیچ اگهی برای نردبان پیدا نشد."
-        await bot_send_message(chat_id=chatid, text=str(error_msg))
+        await notify_chat(chatid, text=str(error_msg))
         return False
     else:
         # سایر خطاها
         error_msg = result[1] if len(result) > 1 else "خطای نامشخص"
-        await bot_send_message(chat_id=chatid, text=str(error_msg))
+        await notify_chat(chatid, text=str(error_msg))
         return False
 
-async def remJob(sch, id, chatid):
-    """تابع برای توقف خودکار job نردبان در ساعت مشخص شده"""
+async def remJob(chatid):
+    """تابع برای توقف خودکار نردبان در ساعت مشخص شده (نوبت STOP در dispatcher)"""
     try:
-        # حذف job نردبان
-        try:
-            sch.remove_job(id)
-        except Exception as e:
-            print(f"⚠️ خطا در حذف job نردبان {id}: {e}")
-        
-        # حذف job توقف خودکار مربوطه (اگر وجود داشته باشد)
-        try:
-            stop_job_id = f"auto_stop_{chatid}_{id}"
-            sch.remove_job(stop_job_id)
-        except:
-            pass  # اگر job توقف وجود نداشت، مشکلی نیست
-
-        # حذف همه auto_stopهای مرتبط با چت (نوع 4 و jobهای مانده)
-        try:
-            for j in sch.get_jobs():
-                jid = str(getattr(j, "id", "") or "")
-                if jid.startswith(f"auto_stop_{chatid}"):
-                    sch.remove_job(jid)
-        except Exception:
-            pass
-        
-        curd.removeJob(chatid=chatid)
-
-        # پاکسازی jobهای باقیمانده sendNardeban برای این چت (به‌خصوص date jobs نوع 4)
-        try:
-            all_jobs = sch.get_jobs()
-            for j in all_jobs:
-                try:
-                    j_args = list(getattr(j, "args", []) or [])
-                    if not j_args:
-                        continue
-                    if int(j_args[0]) != int(chatid):
-                        continue
-                    func_ref = str(getattr(j, "func_ref", "") or "")
-                    if "sendNardeban" in func_ref:
-                        sch.remove_job(j.id)
-                except Exception:
-                    continue
-        except Exception as e:
-            print(f"⚠️ خطا در پاکسازی jobهای باقیمانده نردبان: {e}")
-
+        cancel_ladder(chatid)
         refreshUsed(chatid=chatid)
         
         await bot_send_message(chat_id=chatid, text="✅ عملیات نردبان شما با موفقیت به پایان رسید!")
@@ -4132,49 +3986,26 @@ async def reExtractTokens(chatid):
         success_count = 0
         failed_count = 0
         
-        for l in logins:
-            try:
-                nardebanAPI = nardeban(apiKey=l[1])
-                brandToken = nardebanAPI.getBranToken()
-                
-                if not brandToken:
-                    await bot_send_message(chat_id=chatid, 
-                                                     text=f"❌ خطا در دریافت brand token برای شماره {l[0]}")
-                    failed_count += 1
-                    continue
-                
-                # استخراج توکن‌های جدید
-                tokens = nardebanAPI.get_all_tokens(brand_token=brandToken)
-                
-                if tokens:
-                    # ذخیره توکن‌ها در JSON
-                    new_count = add_tokens_to_json(chatid=chatid, phone=int(l[0]), tokens=tokens)
-                    
-                    if new_count > 0:
-                        # همچنین در دیتابیس هم ذخیره کن (برای سازگاری)
-                        existing_tokens = curd.get_tokens_by_phone(phone=int(l[0]))
-                        new_tokens = [t for t in tokens if t not in existing_tokens]
-                        if new_tokens:
-                            curd.insert_tokens_by_phone(phone=int(l[0]), tokens=new_tokens)
-                        
-                        total_extracted += new_count
-                        success_count += 1
-                        await bot_send_message(chat_id=chatid,
-                                                     text=f"✅ از شماره {l[0]}: {new_count} اگهی جدید استخراج و در JSON ذخیره شد.")
-                    else:
-                        await bot_send_message(chat_id=chatid,
-                                                     text=f"ℹ️ از شماره {l[0]}: همه اگهی‌ها قبلاً استخراج شده بودند.")
-                        success_count += 1
-                else:
-                    await bot_send_message(chat_id=chatid,
-                                                     text=f"⚠️ از شماره {l[0]}: هیچ اگهی‌ای یافت نشد.")
-                    failed_count += 1
-                    
-            except Exception as e:
-                print(f"Error extracting tokens for phone {l[0]}: {e}")
-                await bot_send_message(chat_id=chatid,
-                                                 text=f"❌ خطا در استخراج برای شماره {l[0]}: {str(e)}")
+        results = await extract_tokens_parallel(chatid, logins)
+        for phone, tokens, new_count, error in results:
+            if error == BRAND_TOKEN_ERROR:
+                await bot_send_message(chat_id=chatid, text=f"❌ خطا در دریافت brand token برای شماره {phone}")
+                failed_count += 1
+            elif error:
+                await bot_send_message(chat_id=chatid, text=f"❌ خطا در استخراج برای شماره {phone}: {error}")
                 failed_count += 1
+            elif not tokens:
+                await bot_send_message(chat_id=chatid, text=f"⚠️ از شماره {phone}: هیچ اگهی‌ای یافت نشد.")
+                failed_count += 1
+            elif new_count > 0:
+                total_extracted += new_count
+                success_count += 1
+                await bot_send_message(chat_id=chatid,
+                                       text=f"✅ از شماره {phone}: {new_count} اگهی جدید استخراج و در JSON ذخیره شد.")
+            else:
+                await bot_send_message(chat_id=chatid,
+                                       text=f"ℹ️ از شماره {phone}: همه اگهی‌ها قبلاً استخراج شده بودند.")
+                success_count += 1
         
         # پیام خلاصه
         summary = f"""📊 <b>خلاصه استخراج مجدد:</b>
@@ -4279,13 +4110,103 @@ def build_application():
     return application
 
 
+async def reconcile_ladder_jobs():
+    """
+    آشتی جدول jobs با dispatcher پس از ری‌استارت: چرخه‌های معتبر همین پروسه از نوبت ذخیره‌شده ادامه
+    می‌یابند و چرخه‌هایی که در زمان خاموشی باید تمام می‌شدند با remJob بسته می‌شوند (marker یتیم نمی‌ماند).
+    ردیف‌های قدیمی بدون مالک به پروسهٔ ربات تعلق می‌گیرند.
+    """
+    rows = curd.getJobsForOwner(scheduler_owner, include_unowned=(scheduler_owner == "bot"))
+    resumed = closed = 0
+    stop_time = get_stop_time_from_config()
+    for chatid, jobid, next_run in rows:
+        chatid = int(chatid)
+        if ladder_dispatcher.get(chatid, LADDER) or ladder_dispatcher.get(chatid, STOP):
+            continue
+        try:
+            manageDetails = curd.getManage(chatid=chatid)
+            reason = None
+            if not manageDetails or manageDetails[0] != 1:
+                reason = "ربات غیرفعال است"
+            elif not curd.getCookies(chatid=chatid):
+                reason = "لاگین فعالی وجود ندارد"
+            elif not is_repeat_period_active():
+                reason = "دوره تکرار به پایان رسیده"
+            elif not is_today_active_weekday():
+                reason = "امروز روز فعال نیست"
+            elif is_stop_time_in_past():
+                reason = "ساعت توقف خودکار گذشته است"
+            if reason:
+                print(f"ℹ️ [reconcile] چرخهٔ نردبان کاربر {chatid} بسته شد: {reason}")
+                await remJob(chatid)
+                closed += 1
+                continue
+
+            now = time.time()
+            due = next_run if next_run and next_run > now else now + LADDER_RESUME_DELAY
+            nardeban_type = manageDetails[3] if len(manageDetails) > 3 else 1
+            if nardeban_type == 4:
+                marker = f"natural_{chatid}"
+                ladder_dispatcher.schedule(chatid, LADDER, sendNardeban, due=due)
+                stop_callback = stop_natural_flow
+            else:
+                marker = f"ladder_{chatid}"
+                interval_minutes = manageDetails[5] if len(manageDetails) > 5 else 5
+                ladder_dispatcher.schedule(
+                    chatid, LADDER, sendNardeban,
+                    due=due,
+                    interval=int(interval_minutes) * 60,
+                )
+                stop_callback = remJob
+            curd.addJob(chatid=chatid, job=marker, owner=scheduler_owner, next_run=due)
+            if stop_time:
+                arm_auto_stop(chatid, stop_callback, *stop_time)
+            resumed += 1
+        except Exception as e:
+            print(f"⚠️ [reconcile] خطا در بازیابی نردبان کاربر {chatid}: {e}")
+    if rows:
+        print(f"✅ [reconcile] نردبان‌های {scheduler_owner}: {resumed} ادامه یافت، {closed} بسته شد")
+
+
+async def report_loop_offenders(offenders):
+    """گزارش بدترین مسدودشدن‌های event loop و نوبت‌های دیرهنگام از آخرین گزارش برای ادمین اصلی"""
+    admin_id = get_default_admin_id()
+    if not admin_id:
+        return
+    kinds = {"block": "🧱 مسدود", "late": "⏰ دیرکرد"}
+    lines = ["🐢 <b>گزارش کندی event loop</b>"]
+    for o in offenders:
+        lines.append(
+            f"• {kinds.get(o['kind'], o['kind'])} [{o['process']}] <code>{html.escape(o['site'])}</code>: "
+            f"حداکثر {o['max']}s، {o['count']} بار (جمع {o['total']}s)"
+        )
+    worst_block = next((o for o in offenders if o["kind"] == "block" and o["stack"]), None)
+    if worst_block:
+        tail = "".join(worst_block["stack"].splitlines(keepends=True)[-6:])
+        lines.append(f"\n📍 stack بدترین مورد:\n<pre>{html.escape(tail)}</pre>")
+    await notify_chat(admin_id, "\n".join(lines), parse_mode="HTML")
+
+
+async def start_scheduler(owner):
+    """راه‌اندازی scheduler با jobstore پایدار bot.db (به تفکیک پروسه) و ادامهٔ چرخه‌های نردبان"""
+    global scheduler_owner
+    scheduler_owner = owner
+    if not scheduler.running:
+        # configure تنظیمات قبلی را پاک می‌کند؛ timezone و job_defaults دوباره داده می‌شوند
+        scheduler.configure(event_loop=asyncio.get_running_loop(), **SCHEDULER_OPTIONS)
+        scheduler.add_jobstore(SqliteJobStore(Datas.database, owner), "default")
+        scheduler.add_listener(_observe_job_lag, EVENT_JOB_SUBMITTED)
+        scheduler.start()
+    metrics.start_metrics_export(owner)
+    # گزارش رخدادهای loop (همهٔ پروسه‌ها از جدول مشترک) فقط از پروسهٔ ربات فرستاده می‌شود
+    start_loop_monitor(owner, on_report=report_loop_offenders if owner == "bot" else None)
+    await reconcile_ladder_jobs()
+
+
 async def on_startup(application: Application):
     print("🚀 Application post_init - starting scheduler")
     update_bale_status("connected", "بله متصل شد")
-    loop = asyncio.get_running_loop()
-    scheduler.configure(event_loop=loop)
-    if not scheduler.running:
-        scheduler.start()
+    await start_scheduler("bot")
     
     # تنظیم jobهای شروع خودکار برای همه ادمین‌ها
     try:
@@ -4310,6 +4231,11 @@ async def on_shutdown(application: Application):
     update_bale_status("disconnected", "اتصال بله قطع شد")
     if scheduler.running:
         scheduler.shutdown(wait=False)
+    ladder_dispatcher.shutdown()
+    await notifications.flush_all()
+    await close_async_client()
+    stop_loop_monitor()
+    metrics.stop_metrics_export(scheduler_owner)
 
 
 async def bot_error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
@@ -1,9 +1,525 @@
 import re
+import json
 import sqlite3
 import os
 import secrets
 import hashlib
 import hmac
+import threading
+import time
+
+# ==================== مدیریت اتصال پایدار SQLite ====================
+# هر thread برای هر فایل دیتابیس یک اتصال ماندگار دارد (WAL + busy_timeout + cache دستورها)
+# تا متدهای curdCommands در هر فراخوانی اتصال جدید باز نکنند و bot/worker/web_app هم‌زمان بخوانند.
+DB_BUSY_TIMEOUT_MS = 30000
+DB_CACHED_STATEMENTS = 256
+
+_thread_local = threading.local()
+_wal_checked_paths = set()
+_wal_lock = threading.Lock()
+
+
+class _PooledConnection:
+    """پوشش اتصال ماندگار؛ close() اتصال را نمی‌بندد و فقط تراکنش نیمه‌کاره را rollback می‌کند"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def close(self):
+        try:
+            if self._conn.in_transaction:
+                self._conn.rollback()
+        except sqlite3.Error:
+            pass
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def _open_connection(db_path):
+    conn = sqlite3.connect(
+        db_path,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000,
+        cached_statements=DB_CACHED_STATEMENTS,
+    )
+    conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA foreign_keys = ON")
+    with _wal_lock:
+        if db_path not in _wal_checked_paths:
+            # journal_mode=WAL روی خود فایل ذخیره می‌شود؛ یک بار در هر پروسه کافی است
+            try:
+                conn.execute("PRAGMA journal_mode = WAL")
+            except sqlite3.Error as e:
+                print(f"⚠️ فعال‌سازی WAL ممکن نشد: {e}")
+            _wal_checked_paths.add(db_path)
+    conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+
+def get_db_connection(db_path):
+    """اتصال ماندگار thread جاری به db_path"""
+    conns = getattr(_thread_local, "connections", None)
+    if conns is None:
+        conns = {}
+        _thread_local.connections = conns
+    wrapped = conns.get(db_path)
+    if wrapped is None:
+        wrapped = _PooledConnection(_open_connection(db_path))
+        conns[db_path] = wrapped
+    elif wrapped.in_transaction:
+        # تراکنش باقی‌مانده از خطای قبلی نباید قفل نوشتن را نگه دارد
+        wrapped.close()
+    return wrapped
+
+
+def close_db_connections():
+    """بستن واقعی اتصال‌های thread جاری (برای خاموش شدن تمیز)"""
+    conns = getattr(_thread_local, "connections", None) or {}
+    for wrapped in list(conns.values()):
+        try:
+            wrapped._conn.close()
+        except sqlite3.Error:
+            pass
+    conns.clear()
+# ==================== پایان مدیریت اتصال ====================
+
+# ==================== رویداد تغییر وضعیت ====================
+# نوشتن‌هایی که روی منوی ادمین اثر دارند (jobs، manage، logins، وضعیت توکن‌ها) به شنونده‌ها خبر می‌دهند
+# تا کش‌های درون‌پروسه‌ای (مثل مدل منو) باطل شوند. chatid=None یعنی «همهٔ چت‌ها».
+_state_listeners = []
+
+
+def subscribe_state_change(callback):
+    """ثبت callback(chatid) برای تغییرات وضعیت؛ خروجی تابع لغو اشتراک است"""
+    _state_listeners.append(callback)
+
+    def _unsubscribe():
+        try:
+            _state_listeners.remove(callback)
+        except ValueError:
+            pass
+
+    return _unsubscribe
+
+
+def notify_state_change(chatid=None):
+    for callback in list(_state_listeners):
+        try:
+            callback(chatid)
+        except Exception as e:
+            print(f"⚠️ خطا در شنوندهٔ تغییر وضعیت: {e}")
+# ==================== پایان رویداد تغییر وضعیت ====================
+
+# کش مجموعهٔ ادمین‌ها به ازای مسیر دیتابیس؛ setAdmin/remAdmin همین پروسه آن را فوراً باطل می‌کنند و
+# TTL تغییرات پروسه‌های دیگر (worker / پنل وب) را پوشش می‌دهد.
+ADMIN_CACHE_TTL = 30.0
+_admin_cache = {}
+_admin_cache_lock = threading.Lock()
+
+
+def invalidate_admin_cache(db_path=None):
+    with _admin_cache_lock:
+        if db_path is None:
+            _admin_cache.clear()
+        else:
+            _admin_cache.pop(db_path, None)
+
+# ==================== نسخه‌بندی و مهاجرت schema ====================
+# هر مهاجرت (نسخه، نام، تابع) فقط یک بار اجرا و در جدول schema_version ثبت می‌شود.
+# همهٔ مهاجرت‌های معوق در یک تراکنش اعمال می‌شوند؛ در شروع گرم فقط یک SELECT روی schema_version انجام می‌شود.
+
+def _table_columns(cur, table):
+    cur.execute(f"PRAGMA table_info({table})")
+    return {row[1] for row in cur.fetchall()}
+
+
+def _add_missing_columns(cur, table, columns):
+    """افزودن ستون‌های غایب (به جای ALTERهای شکست‌خورده در هر شروع)"""
+    existing = _table_columns(cur, table)
+    for name, ddl in columns:
+        if name not in existing:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}")
+
+
+# یک شماره می‌تواند در چند پنل (chatid) مجزا لاگین شود — یکتایی فقط روی (chatid, phone)
+_LOGINS_TABLE_SQL = """
+    CREATE TABLE logins (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chatid INTEGER NOT NULL,
+        phone INTEGER NOT NULL,
+        cookie TEXT,
+        active INTEGER,
+        used INTEGER,
+        UNIQUE(chatid, phone)
+    )
+"""
+
+
+def _migration_001_baseline(cur):
+    """جداول پایه + ارتقای دیتابیس‌های قدیمی"""
+    cur.execute("CREATE TABLE IF NOT EXISTS admins(id INTEGER PRIMARY KEY AUTOINCREMENT, chatid INTEGER UNIQUE)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS tokens (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            phone INTEGER NOT NULL,
+            token TEXT NOT NULL
+        )
+    """)
+    cur.execute("CREATE TABLE IF NOT EXISTS jobs(id INTEGER PRIMARY KEY AUTOINCREMENT, chatid INTEGER UNIQUE, jobid TEXT)")
+    cur.execute("CREATE TABLE IF NOT EXISTS sents(id INTEGER PRIMARY KEY AUTOINCREMENT, chatid INTEGER, token TEXT UNIQUE, status TEXT)")
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS adminp("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "chatid INTEGER UNIQUE, "
+        "slogin INTEGER, "
+        "slimit INTEGER, "
+        "scode INTEGER, "
+        "ssearch INTEGER DEFAULT 0"
+        ")"
+    )
+    _add_missing_columns(cur, "adminp", [("ssearch", "INTEGER DEFAULT 0")])
+
+    # logins: یکتایی قدیمی «فقط phone» → (chatid, phone)
+    cur.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='logins'")
+    row = cur.fetchone()
+    if row and row[0] and (
+        re.search(r"phone\s+INTEGER\s+UNIQUE", row[0], re.I)
+        or re.search(r"phone\s+INTEGER\s+NOT\s+NULL\s+UNIQUE", row[0], re.I)
+    ):
+        cur.execute("ALTER TABLE logins RENAME TO logins_legacy_phone_unique")
+        cur.execute(_LOGINS_TABLE_SQL)
+        cur.execute(
+            """
+            INSERT INTO logins (id, chatid, phone, cookie, active, used)
+            SELECT id, chatid, phone, cookie, active, used FROM logins_legacy_phone_unique
+            """
+        )
+        cur.execute("DROP TABLE logins_legacy_phone_unique")
+        print("✅ جدول logins: یکتایی از «فقط phone» به «(chatid, phone)» مهاجرت داده شد.")
+    else:
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS logins ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "chatid INTEGER NOT NULL, "
+            "phone INTEGER NOT NULL, "
+            "cookie TEXT, "
+            "active INTEGER, "
+            "used INTEGER, "
+            "UNIQUE(chatid, phone)"
+            ")"
+        )
+
+    cur.execute("CREATE TABLE IF NOT EXISTS manage(id INTEGER PRIMARY KEY AUTOINCREMENT, chatid INTEGER UNIQUE, active INTEGER, limite INTEGER, climit INTEGER, nardeban_type INTEGER DEFAULT 1, last_round_robin_phone INTEGER, interval_minutes INTEGER DEFAULT 5, stop_hour INTEGER, cost_priority_1 INTEGER, cost_priority_2 INTEGER)")
+    _add_missing_columns(cur, "manage", [
+        ("nardeban_type", "INTEGER DEFAULT 1"),
+        ("last_round_robin_phone", "INTEGER"),
+        ("interval_minutes", "INTEGER DEFAULT 5"),
+        ("stop_hour", "INTEGER"),
+        ("cost_priority_1", "INTEGER"),
+        ("cost_priority_2", "INTEGER"),
+    ])
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS web_commands(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chatid INTEGER NOT NULL,
+            command_type TEXT NOT NULL,
+            payload TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            result TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            processed_at TEXT
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS web_panel_auth(
+            chatid INTEGER PRIMARY KEY,
+            pass_hash TEXT NOT NULL,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def _migration_002_token_states(cur):
+    """جدول وضعیت توکن‌ها (tokens_manager)"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS token_states (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chatid INTEGER NOT NULL,
+            phone INTEGER NOT NULL,
+            token TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            updated_at TEXT
+        )
+    """)
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_token_states_chat_token ON token_states(chatid, token)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_token_states_chat_phone_status ON token_states(chatid, phone, status)")
+    cur.execute("CREATE TABLE IF NOT EXISTS token_store_meta (key TEXT PRIMARY KEY, value TEXT)")
+
+
+def _migration_003_web_commands_index(cur):
+    """ایندکس صف فرمان‌ها برای getPendingWebCommands / has_web_command_in_flight"""
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_web_commands_status ON web_commands(status, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_web_commands_chat_type ON web_commands(chatid, command_type, status)")
+
+
+# لاگ پیام‌های ارسالی ربات (پنل وب) — فقط درج؛ ردیف‌های قدیمی هر چند درج یک‌بار حذف می‌شوند
+LEGACY_MESSAGE_LOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "web_message_logs.json")
+MESSAGE_LOG_MAX_ROWS = 5000
+MESSAGE_LOG_PRUNE_EVERY = 200
+
+
+def _migration_004_message_logs(cur):
+    """جدول لاگ پیام‌ها با ایندکس (chatid, id) + انتقال یک‌بارهٔ web_message_logs.json"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS message_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chatid INTEGER,
+            ts TEXT,
+            text TEXT
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_message_logs_chat ON message_logs(chatid, id)")
+    try:
+        with open(LEGACY_MESSAGE_LOG_PATH, "r", encoding="utf-8") as f:
+            rows = json.load(f)
+    except (OSError, ValueError):
+        return
+    if not isinstance(rows, list):
+        return
+    legacy = []
+    for r in rows[-MESSAGE_LOG_MAX_ROWS:]:
+        if not isinstance(r, dict):
+            continue
+        try:
+            cid = int(r["chat_id"]) if r.get("chat_id") is not None else None
+        except (TypeError, ValueError):
+            cid = None
+        legacy.append((cid, str(r.get("ts", "-")), str(r.get("text", ""))))
+    cur.executemany("INSERT INTO message_logs (chatid, ts, text) VALUES (?, ?, ?)", legacy)
+
+
+def _migration_005_post_index(cur):
+    """فهرست آگهی‌های هر لاگین و cursor همگام‌سازی post-list (post_index.py)"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS post_index (
+            chatid INTEGER NOT NULL,
+            phone INTEGER NOT NULL,
+            brand_token TEXT NOT NULL,
+            token TEXT NOT NULL,
+            label TEXT,
+            title TEXT,
+            fingerprint TEXT,
+            rank REAL,
+            updated_at TEXT,
+            PRIMARY KEY (chatid, phone, brand_token, token)
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS post_sync_cursor (
+            chatid INTEGER NOT NULL,
+            phone INTEGER NOT NULL,
+            brand_token TEXT NOT NULL,
+            head_token TEXT,
+            last_item_identifier TEXT,
+            last_sync REAL,
+            last_full_sync REAL,
+            PRIMARY KEY (chatid, phone, brand_token)
+        )
+    """)
+
+
+def _migration_006_brand_tokens(cur):
+    """کش brand_token هر لاگین به تفکیک شماره و hash کوکی"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS brand_tokens (
+            phone INTEGER NOT NULL,
+            cookie_hash TEXT NOT NULL,
+            brand_token TEXT NOT NULL,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (phone, cookie_hash)
+        )
+    """)
+
+
+def _migration_007_scheduler_jobstore(cur):
+    """jobstore پایدار APScheduler و ستون‌های مالک/نوبت بعدی جدول jobs برای بازیابی پس از ری‌استارت"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS scheduler_jobs (
+            owner TEXT NOT NULL,
+            id TEXT NOT NULL,
+            next_run_time REAL,
+            job_state BLOB NOT NULL,
+            PRIMARY KEY (owner, id)
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_scheduler_jobs_next_run ON scheduler_jobs(owner, next_run_time)")
+    _add_missing_columns(cur, "jobs", [
+        ("owner", "TEXT"),
+        ("next_run", "REAL"),
+    ])
+
+
+def _migration_008_token_meta(cur):
+    """فرادادهٔ هر آگهی (برچسب، عنوان، اولین مشاهده، آخرین نردبان، تعداد نردبان) برای اولویت‌بندی جریان طبیعی"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS token_meta (
+            chatid INTEGER NOT NULL,
+            token TEXT NOT NULL,
+            phone INTEGER,
+            label TEXT,
+            title TEXT,
+            first_seen REAL,
+            last_promoted REAL,
+            promote_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (chatid, token)
+        ) WITHOUT ROWID
+    """)
+    # آگهی‌های فهرست‌شدهٔ فعلی: زمان اولین مشاهده از updated_at با حفظ ترتیب فید (بالای فید = جدیدتر)
+    cur.execute("""
+        INSERT OR IGNORE INTO token_meta (chatid, token, phone, label, title, first_seen)
+        SELECT chatid, token, phone, label, title,
+               COALESCE(CAST(strftime('%s', updated_at) AS REAL), 0) - COALESCE(rank, 0)
+        FROM post_index
+    """)
+
+
+def _migration_009_promotion_journal(cur):
+    """ژورنال تلاش‌های نردبان و زمان‌بندی هر مرحله (promotion_journal.py)"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS promotion_attempts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chatid INTEGER,
+            phone INTEGER,
+            token TEXT,
+            mode TEXT,
+            started_at REAL NOT NULL,
+            finished_at REAL,
+            outcome TEXT,
+            failed_stage TEXT,
+            error_class TEXT,
+            error TEXT
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_promotion_attempts_started ON promotion_attempts(started_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_promotion_attempts_chat ON promotion_attempts(chatid, started_at)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS promotion_stages (
+            attempt_id INTEGER NOT NULL,
+            stage TEXT NOT NULL,
+            started_at REAL NOT NULL,
+            ended_at REAL,
+            http_status INTEGER,
+            requests INTEGER NOT NULL DEFAULT 0,
+            error_class TEXT,
+            PRIMARY KEY (attempt_id, stage)
+        ) WITHOUT ROWID
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_promotion_stages_stage ON promotion_stages(stage, started_at)")
+
+
+def _migration_010_metrics_snapshots(cur):
+    """آخرین snapshot رجیستری متریک هر پروسه (ربات / worker) برای endpoint /metrics پنل وب"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS metrics_snapshots (
+            process TEXT PRIMARY KEY,
+            pid INTEGER,
+            started_at REAL,
+            updated_at REAL NOT NULL,
+            payload TEXT NOT NULL
+        )
+    """)
+
+
+def _migration_011_loop_incidents(cur):
+    """مسدود شدن event loop و اجرای دیرهنگام نوبت‌های زمان‌بند (loop_monitor.py)"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS loop_incidents (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            process TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            at REAL NOT NULL,
+            duration REAL NOT NULL,
+            site TEXT,
+            stack TEXT
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_loop_incidents_at ON loop_incidents(at)")
+
+
+SCHEMA_MIGRATIONS = [
+    (1, "baseline", _migration_001_baseline),
+    (2, "token_states", _migration_002_token_states),
+    (3, "web_commands_index", _migration_003_web_commands_index),
+    (4, "message_logs", _migration_004_message_logs),
+    (5, "post_index", _migration_005_post_index),
+    (6, "brand_tokens", _migration_006_brand_tokens),
+    (7, "scheduler_jobstore", _migration_007_scheduler_jobstore),
+    (8, "token_meta", _migration_008_token_meta),
+    (9, "promotion_journal", _migration_009_promotion_journal),
+    (10, "metrics_snapshots", _migration_010_metrics_snapshots),
+    (11, "loop_incidents", _migration_011_loop_incidents),
+]
+SCHEMA_LATEST_VERSION = SCHEMA_MIGRATIONS[-1][0]
+
+_schema_ready_paths = set()
+_schema_lock = threading.Lock()
+
+
+def _current_schema_version(cur):
+    try:
+        cur.execute("SELECT MAX(version) FROM schema_version")
+        row = cur.fetchone()
+        return int(row[0]) if row and row[0] is not None else 0
+    except sqlite3.OperationalError:
+        return 0
+
+
+def ensure_schema(db_path):
+    """
+    اعمال مهاجرت‌های معوق روی db_path؛ خروجی: نسخهٔ فعلی schema.
+    در هر پروسه پس از اولین بار بدون هیچ کوئری برمی‌گردد.
+    """
+    if db_path in _schema_ready_paths:
+        return SCHEMA_LATEST_VERSION
+    with _schema_lock:
+        if db_path in _schema_ready_paths:
+            return SCHEMA_LATEST_VERSION
+        conn = get_db_connection(db_path)
+        cur = conn.cursor()
+        try:
+            version = _current_schema_version(cur)
+            if version < SCHEMA_LATEST_VERSION:
+                # قفل نوشتن قبل از بررسی مجدد؛ پروسهٔ دیگر (bot/worker/web_app) ممکن است هم‌زمان مهاجرت کند
+                cur.execute("BEGIN IMMEDIATE")
+                cur.execute(
+                    "CREATE TABLE IF NOT EXISTS schema_version("
+                    "version INTEGER PRIMARY KEY, name TEXT, applied_at TEXT DEFAULT CURRENT_TIMESTAMP)"
+                )
+                version = _current_schema_version(cur)
+                applied = []
+                for mig_version, name, func in SCHEMA_MIGRATIONS:
+                    if mig_version <= version:
+                        continue
+                    func(cur)
+                    cur.execute("INSERT INTO schema_version (version, name) VALUES (?, ?)", (mig_version, name))
+                    applied.append(mig_version)
+                conn.commit()
+                if applied:
+                    print(f"✅ مهاجرت‌های دیتابیس اعمال شد: {applied} (نسخهٔ فعلی {SCHEMA_LATEST_VERSION})")
+                version = SCHEMA_LATEST_VERSION
+            _schema_ready_paths.add(db_path)
+            return version
+        except Exception as e:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                pass
+            print(f"❌ خطا در مهاجرت دیتابیس: {e}")
+            raise
+        finally:
+            cur.close()
+# ==================== پایان مهاجرت schema ====================
 
 class curdCommands:
     def __init__(self, Datas):
@@ -15,86 +531,65 @@ class curdCommands:
         if db_dir and not os.path.exists(db_dir):
             os.makedirs(db_dir, exist_ok=True)
         
+    def migrate(self):
+        """ساخت/ارتقای همهٔ جداول با مهاجرت‌های نسخه‌دار"""
+        return ensure_schema(self.db_path)
+
     def _get_connection(self):
-        """ایجاد و بازگرداندن اتصال به دیتابیس SQLite"""
+        """بازگرداندن اتصال ماندگار thread جاری به دیتابیس SQLite (WAL، foreign keys فعال)"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            # فعال کردن foreign keys
-            conn.execute("PRAGMA foreign_keys = ON")
-            return conn
+            return get_db_connection(self.db_path)
         except sqlite3.Error as e:
             print(f"خطا در اتصال به دیتابیس: {e}")
             raise
     
-    def cTable_admins(self):
-        try:
-            conn = self._get_connection()
-            cur = conn.cursor()
-            command = "CREATE TABLE IF NOT EXISTS admins(id INTEGER PRIMARY KEY AUTOINCREMENT, chatid INTEGER UNIQUE)"
-            cur.execute(command)
-            conn.commit()
-            cur.close()
-            conn.close()
-        except Exception as e:
-            print(f"Error creating admins table: {e}")
-
-    def cTable_tokens(self):
-        try:
-            conn = self._get_connection()
-            cur = conn.cursor()
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS tokens (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    phone INTEGER NOT NULL,
-                    token TEXT NOT NULL
-                )
-            """)
-            conn.commit()
-            cur.close()
-            conn.close()
-        except Exception as e:
-            print(f"Error creating tokens table: {e}")
+    @staticmethod
+    def _merge_phone_tokens(cur, phone, tokens):
+        # ادغام با توکن‌های قبلی همان شماره + یک ردیف برای هر phone (بدون تکرار ردیف)
+        cur.execute("SELECT token FROM tokens WHERE phone = ?", (phone,))
+        rows = cur.fetchall()
+        existing_parts = []
+        for row in rows:
+            if row and row[0]:
+                existing_parts.extend([t for t in str(row[0]).split(",") if t])
+        merged = []
+        seen = set()
+        for t in existing_parts + list(tokens):
+            if t and t not in seen:
+                seen.add(t)
+                merged.append(t)
+        cur.execute("DELETE FROM tokens WHERE phone = ?", (phone,))
+        tokens_combined = ",".join(merged)
+        sql_insert = "INSERT INTO tokens (phone, token) VALUES (?, ?)"
+        cur.execute(sql_insert, (phone, tokens_combined))
 
-    def cTable_jobs(self):
+    def insert_tokens_by_phone(self, phone, tokens):
+        print(phone)
+        print(tokens)
         try:
             conn = self._get_connection()
             cur = conn.cursor()
-            command = "CREATE TABLE IF NOT EXISTS jobs(id INTEGER PRIMARY KEY AUTOINCREMENT, chatid INTEGER UNIQUE, jobid TEXT)"
-            cur.execute(command)
+            self._merge_phone_tokens(cur, phone, tokens)
             conn.commit()
             cur.close()
             conn.close()
         except Exception as e:
-            print(f"Error creating jobs table: {e}")
+            print(f"Error inserting tokens: {e}")
 
-    def insert_tokens_by_phone(self, phone, tokens):
-        print(phone)
-        print(tokens)
+    def insert_tokens_batch(self, tokens_by_phone):
+        """ادغام توکن‌های چند شماره در جدول tokens در یک تراکنش — {phone: [tokens]}"""
+        if not tokens_by_phone:
+            return
         try:
             conn = self._get_connection()
             cur = conn.cursor()
-            # ادغام با توکن‌های قبلی همان شماره + یک ردیف برای هر phone (بدون تکرار ردیف)
-            cur.execute("SELECT token FROM tokens WHERE phone = ?", (phone,))
-            rows = cur.fetchall()
-            existing_parts = []
-            for row in rows:
-                if row and row[0]:
-                    existing_parts.extend([t for t in str(row[0]).split(",") if t])
-            merged = []
-            seen = set()
-            for t in existing_parts + list(tokens):
-                if t and t not in seen:
-                    seen.add(t)
-                    merged.append(t)
-            cur.execute("DELETE FROM tokens WHERE phone = ?", (phone,))
-            tokens_combined = ",".join(merged)
-            sql_insert = "INSERT INTO tokens (phone, token) VALUES (?, ?)"
-            cur.execute(sql_insert, (phone, tokens_combined))
+            for phone, tokens in tokens_by_phone.items():
+                self._merge_phone_tokens(cur, phone, tokens)
             conn.commit()
             cur.close()
             conn.close()
         except Exception as e:
-            print(f"Error inserting tokens: {e}")
+            print(f"Error inserting tokens batch: {e}")
 
     def check_tokens_by_phone(self, phone):
         try:
@@ -147,13 +642,14 @@ class curdCommands:
             print(f"Error retrieving tokens: {e}")
             return []
 
-    def addJob(self, chatid, job):
+    def addJob(self, chatid, job, owner=None, next_run=None):
         try:
             conn = self._get_connection()
             cur = conn.cursor()
-            insrt = "INSERT OR REPLACE INTO jobs (chatid, jobid) VALUES (?, ?)"
-            cur.execute(insrt, (chatid, job))
+            insrt = "INSERT OR REPLACE INTO jobs (chatid, jobid, owner, next_run) VALUES (?, ?, ?, ?)"
+            cur.execute(insrt, (chatid, job, owner, next_run))
             conn.commit()
+            notify_state_change(chatid)
             cur.close()
             conn.close()
             return 1
@@ -161,6 +657,37 @@ class curdCommands:
             print(f"Error adding job: {e}")
             return 0
 
+    def setJobNextRun(self, chatid, next_run):
+        """ثبت زمان نوبت بعدی نردبان (epoch) برای ادامهٔ همان چرخه پس از ری‌استارت"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            cur.execute("UPDATE jobs SET next_run = ? WHERE chatid = ?", (next_run, chatid))
+            conn.commit()
+            cur.close()
+            conn.close()
+            return 1
+        except Exception as e:
+            print(f"Error updating job next run: {e}")
+            return 0
+
+    def getJobsForOwner(self, owner, include_unowned=False):
+        """ردیف‌های jobs متعلق به یک پروسه: [(chatid, jobid, next_run)]"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            if include_unowned:
+                cur.execute("SELECT chatid, jobid, next_run FROM jobs WHERE owner = ? OR owner IS NULL", (owner,))
+            else:
+                cur.execute("SELECT chatid, jobid, next_run FROM jobs WHERE owner = ?", (owner,))
+            rows = cur.fetchall()
+            cur.close()
+            conn.close()
+            return rows
+        except Exception as e:
+            print(f"Error getting jobs for owner: {e}")
+            return []
+
     def removeJob(self, chatid):
         try:
             conn = self._get_connection()
@@ -168,6 +695,7 @@ class curdCommands:
             insrt = "DELETE FROM jobs WHERE chatid = ?"
             cur.execute(insrt, (chatid,))
             conn.commit()
+            notify_state_change(chatid)
             cur.close()
             conn.close()
             return 1
@@ -199,6 +727,7 @@ class curdCommands:
             insrt = "INSERT OR IGNORE INTO admins (chatid) VALUES (?)"
             cur.execute(insrt, (chatid,))
             conn.commit()
+            invalidate_admin_cache(self.db_path)
             cur.close()
             conn.close()
             return 1
@@ -220,6 +749,31 @@ class curdCommands:
             print(f"Error getting admins: {e}")
             return []
 
+    def getAdminSet(self):
+        """مجموعهٔ chatid ادمین‌ها (int) از کش درون‌پروسه‌ای؛ فقط پس از انقضای TTL یا تغییر ادمین‌ها از دیتابیس خوانده می‌شود"""
+        now = time.monotonic()
+        cached = _admin_cache.get(self.db_path)
+        if cached is not None and now - cached[0] < ADMIN_CACHE_TTL:
+            return cached[1]
+        try:
+            conn = self._get_connection()
+            rows = conn.execute("SELECT chatid FROM admins").fetchall()
+            conn.close()
+        except Exception as e:
+            print(f"Error getting admins: {e}")
+            # در خطای موقت دیتابیس نسخهٔ قبلی کش (در صورت وجود) معتبرتر از مجموعهٔ خالی است
+            return cached[1] if cached is not None else frozenset()
+        admins = set()
+        for (value,) in rows:
+            try:
+                admins.add(int(value))
+            except (TypeError, ValueError):
+                continue
+        admins = frozenset(admins)
+        with _admin_cache_lock:
+            _admin_cache[self.db_path] = (now, admins)
+        return admins
+
     def remAdmin(self, chatid):
         try:
             conn = self._get_connection()
@@ -227,6 +781,7 @@ class curdCommands:
             insrt = "DELETE FROM admins WHERE chatid = ?"
             cur.execute(insrt, (chatid,))
             conn.commit()
+            invalidate_admin_cache(self.db_path)
             cur.close()
             conn.close()
             return 1
@@ -234,51 +789,6 @@ class curdCommands:
             print(f"Error removing admin: {e}")
             return 0
 
-    def cTable_sents(self):
-        try:
-            conn = self._get_connection()
-            cur = conn.cursor()
-            command = "CREATE TABLE IF NOT EXISTS sents(id INTEGER PRIMARY KEY AUTOINCREMENT, chatid INTEGER, token TEXT UNIQUE, status TEXT)"
-            cur.execute(command)
-            conn.commit()
-            cur.close()
-            conn.close()
-        except Exception as e:
-            print(f"Error creating sents table: {e}")
-
-    def cTable_adminp(self):
-        try:
-            conn = self._get_connection()
-            cur = conn.cursor()
-            command = (
-                "CREATE TABLE IF NOT EXISTS adminp("
-                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
-                "chatid INTEGER UNIQUE, "
-                "slogin INTEGER, "
-                "slimit INTEGER, "
-                "scode INTEGER"
-                ")"
-            )
-            cur.execute(command)
-
-            # اطمینان از وجود ستون ssearch برای مدیریت حالت جستجو در دیوار
-            # در SQLite امکان IF NOT EXISTS برای ستون نیست، پس در یک try/except انجام می‌دهیم
-            try:
-                cur.execute("ALTER TABLE adminp ADD COLUMN ssearch INTEGER DEFAULT 0")
-                conn.commit()
-            except Exception as e:
-                # اگر ستون از قبل وجود داشته باشد، خطا را نادیده می‌گیریم
-                # سایر خطاها فقط لاگ می‌شوند تا جدول خراب نشود
-                msg = str(e)
-                if "duplicate column name" not in msg.lower():
-                    print(f"Warning while ensuring ssearch column in adminp: {e}")
-
-            conn.commit()
-            cur.close()
-            conn.close()
-        except Exception as e:
-            print(f"Error creating adminp table: {e}")
-
     def addAdmin(self, chatid):
         try:
             conn = self._get_connection()
@@ -293,151 +803,6 @@ class curdCommands:
             print(f"Error adding admin: {e}")
             return 0
 
-    def _logins_table_sql_new(self) -> str:
-        """یک شماره می‌تواند در چند پنل (chatid) مجزا لاگین شود — یکتایی فقط روی (chatid, phone)."""
-        return """
-            CREATE TABLE logins (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chatid INTEGER NOT NULL,
-                phone INTEGER NOT NULL,
-                cookie TEXT,
-                active INTEGER,
-                used INTEGER,
-                UNIQUE(chatid, phone)
-            )
-        """
-
-    def cTable_logins(self):
-        try:
-            conn = self._get_connection()
-            cur = conn.cursor()
-            cur.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='logins'")
-            row = cur.fetchone()
-            if row and row[0] and (
-                re.search(r"phone\s+INTEGER\s+UNIQUE", row[0], re.I)
-                or re.search(r"phone\s+INTEGER\s+NOT\s+NULL\s+UNIQUE", row[0], re.I)
-            ):
-                cur.execute("ALTER TABLE logins RENAME TO logins_legacy_phone_unique")
-                cur.execute(self._logins_table_sql_new())
-                cur.execute(
-                    """
-                    INSERT INTO logins (id, chatid, phone, cookie, active, used)
-                    SELECT id, chatid, phone, cookie, active, used FROM logins_legacy_phone_unique
-                    """
-                )
-                cur.execute("DROP TABLE logins_legacy_phone_unique")
-                conn.commit()
-                print("✅ جدول logins: یکتایی از «فقط phone» به «(chatid, phone)» مهاجرت داده شد.")
-            else:
-                cur.execute(
-                    "CREATE TABLE IF NOT EXISTS logins ("
-                    "id INTEGER PRIMARY KEY AUTOINCREMENT, "
-                    "chatid INTEGER NOT NULL, "
-                    "phone INTEGER NOT NULL, "
-                    "cookie TEXT, "
-                    "active INTEGER, "
-                    "used INTEGER, "
-                    "UNIQUE(chatid, phone)"
-                    ")"
-                )
-                conn.commit()
-            cur.close()
-            conn.close()
-        except Exception as e:
-            print(f"Error creating logins table: {e}")
-
-    def cTable_manage(self):
-        try:
-            conn = self._get_connection()
-            cur = conn.cursor()
-            command = "CREATE TABLE IF NOT EXISTS manage(id INTEGER PRIMARY KEY AUTOINCREMENT, chatid INTEGER UNIQUE, active INTEGER, limite INTEGER, climit INTEGER, nardeban_type INTEGER, last_round_robin_phone INTEGER, interval_minutes INTEGER, stop_hour INTEGER, cost_priority_1 INTEGER, cost_priority_2 INTEGER)"
-            cur.execute(command)
-            # اضافه کردن ستون nardeban_type به جدول موجود (اگر وجود نداشته باشد)
-            try:
-                cur.execute("ALTER TABLE manage ADD COLUMN nardeban_type INTEGER DEFAULT 1")
-                conn.commit()
-            except:
-                pass  # ستون قبلاً وجود دارد
-            # اضافه کردن ستون last_round_robin_phone برای ردیابی آخرین لاگین استفاده شده در نوع نوبتی
-            try:
-                cur.execute("ALTER TABLE manage ADD COLUMN last_round_robin_phone INTEGER")
-                conn.commit()
-            except:
-                pass  # ستون قبلاً وجود دارد
-            # اضافه کردن ستون interval_minutes برای تنظیم فاصله بین نردبان‌ها
-            try:
-                cur.execute("ALTER TABLE manage ADD COLUMN interval_minutes INTEGER DEFAULT 5")
-                conn.commit()
-            except:
-                pass  # ستون قبلاً وجود دارد
-            # اضافه کردن ستون stop_hour برای ذخیره ساعت توقف خودکار
-            try:
-                cur.execute("ALTER TABLE manage ADD COLUMN stop_hour INTEGER")
-                conn.commit()
-            except:
-                pass  # ستون قبلاً وجود دارد
-            # اولویت پلن هزینه 1
-            try:
-                cur.execute("ALTER TABLE manage ADD COLUMN cost_priority_1 INTEGER")
-                conn.commit()
-            except:
-                pass
-            # اولویت پلن هزینه 2
-            try:
-                cur.execute("ALTER TABLE manage ADD COLUMN cost_priority_2 INTEGER")
-                conn.commit()
-            except:
-                pass
-            conn.commit()
-            cur.close()
-            conn.close()
-        except Exception as e:
-            print(f"Error creating manage table: {e}")
-
-    def cTable_web_commands(self):
-        """ایجاد جدول صف فرمان‌های پنل وب"""
-        try:
-            conn = self._get_connection()
-            cur = conn.cursor()
-            command = """
-                CREATE TABLE IF NOT EXISTS web_commands(
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    chatid INTEGER NOT NULL,
-                    command_type TEXT NOT NULL,
-                    payload TEXT,
-                    status TEXT NOT NULL DEFAULT 'pending',
-                    result TEXT,
-                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                    processed_at TEXT
-                )
-            """
-            cur.execute(command)
-            conn.commit()
-            cur.close()
-            conn.close()
-        except Exception as e:
-            print(f"Error creating web_commands table: {e}")
-
-    def cTable_web_panel_auth(self):
-        """رمز ورود پنل وب به‌ازای هر ادمین (شناسهٔ چت بله)"""
-        try:
-            conn = self._get_connection()
-            cur = conn.cursor()
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS web_panel_auth(
-                    chatid INTEGER PRIMARY KEY,
-                    pass_hash TEXT NOT NULL,
-                    updated_at TEXT DEFAULT CURRENT_TIMESTAMP
-                )
-                """
-            )
-            conn.commit()
-            cur.close()
-            conn.close()
-        except Exception as e:
-            print(f"Error creating web_panel_auth table: {e}")
-
     _PWEB_ITER = 120_000
 
     @staticmethod
@@ -609,6 +974,7 @@ class curdCommands:
                 (cid, ph, cookie),
             )
             conn.commit()
+            notify_state_change(chatid)
             cur.close()
             conn.close()
             return 0 if existed else 1
@@ -623,6 +989,7 @@ class curdCommands:
             insrt = "DELETE FROM logins WHERE phone = ? AND chatid = ?"
             cur.execute(insrt, (phone, int(chatid)))
             conn.commit()
+            notify_state_change(chatid)
             ok = cur.rowcount > 0
             cur.close()
             conn.close()
@@ -639,6 +1006,7 @@ class curdCommands:
             insrt = "DELETE FROM logins WHERE phone = ? AND chatid = ?"
             cur.execute(insrt, (phone, int(chatid)))
             conn.commit()
+            notify_state_change(chatid)
             affected = cur.rowcount
             cur.close()
             conn.close()
@@ -669,6 +1037,7 @@ class curdCommands:
             insrt = f"UPDATE manage SET {q} = ? WHERE chatid = ?"
             cur.execute(insrt, (v, chatid))
             conn.commit()
+            notify_state_change(chatid)
             cur.close()
             conn.close()
             return 1
@@ -728,7 +1097,10 @@ class curdCommands:
             cur = conn.cursor()
             insrt = "UPDATE logins SET cookie = ?, active = 1 WHERE phone = ? AND chatid = ?"
             cur.execute(insrt, (cookie, phone, int(chatid)))
+            # ورود مجدد (OTP): brand_token کش‌شدهٔ کوکی‌های قبلی این شماره باطل می‌شود
+            cur.execute("DELETE FROM brand_tokens WHERE phone = ?", (int(phone),))
             conn.commit()
+            notify_state_change(chatid)
             cur.close()
             conn.close()
             return 1
@@ -736,6 +1108,64 @@ class curdCommands:
             print(f"Error updating login: {e}")
             return 0
 
+    @staticmethod
+    def _cookie_hash(cookie):
+        return hashlib.sha256(str(cookie).encode("utf-8")).hexdigest()
+
+    def getBrandToken(self, phone, cookie):
+        """brand_token کش‌شده برای (شماره، hash کوکی) یا None"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            insrt = "SELECT brand_token FROM brand_tokens WHERE phone = ? AND cookie_hash = ?"
+            cur.execute(insrt, (int(phone), self._cookie_hash(cookie)))
+            row = cur.fetchone()
+            cur.close()
+            conn.close()
+            return row[0] if row else None
+        except Exception as e:
+            print(f"Error getting brand token: {e}")
+            return None
+
+    def setBrandToken(self, phone, cookie, brand_token):
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            insrt = """
+                INSERT INTO brand_tokens (phone, cookie_hash, brand_token, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(phone, cookie_hash) DO UPDATE SET
+                    brand_token = excluded.brand_token, updated_at = excluded.updated_at
+            """
+            cur.execute(insrt, (int(phone), self._cookie_hash(cookie), str(brand_token)))
+            conn.commit()
+            cur.close()
+            conn.close()
+            return 1
+        except Exception as e:
+            print(f"Error setting brand token: {e}")
+            return 0
+
+    def delBrandToken(self, phone, cookie=None):
+        """باطل کردن brand_token کش‌شده (مثلاً پس از پاسخ 401/403 یا ورود مجدد)"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            if cookie is None:
+                cur.execute("DELETE FROM brand_tokens WHERE phone = ?", (int(phone),))
+            else:
+                cur.execute(
+                    "DELETE FROM brand_tokens WHERE phone = ? AND cookie_hash = ?",
+                    (int(phone), self._cookie_hash(cookie)),
+                )
+            conn.commit()
+            cur.close()
+            conn.close()
+            return 1
+        except Exception as e:
+            print(f"Error deleting brand token: {e}")
+            return 0
+
     def refreshUsed(self, chatid):
         try:
             conn = self._get_connection()
@@ -743,6 +1173,7 @@ class curdCommands:
             insrt = "UPDATE logins SET used = ? WHERE chatid = ?"
             cur.execute(insrt, (0, chatid))
             conn.commit()
+            notify_state_change(chatid)
             cur.close()
             conn.close()
             return 1
@@ -757,6 +1188,7 @@ class curdCommands:
             insrt = "UPDATE logins SET used = used + ? WHERE phone = ? AND chatid = ?"
             cur.execute(insrt, (1, phone, int(chatid)))
             conn.commit()
+            notify_state_change(chatid)
             cur.close()
             conn.close()
             return 1
@@ -788,6 +1220,7 @@ class curdCommands:
             insrt = "UPDATE logins SET used = ? WHERE phone = ? AND chatid = ?"
             cur.execute(insrt, (0, phone, int(chatid)))
             conn.commit()
+            notify_state_change(chatid)
             cur.close()
             conn.close()
             return 1
@@ -844,6 +1277,7 @@ class curdCommands:
                     break
 
             conn.commit()
+            notify_state_change(chatid)
 
             if updated > 0:
                 state_txt = "فعال" if status_val == 1 else "غیرفعال"
@@ -888,6 +1322,29 @@ class curdCommands:
             print(f"Error adding sent: {e}")
             return 0
 
+    def addSentBatch(self, chatid, rows):
+        """
+        نسخهٔ دسته‌ای addSent در یک تراکنش — rows: [(token, status), ...].
+        sents.token در همهٔ چت‌ها یکتاست؛ توکن موجود (حتی برای چت دیگر) با OR IGNORE رد می‌شود و بقیهٔ دسته ثبت می‌شوند.
+        """
+        if not rows:
+            return 0
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            insrt = "INSERT OR IGNORE INTO sents (chatid, token, status) VALUES (?, ?, ?)"
+            added = 0
+            for token, status in rows:
+                cur.execute(insrt, (chatid, token, status))
+                added += cur.rowcount if cur.rowcount and cur.rowcount > 0 else 0
+            conn.commit()
+            cur.close()
+            conn.close()
+            return added
+        except Exception as e:
+            print(f"Error adding sents batch: {e}")
+            return 0
+
     def getCookies(self, chatid):
         try:
             conn = self._get_connection()
@@ -974,6 +1431,7 @@ class curdCommands:
             insrt = "UPDATE manage SET limite = ? WHERE chatid = ?"
             cur.execute(insrt, (int(newLimit), chatid))
             conn.commit()
+            notify_state_change(chatid)
             cur.close()
             conn.close()
             return 1
@@ -1067,9 +1525,9 @@ class curdCommands:
             return 0
 
     def getStats(self, chatid):
-        """دریافت آمار اگهی‌ها برای یک chatid (با جزئیات هر لاگین) - استفاده از JSON با ساختار جدید"""
+        """دریافت آمار اگهی‌ها برای یک chatid (با جزئیات هر لاگین) - از جدول token_states"""
         try:
-            from tokens_manager import get_token_stats, load_tokens_json
+            from tokens_manager import get_status_counts
             
             # دریافت شماره‌های مربوط به این chatid
             phone_numbers = self.get_phone_numbers_by_chatid(chatid=chatid)
@@ -1081,13 +1539,14 @@ class curdCommands:
             total_pending = 0
             total_failed = 0
             
-            # دریافت توکن‌ها از JSON
-            tokens_data = load_tokens_json()
-            json_tokens_by_phone = tokens_data.get(chatid, {})
+            # آمار همه شماره‌ها با یک کوئری
+            counts_by_phone = get_status_counts(chatid)
             
             for phone in phone_numbers:
-                # دریافت آمار برای این phone از JSON
-                phone_stats = get_token_stats(chatid=chatid, phone=phone)
+                try:
+                    phone_stats = counts_by_phone.get(int(phone), {})
+                except (TypeError, ValueError):
+                    phone_stats = {}
                 
                 pending_count = phone_stats.get("pending", 0)
                 success_count = phone_stats.get("success", 0)
@@ -1287,17 +1746,39 @@ class curdCommands:
             return []
 
 
-class CreateDB:
-    def __init__(self, Datas):
-        self.Datas = Datas
-        self.db_path = Datas.database
-    
-    def create(self):
-        """ایجاد فایل دیتابیس SQLite (اگر وجود نداشته باشد)"""
+    def addMessageLog(self, chatid, text, ts):
+        """ثبت یک پیام ارسالی در لاگ پنل (یک INSERT؛ حذف ردیف‌های قدیمی به صورت دوره‌ای)"""
         try:
-            # SQLite خودکار فایل را ایجاد می‌کند
-            conn = sqlite3.connect(self.db_path)
+            conn = self._get_connection()
+            cur = conn.cursor()
+            insrt = "INSERT INTO message_logs (chatid, ts, text) VALUES (?, ?, ?)"
+            cur.execute(insrt, (int(chatid) if chatid is not None else None, str(ts), str(text)))
+            log_id = cur.lastrowid
+            if log_id and log_id % MESSAGE_LOG_PRUNE_EVERY == 0:
+                cur.execute("DELETE FROM message_logs WHERE id <= ?", (log_id - MESSAGE_LOG_MAX_ROWS,))
+            conn.commit()
+            cur.close()
+            conn.close()
+            return log_id
+        except Exception as e:
+            print(f"Error adding message log: {e}")
+            return None
+
+    def getMessageLogs(self, limit=30, chatid=None):
+        """آخرین پیام‌های ارسالی (جدیدترین اول)؛ در صورت chatid فقط همان چت — (ts, text)"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            if chatid is not None:
+                insrt = "SELECT ts, text FROM message_logs WHERE chatid = ? ORDER BY id DESC LIMIT ?"
+                cur.execute(insrt, (int(chatid), int(limit)))
+            else:
+                insrt = "SELECT ts, text FROM message_logs ORDER BY id DESC LIMIT ?"
+                cur.execute(insrt, (int(limit),))
+            rows = cur.fetchall()
+            cur.close()
             conn.close()
-            print(f"Database file created/verified: {self.db_path}")
+            return rows
         except Exception as e:
-            print(f"Error creating database: {e}")
+            print(f"Error getting message logs: {e}")
+            return []
@@ -2,8 +2,95 @@
 
 import requests,json
 import time
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from requests.adapters import HTTPAdapter
 from loadConfig import configBot
-from curds import curdCommands,CreateDB
+from curds import curdCommands
+from plan_cache import PlanFetchError, get_cached_plans, get_fallback_plans, store_plans
+from post_index import (
+    apply_sync,
+    classify_posts,
+    get_snapshot,
+    needs_full_sync,
+    page_is_known,
+    parse_post_page,
+    store_snapshot,
+)
+
+# ==================== pool اتصال‌های keep-alive ====================
+# یک Session مشترک برای همه لاگین‌ها؛ اتصال‌ها به تفکیک host (api.divar.ir، api.bazaar-pay.ir، divar.ir)
+# در pool نگه داشته می‌شوند تا هر مرحلهٔ نردبان handshake جدید TLS نداشته باشد.
+_http_session = None
+_http_session_last_used = 0.0
+_http_session_lock = threading.Lock()
+
+
+def _http_pool_settings():
+    """(اندازهٔ pool برای هر host، مهلت بیکاری به ثانیه) از configs.json"""
+    try:
+        Datas = configBot()
+        return Datas.http_pool_size, Datas.http_idle_timeout
+    except Exception as e:
+        print(f"⚠️ خطا در خواندن تنظیمات pool اتصال: {e}")
+        return 10, 60.0
+
+
+def get_http_session():
+    """
+    Session مشترک requests با pool محدود.
+    اگر بیش از http_idle_timeout ثانیه استفاده نشده باشد، اتصال‌های کهنه بسته و Session تازه ساخته می‌شود.
+    """
+    global _http_session, _http_session_last_used
+    with _http_session_lock:
+        now = time.monotonic()
+        if _http_session is not None:
+            _, idle_timeout = _http_session.pool_settings
+            if now - _http_session_last_used > idle_timeout:
+                try:
+                    _http_session.close()
+                except Exception:
+                    pass
+                _http_session = None
+        if _http_session is None:
+            pool_size, idle_timeout = _http_pool_settings()
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=False)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            # Session بین لاگین‌ها مشترک است؛ کوکی‌های پاسخ نباید به درخواست لاگین دیگری نشت کنند
+            session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+            session.pool_settings = (pool_size, idle_timeout)
+            _http_session = session
+        _http_session_last_used = now
+        return _http_session
+
+
+# نمونه‌های nardeban به ازای (chatid, phone)؛ با تغییر کوکی نمونهٔ جدید ساخته می‌شود
+_nardeban_instances = {}
+_nardeban_instances_lock = threading.Lock()
+
+
+def get_nardeban(chatid, phone, cookie):
+    """نمونهٔ قابل استفادهٔ مجدد nardeban برای یک لاگین"""
+    key = (int(chatid), int(phone))
+    with _nardeban_instances_lock:
+        inst = _nardeban_instances.get(key)
+        if inst is None or inst.apikey != cookie:
+            inst = nardeban(apiKey=cookie)
+            # کلید همگام‌سازی افزایشی post-list (post_index)
+            inst.sync_key = key
+            _nardeban_instances[key] = inst
+        return inst
+
+
+def drop_nardeban(chatid, phone=None):
+    """حذف نمونه‌های کش‌شده (مثلاً پس از حذف لاگین)"""
+    with _nardeban_instances_lock:
+        for key in list(_nardeban_instances.keys()):
+            if key[0] == int(chatid) and (phone is None or key[1] == int(phone)):
+                _nardeban_instances.pop(key, None)
+# ==================== پایان pool اتصال‌ها ====================
 
 class api:
     def __init__(self):
@@ -23,7 +110,7 @@ class api:
         max_retries = 2
         for attempt in range(max_retries):
             try:
-                response = requests.post(url=url, headers=self.headers, json=data, timeout=25)
+                response = get_http_session().post(url=url, headers=self.headers, json=data, timeout=25)
                 try:
                     body = response.json()
                 except Exception:
@@ -46,7 +133,7 @@ class api:
         max_retries = 2
         for attempt in range(max_retries):
             try:
-                response = requests.post(url=url, headers=self.headers, json=data, timeout=25)
+                response = get_http_session().post(url=url, headers=self.headers, json=data, timeout=25)
                 try:
                     body = response.json()
                 except Exception:
@@ -67,6 +154,7 @@ class nardeban:
         self.apikey = apiKey
         self.Datas = configBot()
         self.curd = curdCommands(self.Datas)
+        self.sync_key = None
         # Header اصلی برای درخواست‌های نردبان
         self.headers = {
             "User-Agent": "Dalvik/2.1.0 (Linux; U; Android 13; SM-S918B Build/TP1A.220624.014)",
@@ -95,7 +183,25 @@ class nardeban:
             '_gat_UA-32884252-2': '1',
         }
 
-    def get_cost_plans(self, token):
+    def get_cost_plans(self, token, allow_fallback=False):
+        """
+        پلن‌های نرمال‌شدهٔ یک آگهی — از کش plan_cache (TTL) یا دیوار.
+        در شکست شبکه، جایگزین سطح لاگین فقط با allow_fallback (نمایش منوی پلن‌ها) برگردانده می‌شود؛
+        پلن و قیمت یک آگهی دیگر نباید به createOrderID و پرداخت برسد.
+        """
+        cached = get_cached_plans(token)
+        if cached is not None:
+            return cached
+        try:
+            plans = self._fetch_cost_plans(token)
+        except PlanFetchError:
+            fallback = get_fallback_plans(self.apikey) if allow_fallback else None
+            if fallback is not None:
+                return fallback
+            raise
+        return store_plans(token, self.apikey, plans)
+
+    def _fetch_cost_plans(self, token):
         headers = {
             "User-Agent": "Dalvik/2.1.0 (Linux; U; Android 13; SM-S918B Build/TP1A.220624.014)",
             "X-Device-Model": "SM-S918B",
@@ -113,7 +219,7 @@ class nardeban:
         
         for attempt in range(max_retries):
             try:
-                res = requests.get(f'https://api.divar.ir/v8/payment/costs/{token}',
+                res = get_http_session().get(f'https://api.divar.ir/v8/payment/costs/{token}',
                                    headers=headers, timeout=30)
                 break  # اگر موفق بود، از حلقه خارج شو
             except requests.exceptions.Timeout as e:
@@ -122,13 +228,13 @@ class nardeban:
                     time.sleep(retry_delay)
                     continue
                 else:
-                    raise ValueError(f"Request timeout after {max_retries} attempts: {str(e)}")
+                    raise PlanFetchError(f"Request timeout after {max_retries} attempts: {str(e)}")
             except requests.exceptions.RequestException as e:
-                raise ValueError(f"Request failed: {str(e)}")
+                raise PlanFetchError(f"Request failed: {str(e)}")
         
         # بررسی اینکه res تعریف شده باشد
         if res is None:
-            raise ValueError("Request failed: no response received after all retries")
+            raise PlanFetchError("Request failed: no response received after all retries")
         
         if res.status_code != 200:
             error_msg = f"HTTP {res.status_code}"
@@ -147,6 +253,8 @@ class nardeban:
             except Exception:
                 error_text = res.text[:200] if res.text else "No response body"
                 error_msg += f": {error_text}"
+            if res.status_code >= 500 or res.status_code == 429:
+                raise PlanFetchError(error_msg)
             raise ValueError(error_msg)
         
         try:
@@ -227,7 +335,7 @@ class nardeban:
         
         for attempt in range(max_retries):
             try:
-                response = requests.post(
+                response = get_http_session().post(
                     f'https://api.divar.ir/v8/payment/start/post/{token}',
                     headers=self.headers,
                     json=json_data,
@@ -293,9 +401,9 @@ class nardeban:
         return order_id
 
     def createFlow(self,order):
-        requests.get(f'https://api.divar.ir/v8/paymentcore/flow/{order}', headers=self.headers)
+        get_http_session().get(f'https://api.divar.ir/v8/paymentcore/flow/{order}', headers=self.headers)
     def createCheckOut(self,order):
-        response = requests.get(f'https://api.divar.ir/v8/paymentcore/bazaarpay/initiate/{order}',
+        response = get_http_session().get(f'https://api.divar.ir/v8/paymentcore/bazaarpay/initiate/{order}',
                                 headers=self.headers)
         try:
             if response.status_code != 200:
@@ -326,13 +434,13 @@ class nardeban:
             'method': 'enough_balance',
             'redirect_url': f'https://cafebazaar.ir/bazaar-pay/payment/status?token={checkout}&phone=98{number}&callback=%7B%22url%22%3A%22https%3A%2F%2Fapi.divar.ir%2Fv8%2Fpaymentcore%2Fbazaarpay%2Fcallback%2F{orderid}%22%2C%22method%22%3A%22post%22%2C%22data%22%3A%7B%7D%7D&auth_mode=authenticated_token',
         }
-        requests.post('https://api.bazaar-pay.ir/badje/v1/pay/', params=params, headers=headers,
+        get_http_session().post('https://api.bazaar-pay.ir/badje/v1/pay/', params=params, headers=headers,
                                  json=json_data)
     def promote(self,orderid,token):
-        a = requests.get(url=f'https://divar.ir/real-estate/admin/posts/{token}/promote?payment_order_id={orderid}',
+        a = get_http_session().get(url=f'https://divar.ir/real-estate/admin/posts/{token}/promote?payment_order_id={orderid}',
                          headers=self.headers)
     def isValidPost(self,uid):
-        response = requests.get(
+        response = get_http_session().get(
             f'https://api.divar.ir/v8/post-management-page/web-page/{uid}',
             headers=self.headers,
         )
@@ -356,7 +464,7 @@ class nardeban:
                 'last_item_identifier': '',
             },
         }
-        response = requests.post(f'https://api.divar.ir/v8/premium-user/web/business/{brantToken}/post-list',
+        response = get_http_session().post(f'https://api.divar.ir/v8/premium-user/web/business/{brantToken}/post-list',
                                  headers=self.headers, json=json_data)
         res = response.json()
         for i in res['page']['widget_list']:
@@ -371,28 +479,27 @@ class nardeban:
                         tokens.append(token)
         return tokens
 
-    def _fetch_tokens_by_keywords(self, keywords, brand_token=None):
+    def sync_posts(self, brand_token, force_full=False):
         """
-        Helper برای دریافت آگهی‌ها که برچسب‌شان شامل هر یک از کلمات کلیدی باشد.
+        پیمایش post-list؛ خروجی همهٔ آگهی‌ها [(token, label, title), ...] به ترتیب فید.
+        برای نمونه‌های get_nardeban (sync_key) پیمایش افزایشی است: با رسیدن به صفحه‌ای که همهٔ
+        آگهی‌هایش بدون تغییر در post_index هستند متوقف می‌شود و بقیه از post_index خوانده می‌شود.
+        force_full (تمدید / منقضی) کل فید را پیمایش می‌کند.
         """
-        if not brand_token:
-            brand_token = self.getBranToken()
-        if not brand_token:
-            return []
+        return self._sync_posts(brand_token, force_full)[0]
 
-        headers = {
-            "User-Agent": "Dalvik/2.1.0 (Linux; U; Android 13; SM-S918B Build/TP1A.220624.014)",
-            "X-Device-Model": "SM-S918B",
-            "X-OS-Version": "13",
-            "X-Platform": "android",
-            "Content-Type": "application/json",
-            "Accept": "*/*",
-            'Authorization': f'Basic {self.apikey}',
-        }
+    def _sync_posts(self, brand_token, force_full=False):
+        """(ردیف‌ها، آیا کل فید بدون خطا پیمایش شد)"""
+        incremental = self.sync_key is not None
+        full = True
+        if incremental:
+            chatid, phone = self.sync_key
+            full = force_full or needs_full_sync(chatid, phone, brand_token)
 
         last_item_identifier = ''
-        matched_tokens = []
-
+        fetched = []
+        complete = True
+        refreshed = False
         while True:
             json_data = {
                 'brand_token': brand_token,
@@ -401,117 +508,102 @@ class nardeban:
                     'last_item_identifier': last_item_identifier,
                 },
             }
-
-            response = requests.post(
+            response = get_http_session().post(
                 f'https://api.divar.ir/v8/premium-user/web/business/{brand_token}/post-list',
-                headers=headers,
+                headers=self.headers,
                 json=json_data
             )
-
             if response.status_code != 200:
-                print(f"[fetch_tokens_by_keywords] HTTP {response.status_code} برای brand_token {brand_token}")
+                print(f"[post-list] HTTP {response.status_code} برای brand_token {brand_token}")
+                if response.status_code in (401, 403) and incremental and not refreshed:
+                    # brand_token کش‌شده باطل شده؛ یک‌بار با توکن تازه از اول پیمایش می‌شود
+                    self.curd.delBrandToken(phone=phone, cookie=self.apikey)
+                    refreshed = True
+                    fresh = self.getBranToken()
+                    if fresh:
+                        brand_token = fresh
+                        full = force_full or needs_full_sync(chatid, phone, brand_token)
+                        last_item_identifier = ''
+                        fetched = []
+                        continue
+                complete = False
                 break
 
-            data = response.json()
-            widgets = data.get('page', {}).get('widget_list', [])
-
-            for widget in widgets:
-                if widget.get('widget_type') != 'POST_ROW':
-                    continue
-                token = widget.get('uid')
-                label = (widget.get('data', {}) or {}).get('label', '') or ''
-
-                label_str = str(label)
-                normalized_label = label_str.replace('‌', '').replace('ٔ', '').replace(' ', '')
-                normalized_lower = normalized_label.lower()
-
-                if any(keyword in normalized_lower for keyword in keywords):
-                    matched_tokens.append({
-                        'token': token,
-                        'label': label_str,
-                        'title': widget.get('data', {}).get('title', '')
-                    })
-
-            infinite_scroll_response = data.get('page', {}).get('infinite_scroll_response', {})
-            has_next = infinite_scroll_response.get('last_item_identifier')
+            rows, has_next = parse_post_page(response.json())
+            fetched.extend(rows)
+            if incremental and not full and page_is_known(chatid, phone, brand_token, rows):
+                break
             if not has_next:
                 break
-
             last_item_identifier = has_next
 
-        return matched_tokens
-
-    def get_all_tokens(self, brand_token):
-        headers = {
-            "User-Agent": "Dalvik/2.1.0 (Linux; U; Android 13; SM-S918B Build/TP1A.220624.014)",
-            "X-Device-Model": "SM-S918B",
-            "X-OS-Version": "13",
-            "X-Platform": "android",
-            "Content-Type": "application/json",
-            "Accept": "*/*",
-            'Authorization': f'Basic {self.apikey}',
-        }
-
-        last_item_identifier = ''
-        all_tokens = []
-        while True:
-            json_data = {
-                'brand_token': brand_token,
-                'specification': {
-                    'query': '',
-                    'last_item_identifier': last_item_identifier,
-                },
-            }
-
-            response = requests.post(f'https://api.divar.ir/v8/premium-user/web/business/{brand_token}/post-list',
-                                     headers=headers, json=json_data)
+        if not incremental:
+            return fetched, complete
+        if not complete and not fetched:
+            # خطای دسترسی (مثلاً کوکی منقضی) — مثل قبل چیزی برنگردان
+            return [], False
+        rows = apply_sync(
+            chatid, phone, brand_token, fetched,
+            full=full and complete,
+            last_item_identifier=last_item_identifier or None,
+        )
+        return rows, full and complete
 
-            if response.status_code == 200:
-                data = response.json()
-                widgets = data.get('page', {}).get('widget_list', [])
-                # استخراج توکن‌ها از widget_list
-                for widget in widgets:
-                    if widget.get('widget_type') == 'POST_ROW' and widget.get('data', {}).get('label') == "منتشر شده":
-                        token = widget['uid']
-                        if token:
-                            all_tokens.append(token)
-
-                infinite_scroll_response = data.get('page', {}).get('infinite_scroll_response', {})
-                has_next = infinite_scroll_response.get('last_item_identifier')
-                if not has_next:
-                    break  # اگر has_next False باشد، از حلقه خارج می‌شود
-
-                last_item_identifier = has_next  # به‌روزرسانی برای درخواست بعدی
-            else:
-                print(f"Error: {response.status_code}")
-                break
+    def post_snapshot(self, brand_token, full=False):
+        """
+        یک پیمایش post-list برای هر سه مسیر (استخراج، نیاز به تمدید، منقضی)؛
+        نتیجهٔ دسته‌بندی‌شده برای نمونه‌های get_nardeban تا post_snapshot_ttl کش می‌شود.
+        full=True (تمدید / منقضی) فقط snapshot پیمایش کامل را می‌پذیرد و در غیر این صورت کل فید را پیمایش می‌کند.
+        """
+        if self.sync_key is None:
+            return classify_posts(self.sync_posts(brand_token))
+        chatid, phone = self.sync_key
+        snapshot = get_snapshot(chatid, phone, brand_token, require_full=full)
+        if snapshot is not None:
+            return snapshot
+        rows, walked_full = self._sync_posts(brand_token, force_full=full)
+        snapshot = classify_posts(rows)
+        # خطای دریافت (لیست خالی) کش نمی‌شود
+        return store_snapshot(chatid, phone, brand_token, snapshot, full=walked_full) if rows else snapshot
 
-        return all_tokens
+    def get_all_tokens(self, brand_token):
+        return list(self.post_snapshot(brand_token)["published"])
 
     def get_tokens_needing_renewal(self, brand_token=None):
         """
         آگهی‌هایی که به زودی نیاز به تمدید دارند (قبل از منقضی شدن).
         """
-        keywords = ['تمدید', 'نیازبهتمدید', 'نیاز به تمدید', 'انقضا', 'expire', 'renew']
-        normalized_keywords = [kw.replace('‌', '').replace(' ', '').lower() for kw in keywords]
-        return self._fetch_tokens_by_keywords(normalized_keywords, brand_token=brand_token)
+        if not brand_token:
+            brand_token = self.getBranToken()
+        if not brand_token:
+            return []
+        return list(self.post_snapshot(brand_token, full=True)["renewal"])
 
     def get_expired_tokens(self, brand_token=None):
         """
         آگهی‌هایی که وضعیت‌شان منقضی شده است.
         """
-        keywords = ['منقضی', 'expired']
-        normalized_keywords = [kw.replace('‌', '').replace(' ', '').lower() for kw in keywords]
-        return self._fetch_tokens_by_keywords(normalized_keywords, brand_token=brand_token)
+        if not brand_token:
+            brand_token = self.getBranToken()
+        if not brand_token:
+            return []
+        return list(self.post_snapshot(brand_token, full=True)["expired"])
 
     def getBranToken(self):
+        # brand_token برای یک کوکی تقریباً ثابت است؛ برای نمونه‌های get_nardeban از کش دیتابیس خوانده می‌شود
+        if self.sync_key is not None:
+            cached = self.curd.getBrandToken(phone=self.sync_key[1], cookie=self.apikey)
+            if cached:
+                return cached
         try:
-            response = requests.get('https://api.divar.ir/v8/premium-user/web/get-business-list-web', headers=self.headers)
+            response = get_http_session().get('https://api.divar.ir/v8/premium-user/web/get-business-list-web', headers=self.headers)
             bToken = response.json()['business_data_list'][0]['brand_token']
         except Exception as e:
             print(e)
             return None
         else:
+            if self.sync_key is not None and bToken:
+                self.curd.setBrandToken(phone=self.sync_key[1], cookie=self.apikey, brand_token=bToken)
             return bToken
 
     def sendNardeban(self, number, chatid, priority_1=None, priority_2=None):
@@ -671,7 +763,7 @@ class nardeban:
                 "page": page
             }
             
-            response = requests.get(
+            response = get_http_session().get(
                 url,
                 headers=self.headers,
                 cookies=self.cookies,
@@ -0,0 +1,682 @@
+# This Python file uses the following encoding: utf-8
+"""
+نسخهٔ asyncio کلاینت نردبان دیوار (بر پایهٔ httpx.AsyncClient).
+
+همان خط لولهٔ dapi.nardeban (selectPlan → createOrderID → createFlow → createCheckOut → pay → promote)
+و استخراج توکن‌ها (getBranToken / get_all_tokens) را بدون مسدود کردن event loop اجرا می‌کند؛
+retryها با asyncio.sleep انجام می‌شوند تا jobهای بقیهٔ ادمین‌ها و polling بله متوقف نشوند.
+خروجی‌ها دقیقاً هم‌شکل نسخهٔ همگام هستند: [1, token, number] / [0, token, "stage: err"] / [2, msg]
+"""
+
+import asyncio
+import time
+
+import httpx
+
+import metrics
+from loadConfig import configBot, get_config
+from curds import curdCommands
+from promotion_journal import PromotionAttempt, note_http
+from plan_cache import PlanFetchError, get_cached_plans, get_fallback_plans, store_plans
+from post_index import (
+    apply_sync,
+    classify_posts,
+    get_snapshot,
+    needs_full_sync,
+    page_is_known,
+    parse_post_page,
+    store_snapshot,
+)
+
+DIVAR_API_BASE = "https://api.divar.ir"
+BAZAAR_PAY_URL = "https://api.bazaar-pay.ir/badje/v1/pay/"
+
+_BASE_HEADERS = {
+    "User-Agent": "Dalvik/2.1.0 (Linux; U; Android 13; SM-S918B Build/TP1A.220624.014)",
+    "X-Device-Model": "SM-S918B",
+    "X-OS-Version": "13",
+    "X-Platform": "android",
+    "Content-Type": "application/json",
+    "Accept": "*/*",
+}
+
+# کلاینت مشترک؛ به event loop جاری وابسته است و در صورت تغییر loop (ری‌استارت polling) از نو ساخته می‌شود
+_client = None
+_client_loop = None
+
+
+def _pool_limits():
+    """محدودیت‌های pool از configs.json (http_pool_size / http_idle_timeout)"""
+    try:
+        Datas = configBot()
+        pool_size, idle_timeout = Datas.http_pool_size, Datas.http_idle_timeout
+    except Exception as e:
+        print(f"⚠️ خطا در خواندن تنظیمات pool اتصال: {e}")
+        pool_size, idle_timeout = 10, 60.0
+    return httpx.Limits(
+        max_connections=pool_size * 3,
+        max_keepalive_connections=pool_size,
+        keepalive_expiry=idle_timeout,
+    )
+
+
+def get_async_client():
+    """کلاینت httpx مشترک برای event loop جاری (pool محدود keep-alive به تفکیک host)"""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, connect=10.0),
+            limits=_pool_limits(),
+        )
+        _client_loop = loop
+    return _client
+
+
+async def close_async_client():
+    """بستن کلاینت مشترک (در on_shutdown ربات)"""
+    global _client, _client_loop
+    client = _client
+    _client = None
+    _client_loop = None
+    if client is not None and not client.is_closed:
+        try:
+            await client.aclose()
+        except Exception as e:
+            print(f"⚠️ خطا در بستن کلاینت async دیوار: {e}")
+
+
+# محدودیت نرخ به تفکیک host: درخواست‌های هم‌زمان چند لاگین با فاصلهٔ حداقلی ارسال می‌شوند
+DEFAULT_HOST_RPS = 5.0
+DEFAULT_EXTRACT_CONCURRENCY = 4
+_host_next_slot = {}
+
+
+def _host_min_interval():
+    """فاصلهٔ حداقل بین دو درخواست به یک host (ثانیه) از divar_host_rps؛ 0 یعنی بدون محدودیت"""
+    try:
+        rps = float(get_config().get("divar_host_rps", DEFAULT_HOST_RPS))
+    except Exception:
+        rps = DEFAULT_HOST_RPS
+    return 1.0 / rps if rps > 0 else 0.0
+
+
+async def _throttle_host(host):
+    """رزرو نوبت بعدی host و انتظار تا آن لحظه (بدون قفل؛ همه در یک event loop)"""
+    interval = _host_min_interval()
+    if interval <= 0:
+        return
+    now = asyncio.get_running_loop().time()
+    slot = max(now, _host_next_slot.get(host, 0.0))
+    _host_next_slot[host] = slot + interval
+    if slot > now:
+        await asyncio.sleep(slot - now)
+
+
+def _extract_concurrency():
+    try:
+        return max(1, int(get_config().get("extract_concurrency", DEFAULT_EXTRACT_CONCURRENCY)))
+    except Exception:
+        return DEFAULT_EXTRACT_CONCURRENCY
+
+
+# نمونه‌های nardebanAsync به ازای (chatid, phone)؛ با تغییر کوکی نمونهٔ جدید ساخته می‌شود
+_instances = {}
+
+
+def get_nardeban_async(chatid, phone, cookie):
+    """نمونهٔ قابل استفادهٔ مجدد nardebanAsync برای یک لاگین (بدون خواندن دوبارهٔ configs در هر tick)"""
+    key = (int(chatid), int(phone))
+    inst = _instances.get(key)
+    if inst is None or inst.apikey != cookie:
+        inst = nardebanAsync(apiKey=cookie)
+        # کلید همگام‌سازی افزایشی post-list (post_index)
+        inst.sync_key = key
+        _instances[key] = inst
+    return inst
+
+
+def drop_nardeban_async(chatid, phone=None):
+    """حذف نمونه‌های کش‌شده (مثلاً پس از حذف لاگین)"""
+    for key in list(_instances.keys()):
+        if key[0] == int(chatid) and (phone is None or key[1] == int(phone)):
+            _instances.pop(key, None)
+
+
+def _http_error_message(response):
+    """ساخت پیام خطای خوانا از پاسخ غیر 200 (هم‌ارز منطق dapi.nardeban)"""
+    error_msg = f"HTTP {response.status_code}"
+    try:
+        error_data = response.json()
+        if isinstance(error_data, dict):
+            if 'error' in error_data:
+                detail = error_data.get('error', {})
+                if isinstance(detail, dict):
+                    error_msg += f": {detail.get('message', detail.get('type', detail.get('code', 'Unknown error')))}"
+                elif isinstance(detail, str):
+                    error_msg += f": {detail}"
+                else:
+                    error_msg += f": {str(error_data.get('message', response.text[:150]))}"
+            elif 'message' in error_data:
+                error_msg += f": {error_data.get('message')}"
+            else:
+                error_msg += f": {str(error_data)[:150]}"
+        else:
+            error_msg += f": {str(error_data)[:150]}"
+    except Exception:
+        error_text = response.text[:200] if response.text else "No response body"
+        error_msg += f": {error_text}"
+    return error_msg
+
+
+class nardebanAsync:
+    def __init__(self, apiKey):
+        self.apikey = apiKey
+        self.Datas = configBot()
+        self.curd = curdCommands(self.Datas)
+        self.sync_key = None
+        self.headers = dict(_BASE_HEADERS)
+        self.headers['Authorization'] = f'Basic {str(self.apikey)}'
+
+    async def _request(self, method, url, *, headers=None, max_retries=3, retry_delay=2, **kwargs):
+        """
+        ارسال درخواست با retry غیرمسدودکننده.
+        فقط خطاهای timeout/اتصال دوباره تلاش می‌شوند (backoff نمایی)؛ بقیه ValueError می‌شوند.
+        """
+        client = get_async_client()
+        host = httpx.URL(url).host
+        for attempt in range(max_retries):
+            await _throttle_host(host)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, headers=headers or self.headers, **kwargs)
+                note_http(status=response.status_code)
+                metrics.observe("probot_divar_http_seconds", time.perf_counter() - started, host=host)
+                metrics.inc("probot_divar_http_requests_total", host=host, status=response.status_code)
+                return response
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                note_http(error=e)
+                metrics.observe("probot_divar_http_seconds", time.perf_counter() - started, host=host)
+                metrics.inc("probot_divar_http_requests_total", host=host, status="error")
+                if attempt < max_retries - 1:
+                    await asyncio.sleep(retry_delay * (2 ** attempt))
+                    continue
+                raise ValueError(f"Request timeout after {max_retries} attempts: {str(e)}")
+            except httpx.HTTPError as e:
+                raise ValueError(f"Request failed: {str(e)}")
+        raise ValueError("Request failed: no response received after all retries")
+
+    async def get_cost_plans(self, token, allow_fallback=False):
+        """
+        پلن‌های نرمال‌شده — کش plan_cache مشترک با نسخهٔ همگام (منوی پلن‌ها و نردبان).
+        جایگزین سطح لاگین فقط با allow_fallback (نمایش منو) برگردانده می‌شود، نه برای پرداخت.
+        """
+        cached = get_cached_plans(token)
+        if cached is not None:
+            return cached
+        try:
+            plans = await self._fetch_cost_plans(token)
+        except PlanFetchError:
+            fallback = get_fallback_plans(self.apikey) if allow_fallback else None
+            if fallback is not None:
+                return fallback
+            raise
+        return store_plans(token, self.apikey, plans)
+
+    async def _fetch_cost_plans(self, token):
+        try:
+            res = await self._request("GET", f'{DIVAR_API_BASE}/v8/payment/costs/{token}')
+        except ValueError as e:
+            raise PlanFetchError(str(e))
+        if res.status_code != 200:
+            if res.status_code >= 500 or res.status_code == 429:
+                raise PlanFetchError(_http_error_message(res))
+            raise ValueError(_http_error_message(res))
+
+        try:
+            response_data = res.json()
+        except Exception as e:
+            raise ValueError(f"invalid costs response: {str(e)}")
+
+        if not isinstance(response_data, dict) or 'costs' not in response_data:
+            raise ValueError(f"costs not found in response: {response_data}")
+
+        costs = response_data['costs']
+        if not isinstance(costs, list):
+            raise ValueError(f"costs is not a list: {type(costs)}")
+        if len(costs) == 0:
+            raise ValueError("no costs/plans available for this post")
+
+        normalized = []
+        for row in costs:
+            if not isinstance(row, dict):
+                continue
+            pid = row.get("id")
+            if pid is None:
+                continue
+            try:
+                pid_int = int(pid)
+            except Exception:
+                continue
+            normalized.append(
+                {
+                    "id": pid_int,
+                    "available": bool(row.get("available", False)),
+                    "name": str(row.get("title") or row.get("name") or f"پلن {pid_int}"),
+                    "price": row.get("price"),
+                }
+            )
+        if not normalized:
+            raise ValueError("no valid cost plans in response")
+        return normalized
+
+    async def selectPlan(self, token, priority_1=None, priority_2=None):
+        plans = await self.get_cost_plans(token)
+        available_ids = [p["id"] for p in plans if p.get("available")]
+        if not available_ids:
+            raise ValueError("no available plans for this post")
+
+        preferred = []
+        for raw in (priority_1, priority_2):
+            if raw is None or raw == "":
+                continue
+            try:
+                preferred.append(int(raw))
+            except Exception:
+                continue
+
+        for pid in preferred:
+            if pid in available_ids:
+                return pid
+
+        # fallback: همان رفتار نسخهٔ همگام (اگر اندیس 2 موجود و available بود)
+        if len(plans) >= 3 and plans[2].get("available") and plans[2].get("id"):
+            return int(plans[2]["id"])
+        return int(available_ids[0])
+
+    async def createOrderID(self, token, planPrice):
+        json_data = {
+            'cost_ids': [
+                planPrice,
+            ],
+            'cost_to_option': {
+            },
+        }
+        response = await self._request("POST", f'{DIVAR_API_BASE}/v8/payment/start/post/{token}', json=json_data)
+        if response.status_code != 200:
+            raise ValueError(_http_error_message(response))
+
+        try:
+            response_data = response.json()
+        except Exception as e:
+            raise ValueError(f"invalid response: {str(e)}")
+
+        if not isinstance(response_data, dict):
+            raise ValueError(f"response is not a dict: {type(response_data)}")
+        if 'order_id' not in response_data:
+            raise ValueError(f"order_id not found in response: {response_data}")
+
+        order_id = response_data.get('order_id')
+        if not order_id:
+            raise ValueError("order_id is empty or None")
+        return order_id
+
+    async def createFlow(self, order):
+        # ساخت flow پرداخت روی سرور حالت می‌سازد؛ timeout یعنی شاید اعمال شده باشد، پس retry نمی‌شود
+        await self._request("GET", f'{DIVAR_API_BASE}/v8/paymentcore/flow/{order}', max_retries=1)
+
+    async def createCheckOut(self, order):
+        response = await self._request("GET", f'{DIVAR_API_BASE}/v8/paymentcore/bazaarpay/initiate/{order}')
+        try:
+            if response.status_code != 200:
+                print(f"Error in createCheckOut: status code {response.status_code}")
+                raise Exception(f"HTTP {response.status_code}")
+            data = response.json()
+            if 'checkout_token' not in data:
+                raise Exception("checkout_token not found in response")
+            return data['checkout_token']
+        except Exception as e:
+            print(f"Error in createCheckOut: {e}")
+            raise
+
+    async def pay(self, orderid, checkout, number):
+        params = {
+            'checkout_token': checkout,
+        }
+        json_data = {
+            'checkout_token': checkout,
+            'method': 'enough_balance',
+            'redirect_url': f'https://cafebazaar.ir/bazaar-pay/payment/status?token={checkout}&phone=98{number}&callback=%7B%22url%22%3A%22https%3A%2F%2Fapi.divar.ir%2Fv8%2Fpaymentcore%2Fbazaarpay%2Fcallback%2F{orderid}%22%2C%22method%22%3A%22post%22%2C%22data%22%3A%7B%7D%7D&auth_mode=authenticated_token',
+        }
+        # مثل nardeban.pay فقط یک‌بار: ReadTimeout روی پرداخت معمولاً یعنی سرور درخواست را گرفته و retry دوباره کسر می‌کند
+        await self._request(
+            "POST", BAZAAR_PAY_URL, headers=dict(_BASE_HEADERS), params=params, json=json_data, max_retries=1,
+        )
+
+    async def promote(self, orderid, token):
+        await self._request(
+            "GET",
+            f'https://divar.ir/real-estate/admin/posts/{token}/promote?payment_order_id={orderid}',
+            max_retries=1,
+        )
+
+    async def getBranToken(self):
+        if self.sync_key is not None:
+            cached = self.curd.getBrandToken(phone=self.sync_key[1], cookie=self.apikey)
+            if cached:
+                return cached
+        try:
+            response = await self._request("GET", f'{DIVAR_API_BASE}/v8/premium-user/web/get-business-list-web')
+            bToken = response.json()['business_data_list'][0]['brand_token']
+        except Exception as e:
+            print(e)
+            return None
+        else:
+            if self.sync_key is not None and bToken:
+                self.curd.setBrandToken(phone=self.sync_key[1], cookie=self.apikey, brand_token=bToken)
+            return bToken
+
+    async def sync_posts(self, brand_token, force_full=False):
+        """پیمایش post-list (افزایشی برای نمونه‌های get_nardeban_async) — هم‌ارز nardeban.sync_posts"""
+        return (await self._sync_posts(brand_token, force_full))[0]
+
+    async def _sync_posts(self, brand_token, force_full=False):
+        """(ردیف‌ها، آیا کل فید بدون خطا پیمایش شد)"""
+        incremental = self.sync_key is not None
+        full = True
+        if incremental:
+            chatid, phone = self.sync_key
+            full = force_full or needs_full_sync(chatid, phone, brand_token)
+
+        last_item_identifier = ''
+        fetched = []
+        complete = True
+        refreshed = False
+        while True:
+            json_data = {
+                'brand_token': brand_token,
+                'specification': {
+                    'query': '',
+                    'last_item_identifier': last_item_identifier,
+                },
+            }
+            response = await self._request(
+                "POST",
+                f'{DIVAR_API_BASE}/v8/premium-user/web/business/{brand_token}/post-list',
+                json=json_data,
+            )
+            if response.status_code != 200:
+                print(f"Error: {response.status_code}")
+                if response.status_code in (401, 403) and incremental and not refreshed:
+                    # brand_token کش‌شده باطل شده؛ یک‌بار با توکن تازه از اول پیمایش می‌شود
+                    self.curd.delBrandToken(phone=phone, cookie=self.apikey)
+                    refreshed = True
+                    fresh = await self.getBranToken()
+                    if fresh:
+                        brand_token = fresh
+                        full = force_full or needs_full_sync(chatid, phone, brand_token)
+                        last_item_identifier = ''
+                        fetched = []
+                        continue
+                complete = False
+                break
+
+            rows, has_next = parse_post_page(response.json())
+            fetched.extend(rows)
+            if incremental and not full and page_is_known(chatid, phone, brand_token, rows):
+                break
+            if not has_next:
+                break
+            last_item_identifier = has_next
+
+        if not incremental:
+            return fetched, complete
+        if not complete and not fetched:
+            return [], False
+        rows = apply_sync(
+            chatid, phone, brand_token, fetched,
+            full=full and complete,
+            last_item_identifier=last_item_identifier or None,
+        )
+        return rows, full and complete
+
+    async def post_snapshot(self, brand_token, full=False):
+        """snapshot دسته‌بندی‌شدهٔ post-list (مشترک با نسخهٔ همگام تا post_snapshot_ttl)؛ full مثل nardeban.post_snapshot"""
+        if self.sync_key is None:
+            return classify_posts(await self.sync_posts(brand_token))
+        chatid, phone = self.sync_key
+        snapshot = get_snapshot(chatid, phone, brand_token, require_full=full)
+        if snapshot is not None:
+            return snapshot
+        rows, walked_full = await self._sync_posts(brand_token, force_full=full)
+        snapshot = classify_posts(rows)
+        return store_snapshot(chatid, phone, brand_token, snapshot, full=walked_full) if rows else snapshot
+
+    async def get_all_tokens(self, brand_token):
+        return list((await self.post_snapshot(brand_token))["published"])
+
+    async def _stage(self, coro, timeout, journal=None, name=None):
+        """اجرای یک مرحله با timeout اختیاری (برای نردبان گروهی)؛ با journal زمان و وضعیت مرحله ثبت می‌شود"""
+        handle = journal.begin(name) if journal is not None else None
+        try:
+            if timeout is None:
+                result = await coro
+            else:
+                try:
+                    result = await asyncio.wait_for(coro, timeout)
+                except asyncio.TimeoutError:
+                    raise ValueError(f"stage timeout after {timeout}s")
+        except Exception as e:
+            if handle is not None:
+                journal.end(handle, e)
+            raise
+        if handle is not None:
+            journal.end(handle)
+        return result
+
+    def _record_sent(self, chatid, token, status, sent_log):
+        # در نردبان گروهی رکوردها جمع و یکجا ثبت می‌شوند
+        if sent_log is not None:
+            sent_log.append((token, status))
+        else:
+            self.curd.addSent(token=token, chatid=chatid, status=status)
+
+    async def _run_pipeline(self, number, chatid, token, priority_1=None, priority_2=None, *,
+                            stage_timeout=None, sent_log=None):
+        """شش مرحلهٔ نردبان برای یک توکن با ثبت در ژورنال تلاش‌ها (promotion_journal)"""
+        journal = PromotionAttempt(chatid, number, token, mode="single" if sent_log is None else "bulk")
+        try:
+            result = await self._run_stages(
+                number, chatid, token, priority_1, priority_2, stage_timeout, sent_log, journal)
+        except Exception as e:
+            journal.finish([0, token, str(e).strip() or type(e).__name__])
+            raise
+        journal.finish(result)
+        return result
+
+    async def _run_stages(self, number, chatid, token, priority_1, priority_2, stage_timeout, sent_log, journal):
+        """شش مرحلهٔ نردبان برای یک توکن؛ در هر شکست addSent(failed) ثبت می‌شود (یا در sent_log)"""
+        try:
+            planCost = int(await self._stage(
+                self.selectPlan(token=token, priority_1=priority_1, priority_2=priority_2), stage_timeout, journal, "selectPlan"))
+        except Exception as e:
+            error_msg = str(e).strip() or "Unknown error"
+            print(f"selectPlan error for token {token}: {error_msg}")
+            self._record_sent(chatid, token, "failed", sent_log)
+            return [0, token, f"selectPlan: {error_msg[:150]}"]
+
+        try:
+            orderId = await self._stage(self.createOrderID(token=token, planPrice=planCost), stage_timeout, journal, "createOrderID")
+        except Exception as e:
+            error_msg = str(e).strip() or "Unknown error"
+            print(f"createOrderID error for token {token}: {error_msg}")
+            self._record_sent(chatid, token, "failed", sent_log)
+            return [0, token, f"createOrderID: {error_msg[:150]}"]
+
+        try:
+            await self._stage(self.createFlow(order=orderId), stage_timeout, journal, "createFlow")
+        except Exception as e:
+            print(e)
+            self._record_sent(chatid, token, "failed", sent_log)
+            return [0, token, "createFlow"]
+
+        try:
+            checkout = await self._stage(self.createCheckOut(order=orderId), stage_timeout, journal, "createCheckOut")
+        except Exception as e:
+            print(e)
+            self._record_sent(chatid, token, "failed", sent_log)
+            return [0, token, "createCheckOut"]
+
+        # pay و promote بدون timeout مرحله: لغو پس از ارسال درخواست پرداخت توکن را failed می‌کرد و تمدید بعدی
+        # دوباره پول می‌داد؛ این دو مرحله فقط به timeout کلاینت HTTP تکیه می‌کنند
+        try:
+            await self._stage(self.pay(orderid=orderId, checkout=checkout, number=str(number)), None, journal, "pay")
+        except Exception as e:
+            print(e)
+            self._record_sent(chatid, token, "failed", sent_log)
+            return [0, token, "pay"]
+
+        try:
+            await self._stage(self.promote(orderid=orderId, token=token), None, journal, "promote")
+        except Exception as e:
+            print(e)
+            self._record_sent(chatid, token, "failed", sent_log)
+            return [0, token, "promote"]
+
+        # فقط در صورت موفقیت کامل، توکن را به عنوان success ذخیره می‌کنیم
+        self._record_sent(chatid, token, "success", sent_log)
+        return [1, token, number]
+
+    async def sendNardeban(self, number, chatid, priority_1=None, priority_2=None):
+        from tokens_manager import get_tokens_from_json
+
+        tokens = get_tokens_from_json(chatid=chatid, phone=int(number), status="pending")
+        token = tokens[0] if tokens else None
+        if not token:
+            return [2, "هیچ اگهی برای نردبان پیدا نشد."]
+        return await self._run_pipeline(number, chatid, token, priority_1=priority_1, priority_2=priority_2)
+
+    async def sendNardebanWithToken(self, number, chatid, token, require_pending=True, priority_1=None, priority_2=None):
+        """نردبان یک توکن خاص"""
+        if require_pending:
+            pending_tokens = self.curd.get_pending_tokens_by_phone(phone=number, chatid=chatid)
+            if token not in pending_tokens:
+                return [0, token, "این توکن قبلاً نردبان شده است"]
+        return await self._run_pipeline(number, chatid, token, priority_1=priority_1, priority_2=priority_2)
+
+
+# نردبان گروهی (تمدید همهٔ آگهی‌های نیازمند تمدید/منقضی)
+DEFAULT_BULK_PER_LOGIN = 3
+DEFAULT_BULK_CONCURRENCY = 8
+DEFAULT_STAGE_TIMEOUT = 45
+
+
+def _bulk_settings():
+    """(سقف هم‌زمانی هر لاگین، سقف کل، timeout هر مرحله) از configs.json"""
+    config = get_config()
+    try:
+        per_login = max(1, int(config.get("bulk_promote_per_login", DEFAULT_BULK_PER_LOGIN)))
+    except Exception:
+        per_login = DEFAULT_BULK_PER_LOGIN
+    try:
+        total = max(1, int(config.get("bulk_promote_concurrency", DEFAULT_BULK_CONCURRENCY)))
+    except Exception:
+        total = DEFAULT_BULK_CONCURRENCY
+    try:
+        stage_timeout = float(config.get("promote_stage_timeout", DEFAULT_STAGE_TIMEOUT))
+    except Exception:
+        stage_timeout = DEFAULT_STAGE_TIMEOUT
+    return per_login, total, (stage_timeout if stage_timeout > 0 else None)
+
+
+async def promote_tokens_bulk(chatid, jobs, *, progress=None, progress_every=5.0):
+    """
+    نردبان هم‌زمان گروهی از توکن‌ها از خط لولهٔ شش‌مرحله‌ای.
+    jobs: [(phone, cookie, token), ...] — سقف هم‌زمانی به ازای هر لاگین و کل، timeout برای هر مرحله.
+    sents و token_states به صورت دسته‌ای (در هر گزارش پیشرفت و در پایان) ثبت می‌شوند.
+    progress: coroutine اختیاری progress(done, total, success, failed)
+    خروجی به ترتیب jobs: [[1, token, number] | [0, token, "stage: err"], ...]
+    """
+    from tokens_manager import set_tokens_status
+
+    if not jobs:
+        return []
+    per_login, total_cap, stage_timeout = _bulk_settings()
+    global_slots = asyncio.Semaphore(total_cap)
+    login_slots = {}
+    records = []
+    bookkeeping = get_nardeban_async(chatid, jobs[0][0], jobs[0][1]).curd
+    loop = asyncio.get_running_loop()
+    state = {"done": 0, "success": 0, "failed": 0, "last_report": loop.time(), "reporting": False}
+
+    def _flush():
+        if not records:
+            return
+        batch = list(records)
+        records.clear()
+        bookkeeping.addSentBatch(chatid=chatid, rows=batch)
+        set_tokens_status(chatid, [t for t, status in batch if status == "success"], "success")
+
+    async def _report(force=False):
+        if progress is None or state["reporting"]:
+            return
+        if not force and loop.time() - state["last_report"] < progress_every:
+            return
+        state["reporting"] = True
+        state["last_report"] = loop.time()
+        try:
+            _flush()
+            await progress(state["done"], len(jobs), state["success"], state["failed"])
+        except Exception as e:
+            print(f"⚠️ خطا در گزارش پیشرفت نردبان گروهی: {e}")
+        finally:
+            state["reporting"] = False
+
+    async def _one(phone, cookie, token):
+        api = get_nardeban_async(chatid, phone, cookie)
+        slots = login_slots.setdefault(int(phone), asyncio.Semaphore(per_login))
+        async with slots, global_slots:
+            try:
+                result = await api._run_pipeline(
+                    phone, chatid, token, stage_timeout=stage_timeout, sent_log=records)
+            except Exception as e:
+                result = [0, token, (str(e).strip() or "Unknown error")[:150]]
+                records.append((token, "failed"))
+        state["done"] += 1
+        state["success" if result and result[0] == 1 else "failed"] += 1
+        await _report()
+        return result
+
+    await _report(force=True)
+    results = await asyncio.gather(*[_one(phone, cookie, token) for phone, cookie, token in jobs])
+    _flush()
+    await _report(force=True)
+    return results
+
+
+# خطای نبود brand token در نتیجهٔ استخراج (پیام مخصوص در ربات)
+BRAND_TOKEN_ERROR = "brand_token"
+
+
+async def _fetch_login_tokens(chatid, login, slots):
+    phone, cookie = login[0], login[1]
+    async with slots:
+        try:
+            api = get_nardeban_async(chatid, phone, cookie)
+            brand_token = await api.getBranToken()
+            if not brand_token:
+                return (phone, None, BRAND_TOKEN_ERROR)
+            tokens = await api.get_all_tokens(brand_token=brand_token)
+            return (phone, tokens or [], None)
+        except Exception as e:
+            print(f"Error extracting tokens for phone {phone}: {e}")
+            return (phone, None, str(e))
+
+
+async def fetch_tokens_for_logins(chatid, logins, concurrency=None):
+    """
+    استخراج موازی آگهی‌های چند لاگین با سقف هم‌زمانی (extract_concurrency).
+    خروجی به ترتیب logins: [(phone, tokens یا None, error یا None), ...] — بدون نوشتن در store.
+    """
+    slots = asyncio.Semaphore(concurrency or _extract_concurrency())
+    return await asyncio.gather(*[_fetch_login_tokens(chatid, l, slots) for l in logins])
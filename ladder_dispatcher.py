@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+زمان‌بند مرکزی نردبان برای همهٔ ادمین‌ها.
+به جای یک job interval در APScheduler به ازای هر چت (به‌علاوهٔ cronهای auto_stop و زنجیرهٔ
+jobهای date نوع ۴) همهٔ نوبت‌ها در یک heap بر اساس زمان سررسید نگه داشته می‌شوند و یک task
+واحد آن‌ها را اجرا می‌کند. زمان‌بندی O(log n) است و لغو با chatid در O(1) (حذف تنبل از heap).
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+
+LADDER = "ladder"
+STOP = "stop"
+
+# وقتی بیش از نیمی از heap ورودی‌های لغوشده باشد (و حداقل این تعداد) heap بازسازی می‌شود
+_COMPACT_MIN_STALE = 64
+
+
+class _Entry:
+    __slots__ = ("chatid", "kind", "callback", "due", "interval", "cancelled")
+
+    def __init__(self, chatid, kind, callback, due, interval):
+        self.chatid = chatid
+        self.kind = kind
+        self.callback = callback
+        self.due = due
+        self.interval = interval
+        self.cancelled = False
+
+
+class LadderDispatcher:
+    """
+    هر chatid حداکثر یک نوبت از هر نوع دارد: LADDER (نردبان تکراری یا یک‌باره) و STOP (توقف خودکار).
+    callback با آرگومان chatid صدا زده می‌شود؛ اگر اجرای قبلی نردبان همان چت هنوز تمام نشده باشد
+    نوبت جدید رد می‌شود (معادل max_instances=1 در APScheduler).
+    on_due_change(chatid, kind, due) پس از هر ثبت/پیشروی نوبت صدا زده می‌شود (برای ذخیرهٔ پایدار).
+    on_lag(chatid, kind, lag) هنگام اجرای هر نوبت با تأخیر آن نسبت به سررسید (ثانیه) صدا زده می‌شود.
+    """
+
+    def __init__(self, on_due_change=None, on_lag=None):
+        self._on_due_change = on_due_change
+        self._on_lag = on_lag
+        self._heap = []
+        self._entries = {}
+        self._seq = itertools.count()
+        self._stale = 0
+        self._running = {}
+        self._wake = None
+        self._task = None
+
+    # ------------------------------------------------------------------ زمان‌بندی
+
+    def schedule(self, chatid, kind, callback, due, interval=None):
+        """ثبت/جایگزینی نوبت (chatid, kind) در زمان due (epoch ثانیه)؛ interval بر حسب ثانیه برای تکرار"""
+        key = (int(chatid), kind)
+        old = self._entries.get(key)
+        if old is not None:
+            old.cancelled = True
+            self._stale += 1
+        entry = _Entry(int(chatid), kind, callback, float(due), float(interval) if interval else None)
+        self._entries[key] = entry
+        self._push(entry)
+        return entry
+
+    def reschedule(self, chatid, kind, due):
+        """تغییر زمان نوبت موجود با همان callback؛ اگر نوبتی نباشد False"""
+        entry = self._entries.get((int(chatid), kind))
+        if entry is None:
+            return False
+        self.schedule(chatid, kind, entry.callback, due, entry.interval)
+        return True
+
+    def cancel(self, chatid, kind=None):
+        """لغو نوبت‌های یک چت (همهٔ انواع یا فقط kind)؛ تعداد نوبت‌های لغوشده را برمی‌گرداند"""
+        kinds = (kind,) if kind else (LADDER, STOP)
+        removed = 0
+        for k in kinds:
+            entry = self._entries.pop((int(chatid), k), None)
+            if entry is not None:
+                entry.cancelled = True
+                self._stale += 1
+                removed += 1
+        if self._stale >= _COMPACT_MIN_STALE and self._stale * 2 > len(self._heap):
+            self._compact()
+        return removed
+
+    def get(self, chatid, kind=LADDER):
+        return self._entries.get((int(chatid), kind))
+
+    def chats(self, kind=LADDER):
+        return [cid for (cid, k) in self._entries if k == kind]
+
+    def stats(self):
+        return {
+            "ladders": sum(1 for (_, k) in self._entries if k == LADDER),
+            "stops": sum(1 for (_, k) in self._entries if k == STOP),
+            "heap": len(self._heap),
+            "running": sum(1 for t in self._running.values() if not t.done()),
+        }
+
+    def shutdown(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        self._task = None
+
+    # ------------------------------------------------------------------ داخلی
+
+    def _push(self, entry):
+        heapq.heappush(self._heap, (entry.due, next(self._seq), entry))
+        self._notify(entry)
+        self._ensure_driver()
+        if self._heap[0][2] is entry and self._wake is not None:
+            self._wake.set()
+
+    def _notify(self, entry):
+        if self._on_due_change is None:
+            return
+        try:
+            self._on_due_change(entry.chatid, entry.kind, entry.due)
+        except Exception as e:
+            print(f"⚠️ [dispatcher] ثبت نوبت بعدی کاربر {entry.chatid} ناموفق بود: {e}")
+
+    def _report_lag(self, entry, lag):
+        if self._on_lag is None:
+            return
+        try:
+            self._on_lag(entry.chatid, entry.kind, max(0.0, lag))
+        except Exception as e:
+            print(f"⚠️ [dispatcher] ثبت تأخیر نوبت کاربر {entry.chatid} ناموفق بود: {e}")
+
+    def _compact(self):
+        self._heap = [item for item in self._heap if not item[2].cancelled]
+        heapq.heapify(self._heap)
+        self._stale = 0
+
+    def _ensure_driver(self):
+        if self._task is not None and not self._task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # خارج از event loop؛ اولین schedule داخل loop آن را راه می‌اندازد
+            return
+        self._wake = asyncio.Event()
+        self._task = loop.create_task(self._drive())
+
+    async def _drive(self):
+        while True:
+            while self._heap and self._heap[0][2].cancelled:
+                heapq.heappop(self._heap)
+                self._stale = max(0, self._stale - 1)
+            if not self._heap:
+                await self._wake.wait()
+                self._wake.clear()
+                continue
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+                continue
+            due, _, entry = heapq.heappop(self._heap)
+            self._report_lag(entry, time.time() - due)
+            if entry.interval:
+                # نوبت‌های ازدست‌رفته ادغام می‌شوند (معادل coalesce در APScheduler)
+                now = time.time()
+                entry.due += entry.interval
+                if entry.due <= now:
+                    entry.due = now + entry.interval
+                heapq.heappush(self._heap, (entry.due, next(self._seq), entry))
+                self._notify(entry)
+            elif self._entries.get((entry.chatid, entry.kind)) is entry:
+                del self._entries[(entry.chatid, entry.kind)]
+            self._fire(entry)
+
+    def _fire(self, entry):
+        if entry.kind == LADDER:
+            previous = self._running.get(entry.chatid)
+            if previous is not None and not previous.done():
+                print(f"⚠️ [dispatcher] اجرای قبلی نردبان کاربر {entry.chatid} هنوز در جریان است - این نوبت رد شد")
+                return
+        task = asyncio.get_running_loop().create_task(self._run(entry))
+        if entry.kind == LADDER:
+            self._running[entry.chatid] = task
+
+    async def _run(self, entry):
+        try:
+            await entry.callback(entry.chatid)
+        except Exception as e:
+            print(f"❌ [dispatcher] خطا در اجرای {entry.kind} برای کاربر {entry.chatid}: {e}")
+        finally:
+            if entry.kind == LADDER and self._running.get(entry.chatid) is asyncio.current_task():
+                del self._running[entry.chatid]
@@ -1,44 +1,229 @@
+import asyncio
 import json
 import os
+import tempfile
+import threading
+from types import MappingProxyType
+
+CONFIG_PATH = 'configs.json'
+
+# کش درون‌حافظه‌ای configs.json — با تغییر mtime/اندازهٔ فایل دوباره خوانده می‌شود
+_config_lock = threading.RLock()
+_config_cache = None
+_config_stamp = None
+_config_version = 0
+_config_listeners = []  # [(callback, loop)]
+
+
+def _file_stamp(path=CONFIG_PATH):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _changed_keys(old, new):
+    old = old or {}
+    return frozenset(k for k in set(old) | set(new) if old.get(k) != new.get(k))
+
+
+def _call_listener(callback, changed, config):
+    try:
+        callback(changed, config)
+    except Exception as e:
+        print(f"⚠️ [config] خطا در listener تغییر تنظیمات: {e}")
+
+
+def _current_loop():
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def _notify_config_listeners(changed, config):
+    """
+    اطلاع‌رسانی تغییر تنظیمات به مشترک‌ها (خارج از قفل).
+    تغییر ممکن است در هر threadی دیده شود (مثلاً asyncio.to_thread)؛ listenerی که داخل یک event loop
+    ثبت شده با call_soon_threadsafe روی همان loop اجرا می‌شود.
+    """
+    if not changed:
+        return
+    with _config_lock:
+        listeners = list(_config_listeners)
+    current = _current_loop()
+    for callback, loop in listeners:
+        if loop is None or loop is current:
+            _call_listener(callback, changed, config)
+            continue
+        try:
+            loop.call_soon_threadsafe(_call_listener, callback, changed, config)
+        except RuntimeError:
+            # loop بسته شده است؛ مشترکی برای دریافت رویداد باقی نمانده
+            print("⚠️ [config] event loop listener بسته شده است؛ تغییر تنظیمات به آن نرسید")
+
+
+def _reload_locked():
+    """خواندن دوبارهٔ فایل در صورت تغییر؛ برمی‌گرداند (کلیدهای تغییرکرده، config)"""
+    global _config_cache, _config_stamp, _config_version
+    try:
+        stamp = _file_stamp()
+    except OSError:
+        if _config_cache is None:
+            raise
+        return frozenset(), _config_cache
+    if _config_cache is not None and stamp == _config_stamp:
+        return frozenset(), _config_cache
+    try:
+        with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        if _config_cache is None:
+            raise
+        # فایل نیمه‌نوشته (نوشتن غیراتمی از بیرون) — نسخهٔ قبلی معتبر می‌ماند
+        print(f"⚠️ [config] خواندن configs.json ناموفق بود، از نسخهٔ کش استفاده می‌شود: {e}")
+        return frozenset(), _config_cache
+    if not isinstance(data, dict):
+        data = {}
+    first_load = _config_cache is None
+    changed = _changed_keys(_config_cache, data)
+    _config_cache = MappingProxyType(data)
+    _config_stamp = stamp
+    if first_load or changed:
+        _config_version += 1
+    return (frozenset() if first_load else changed), _config_cache
+
+
+def get_config():
+    """تنظیمات فعلی configs.json به صورت فقط‌خواندنی (بدون parse مجدد تا تغییر فایل)"""
+    with _config_lock:
+        changed, config = _reload_locked()
+    _notify_config_listeners(changed, config)
+    return config
+
+
+def refresh_config():
+    """بررسی تغییر فایل توسط فرایندهای دیگر؛ برمی‌گرداند مجموعهٔ کلیدهای تغییرکرده"""
+    with _config_lock:
+        changed, config = _reload_locked()
+    _notify_config_listeners(changed, config)
+    return changed
+
+
+def get_config_version():
+    """شمارندهٔ نسخهٔ تنظیمات — با هر تغییر محتوا یک واحد زیاد می‌شود"""
+    with _config_lock:
+        return _config_version
+
+
+def _write_config_atomic(data):
+    """نوشتن اتمی: فایل موقت در همان پوشه + fsync + os.replace"""
+    directory = os.path.dirname(os.path.abspath(CONFIG_PATH))
+    fd, tmp_path = tempfile.mkstemp(prefix='.configs.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, CONFIG_PATH)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def update_config(values=None, remove=(), replace=False):
+    """ادغام مقادیر در configs.json و نوشتن اتمی؛ برمی‌گرداند کلیدهای تغییرکرده
+
+    Args:
+        values: دیکشنری مقادیر جدید
+        remove: کلیدهایی که باید حذف شوند
+        replace: اگر True باشد، کل فایل با values جایگزین می‌شود
+    """
+    global _config_cache, _config_stamp, _config_version
+    with _config_lock:
+        _, current = _reload_locked()
+        data = dict(values or {}) if replace else dict(current)
+        if not replace:
+            data.update(values or {})
+        for key in remove:
+            data.pop(key, None)
+        changed = _changed_keys(current, data)
+        if changed or replace:
+            _write_config_atomic(data)
+            _config_cache = MappingProxyType(data)
+            _config_stamp = _file_stamp()
+            if changed:
+                _config_version += 1
+        config = _config_cache
+    _notify_config_listeners(changed, config)
+    return changed
+
+
+def subscribe_config(callback):
+    """
+    ثبت listener با امضای callback(changed_keys, config)؛ تابع لغو اشتراک برمی‌گرداند.
+    اگر داخل event loop صدا زده شود، callback همیشه روی همان loop اجرا می‌شود.
+    """
+    entry = (callback, _current_loop())
+    with _config_lock:
+        _config_listeners.append(entry)
+
+    def _unsubscribe():
+        with _config_lock:
+            if entry in _config_listeners:
+                _config_listeners.remove(entry)
+
+    return _unsubscribe
+
 
 class configBot:
     def __init__(self):
-        with open('configs.json', encoding="utf8") as data:
-            self.config = json.load(data)
-            # برای SQLite فقط نام فایل دیتابیس نیاز است
-            # اگر مسیر کامل نباشد، در همان پوشه فعلی ایجاد می‌شود
-            db_name = self.config.get('database', 'bot.db')
-            if not os.path.isabs(db_name):
-                # اگر مسیر نسبی است، در پوشه فعلی قرار می‌گیرد
-                self.database = db_name
-            else:
-                self.database = db_name
-            
-            # توکن ربات بله — «token» یا «bale_token»
-            _tok = self.config.get("bale_token") or self.config.get("token")
-            if _tok is not None and str(_tok).strip():
-                self.token = str(_tok).strip()
-            else:
-                self.token = None
-            # تبدیل admin به int برای اطمینان از مقایسه صحیح
-            admin_value = self.config.get('admin')
-            if admin_value is not None:
-                try:
-                    # تبدیل به int (ممکن است string یا int باشد)
-                    if isinstance(admin_value, str):
-                        self.admin = int(admin_value.strip())
-                    else:
-                        self.admin = int(admin_value)
-                    print(f"✅ [loadConfig] Admin پیش‌فرض: {self.admin} (type: {type(self.admin)})")
-                except (ValueError, TypeError) as e:
-                    print(f"❌ [loadConfig] خطا در تبدیل admin به int: {e} (admin: {admin_value}, type: {type(admin_value)})")
-                    self.admin = None
-            else:
+        self.config = dict(get_config())
+        # برای SQLite فقط نام فایل دیتابیس نیاز است
+        # اگر مسیر کامل نباشد، در همان پوشه فعلی ایجاد می‌شود
+        db_name = self.config.get('database', 'bot.db')
+        if not os.path.isabs(db_name):
+            # اگر مسیر نسبی است، در پوشه فعلی قرار می‌گیرد
+            self.database = db_name
+        else:
+            self.database = db_name
+        
+        # توکن ربات بله — «token» یا «bale_token»
+        _tok = self.config.get("bale_token") or self.config.get("token")
+        if _tok is not None and str(_tok).strip():
+            self.token = str(_tok).strip()
+        else:
+            self.token = None
+        # تبدیل admin به int برای اطمینان از مقایسه صحیح
+        admin_value = self.config.get('admin')
+        if admin_value is not None:
+            try:
+                # تبدیل به int (ممکن است string یا int باشد)
+                if isinstance(admin_value, str):
+                    self.admin = int(admin_value.strip())
+                else:
+                    self.admin = int(admin_value)
+                print(f"✅ [loadConfig] Admin پیش‌فرض: {self.admin} (type: {type(self.admin)})")
+            except (ValueError, TypeError) as e:
+                print(f"❌ [loadConfig] خطا در تبدیل admin به int: {e} (admin: {admin_value}, type: {type(admin_value)})")
                 self.admin = None
-                print("⚠️ [loadConfig] admin در فایل configs.json تعریف نشده است!")
-            self.times = self.config['times']
-            
-            # برای سازگاری با کد قدیمی (اگر جایی استفاده شده باشد)
-            self.host = None
-            self.user = None
-            self.passwd = None
+        else:
+            self.admin = None
+            print("⚠️ [loadConfig] admin در فایل configs.json تعریف نشده است!")
+        self.times = self.config['times']
+
+        # تنظیمات pool اتصال‌های HTTP به دیوار/بازار پی (keep-alive)
+        try:
+            self.http_pool_size = max(1, int(self.config.get('http_pool_size', 10)))
+        except (ValueError, TypeError):
+            self.http_pool_size = 10
+        try:
+            self.http_idle_timeout = max(1.0, float(self.config.get('http_idle_timeout', 60)))
+        except (ValueError, TypeError):
+            self.http_idle_timeout = 60.0
+        
+        # برای سازگاری با کد قدیمی (اگر جایی استفاده شده باشد)
+        self.host = None
+        self.user = None
+        self.passwd = None
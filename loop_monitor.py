@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+پایش event loop ربات و worker.
+یک task ضربان هر نیم ثانیه می‌خوابد و تأخیر بیدار شدنش را اندازه می‌گیرد؛ یک thread نگهبان اگر ضربان بیش از
+loop_block_threshold_seconds عقب بیفتد stack همان لحظهٔ thread حلقه را برمی‌دارد (callbackی که loop را نگه داشته،
+مثلاً HTTP همگام در sendNardeban). نوبت‌های زمان‌بند (dispatcher نردبان و jobهای APScheduler) که بیش از
+tick_lag_threshold_seconds دیر اجرا شوند هم ثبت می‌شوند. رخدادها در جدول loop_incidents می‌مانند تا پنل وب
+بدترین موارد را نشان دهد و گزارش دوره‌ای برای ادمین اصلی فرستاده شود.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+
+import metrics
+from loadConfig import configBot, get_config
+from curds import get_db_connection, ensure_schema
+
+DEFAULT_BLOCK_THRESHOLD = 1.0
+DEFAULT_TICK_LAG_THRESHOLD = 5.0
+DEFAULT_REPORT_MINUTES = 30
+DEFAULT_RETENTION_DAYS = 7
+BLOCK = "block"
+LATE = "late"
+
+_HEARTBEAT_INTERVAL = 0.5
+_WATCHDOG_INTERVAL = 0.1
+_STACK_DEPTH = 12
+_PRUNE_EVERY = 100
+_PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+_db_path = None
+_ready = False
+_writes = 0
+_process = None
+
+
+def _get_connection():
+    global _db_path, _ready
+    if _db_path is None:
+        _db_path = configBot().database
+    if not _ready:
+        ensure_schema(_db_path)
+        _ready = True
+    return get_db_connection(_db_path)
+
+
+def _config_number(key, default):
+    try:
+        return max(0.0, float(get_config().get(key, default)))
+    except Exception:
+        return default
+
+
+def _blame_site(frames):
+    """داخلی‌ترین frame کد پروژه (نه کتابخانه‌ها) به شکل file.py:line func"""
+    for frame in reversed(frames):
+        path = os.path.abspath(frame.filename)
+        if path.startswith(_PROJECT_ROOT) and os.path.basename(path) != "loop_monitor.py":
+            return f"{os.path.basename(path)}:{frame.lineno} {frame.name}"
+    if frames:
+        frame = frames[-1]
+        return f"{os.path.basename(frame.filename)}:{frame.lineno} {frame.name}"
+    return None
+
+
+def _record(kind, duration, site=None, stack=None):
+    global _writes
+    metrics.inc("probot_loop_incidents_total", kind=kind)
+    try:
+        conn = _get_connection()
+        conn.execute(
+            "INSERT INTO loop_incidents (process, kind, at, duration, site, stack) VALUES (?, ?, ?, ?, ?, ?)",
+            (_process or "unknown", kind, time.time(), float(duration), site, stack),
+        )
+        _writes += 1
+        if _writes % _PRUNE_EVERY == 0:
+            cutoff = time.time() - _config_number("loop_incident_days", DEFAULT_RETENTION_DAYS) * 86400
+            conn.execute("DELETE FROM loop_incidents WHERE at < ?", (cutoff,))
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        print(f"⚠️ [loop_monitor] ثبت رخداد {kind} ناموفق بود: {e}")
+
+
+def note_tick_lag(site, lag):
+    """ثبت نوبت زمان‌بندی که دیرتر از tick_lag_threshold_seconds اجرا شده است"""
+    if lag >= _config_number("tick_lag_threshold_seconds", DEFAULT_TICK_LAG_THRESHOLD):
+        print(f"⚠️ [loop_monitor] {site} با {lag:.1f} ثانیه تأخیر اجرا شد")
+        _record(LATE, lag, site=site)
+
+
+class LoopMonitor:
+    """ضربان روی event loop و نگهبان در thread جدا؛ start/stop باید داخل همان loop صدا زده شوند"""
+
+    def __init__(self):
+        self._loop_thread = None
+        self._beat = None
+        self._captured = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watchdog = None
+        self._task = None
+        self._threshold = DEFAULT_BLOCK_THRESHOLD
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._loop_thread = threading.get_ident()
+        self._threshold = _config_number("loop_block_threshold_seconds", DEFAULT_BLOCK_THRESHOLD)
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        self._task = None
+
+    async def _heartbeat(self):
+        while True:
+            before = time.monotonic()
+            with self._lock:
+                self._beat = before
+            await asyncio.sleep(_HEARTBEAT_INTERVAL)
+            lag = max(0.0, time.monotonic() - before - _HEARTBEAT_INTERVAL)
+            metrics.observe("probot_event_loop_lag_seconds", lag)
+            with self._lock:
+                captured, self._captured = self._captured, None
+            # آستانه در thread حلقه خوانده می‌شود تا نگهبان هر ۰.۱ ثانیه فایل تنظیمات را stat نکند
+            self._threshold = _config_number("loop_block_threshold_seconds", DEFAULT_BLOCK_THRESHOLD)
+            if lag < self._threshold:
+                continue
+            site, stack = None, None
+            if captured is not None and captured[0] == before:
+                site, stack = captured[1], captured[2]
+            print(f"⚠️ [loop_monitor] event loop {lag:.2f} ثانیه مسدود بود ({site or 'نامشخص'})")
+            _record(BLOCK, lag, site=site, stack=stack)
+
+    def _watch(self):
+        while not self._stop.wait(_WATCHDOG_INTERVAL):
+            threshold = self._threshold
+            with self._lock:
+                beat = self._beat
+                if self._captured is not None and self._captured[0] == beat:
+                    continue
+            if time.monotonic() - beat - _HEARTBEAT_INTERVAL < threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            frames = traceback.extract_stack(frame)[-_STACK_DEPTH:]
+            del frame
+            with self._lock:
+                if self._beat == beat:
+                    self._captured = (beat, _blame_site(frames), "".join(traceback.format_list(frames)))
+
+
+_monitor = LoopMonitor()
+_report_task = None
+
+
+async def _report_loop(on_report):
+    since = time.time()
+    while True:
+        await asyncio.sleep(max(60.0, _config_number("loop_report_minutes", DEFAULT_REPORT_MINUTES) * 60))
+        now = time.time()
+        offenders = worst_offenders(since=since)
+        since = now
+        if not offenders:
+            continue
+        try:
+            await on_report(offenders)
+        except Exception as e:
+            print(f"⚠️ [loop_monitor] ارسال گزارش رخدادهای loop ناموفق بود: {e}")
+
+
+def start_loop_monitor(process, on_report=None):
+    """
+    شروع پایش loop جاری. on_report(offenders) (coroutine) هر loop_report_minutes با بدترین رخدادهای
+    همهٔ پروسه‌ها از گزارش قبلی صدا زده می‌شود؛ فقط یک پروسه باید آن را بدهد تا گزارش تکراری نرود.
+    """
+    global _process, _report_task
+    _process = process
+    _monitor.start()
+    if on_report is not None and (_report_task is None or _report_task.done()):
+        _report_task = asyncio.get_running_loop().create_task(_report_loop(on_report))
+
+
+def stop_loop_monitor():
+    global _report_task
+    _monitor.stop()
+    if _report_task is not None and not _report_task.done():
+        _report_task.cancel()
+    _report_task = None
+
+
+def worst_offenders(since=None, hours=24, limit=5):
+    """
+    رخدادهای گروه‌بندی‌شده بر اساس (process, kind, site)، بیشترین مدت اول:
+    [{"process", "kind", "site", "count", "max", "total", "last_at", "stack"}]؛ stack مربوط به طولانی‌ترین رخداد است.
+    """
+    if since is None:
+        since = time.time() - hours * 3600
+    try:
+        conn = _get_connection()
+        rows = conn.execute(
+            "SELECT process, kind, site, at, duration, stack FROM loop_incidents WHERE at >= ?",
+            (since,),
+        ).fetchall()
+        conn.close()
+    except Exception as e:
+        print(f"❌ [loop_monitor] خطا در خواندن رخدادهای loop: {e}")
+        return []
+    groups = {}
+    for process, kind, site, at, duration, stack in rows:
+        key = (process, kind, site or "نامشخص")
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {
+                "process": process, "kind": kind, "site": key[2],
+                "count": 0, "max": 0.0, "total": 0.0, "last_at": at, "stack": None,
+            }
+        group["count"] += 1
+        group["total"] += duration
+        group["last_at"] = max(group["last_at"], at)
+        if duration >= group["max"]:
+            group["max"] = duration
+            group["stack"] = stack or group["stack"]
+    result = sorted(groups.values(), key=lambda g: (-g["max"], -g["count"]))[:limit]
+    for group in result:
+        group["max"] = round(group["max"], 2)
+        group["total"] = round(group["total"], 2)
+    return result
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+رجیستری متریک درون‌پروسه‌ای (شمارنده، هیستوگرام و gaugeهای لحظه‌ای از collectorها).
+ربات و worker هر metrics_flush_seconds یک snapshot از رجیستری خود را در جدول metrics_snapshots می‌نویسند؛
+endpoint /metrics پنل وب snapshotها را با برچسب process و gaugeهای دیتابیس (صف فرمان‌ها، توکن‌ها) در قالب متنی
+Prometheus برمی‌گرداند.
+"""
+
+import asyncio
+import bisect
+import json
+import os
+import threading
+import time
+
+from loadConfig import configBot, get_config
+from curds import get_db_connection, ensure_schema
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+DEFAULT_FLUSH_SECONDS = 15.0
+
+# نام: (نوع، توضیح)
+METRICS = {
+    "probot_promotions_total": ("counter", "تلاش‌های نردبان به تفکیک نتیجه و حالت (single/bulk)"),
+    "probot_promotion_stage_seconds": ("histogram", "مدت هر مرحلهٔ خط لولهٔ نردبان"),
+    "probot_promotion_stage_failures_total": ("counter", "شکست‌های هر مرحلهٔ خط لولهٔ نردبان"),
+    "probot_divar_http_seconds": ("histogram", "مدت درخواست‌های HTTP دیوار/بازار به تفکیک host"),
+    "probot_divar_http_requests_total": ("counter", "درخواست‌های HTTP دیوار/بازار به تفکیک host و status"),
+    "probot_bale_send_seconds": ("histogram", "مدت ارسال پیام بله (با retry) به تفکیک نتیجه"),
+    "probot_bale_send_retries_total": ("counter", "retryهای ارسال پیام بله"),
+    "probot_scheduler_tick_lag_seconds": ("histogram", "تأخیر اجرای نوبت‌های زمان‌بند نسبت به زمان سررسید"),
+    "probot_event_loop_lag_seconds": ("histogram", "تأخیر بیدار شدن ضربان event loop (مسدود شدن حلقه)"),
+    "probot_loop_incidents_total": ("counter", "رخدادهای ثبت‌شدهٔ loop_monitor (block / late)"),
+    "probot_send_queue_depth": ("gauge", "پیام‌های در صف هر خط ارسال"),
+    "probot_send_queue_sent_total": ("counter", "پیام‌های ارسال‌شده از هر خط"),
+    "probot_notifications_total": ("counter", "اعلان‌های بافرشده و پیام‌های واقعی ارسال‌شده"),
+    "probot_plan_cache_total": ("counter", "برخوردهای کش پلن به تفکیک نتیجه"),
+    "probot_ladder_entries": ("gauge", "نوبت‌های ثبت‌شده در زمان‌بند نردبان"),
+    "probot_pending_index_tokens": ("gauge", "توکن‌های pending در نمایهٔ درون‌حافظه‌ای"),
+    "probot_web_commands": ("gauge", "فرمان‌های پنل وب به تفکیک وضعیت"),
+    "probot_web_command_oldest_pending_seconds": ("gauge", "عمر قدیمی‌ترین فرمان pending پنل وب"),
+    "probot_token_states": ("gauge", "توکن‌های ذخیره‌شده به تفکیک وضعیت"),
+    "probot_metrics_snapshot_age_seconds": ("gauge", "فاصلهٔ آخرین snapshot هر پروسه تا الان"),
+}
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_collectors = []
+_started_at = time.time()
+_export_task = None
+
+_db_path = None
+_ready = False
+
+
+def _get_connection():
+    global _db_path, _ready
+    if _db_path is None:
+        _db_path = configBot().database
+    if not _ready:
+        ensure_schema(_db_path)
+        _ready = True
+    return get_db_connection(_db_path)
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    key = _key(name, labels)
+    value = max(0.0, float(value))
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [[0] * (len(DEFAULT_BUCKETS) + 1), 0.0, 0]
+        hist[0][bisect.bisect_left(DEFAULT_BUCKETS, value)] += 1
+        hist[1] += value
+        hist[2] += 1
+
+
+def register_collector(collector):
+    """collector() -> [(name, labels_dict, value), ...] که هنگام snapshot خوانده می‌شود (آمار ماژول‌های دیگر)"""
+    _collectors.append(collector)
+
+
+def snapshot():
+    with _lock:
+        counters = [[name, list(labels), value] for (name, labels), value in _counters.items()]
+        histograms = [
+            [name, list(labels), list(hist[0]), hist[1], hist[2]]
+            for (name, labels), hist in _histograms.items()
+        ]
+    samples = []
+    for collector in list(_collectors):
+        try:
+            for name, labels, value in collector() or ():
+                samples.append([name, list(_key(name, labels)[1]), value])
+        except Exception as e:
+            print(f"⚠️ [metrics] خطا در collector: {e}")
+    return {"buckets": list(DEFAULT_BUCKETS), "counters": counters + samples, "histograms": histograms}
+
+
+def write_snapshot(process):
+    try:
+        conn = _get_connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO metrics_snapshots (process, pid, started_at, updated_at, payload) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (process, os.getpid(), _started_at, time.time(), json.dumps(snapshot(), ensure_ascii=False)),
+        )
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        print(f"⚠️ [metrics] ثبت snapshot پروسهٔ {process} ناموفق بود: {e}")
+
+
+def _flush_interval():
+    try:
+        return max(1.0, float(get_config().get("metrics_flush_seconds", DEFAULT_FLUSH_SECONDS)))
+    except Exception:
+        return DEFAULT_FLUSH_SECONDS
+
+
+async def _export_loop(process):
+    while True:
+        write_snapshot(process)
+        await asyncio.sleep(_flush_interval())
+
+
+def start_metrics_export(process):
+    """شروع ثبت دوره‌ای snapshot این پروسه (یک‌بار برای هر event loop)"""
+    global _export_task
+    if _export_task is not None and not _export_task.done():
+        return
+    _export_task = asyncio.get_running_loop().create_task(_export_loop(process))
+
+
+def stop_metrics_export(process):
+    global _export_task
+    if _export_task is not None and not _export_task.done():
+        _export_task.cancel()
+    _export_task = None
+    write_snapshot(process)
+
+
+# ------------------------------------------------------------------ خروجی Prometheus
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if value == float("inf"):
+            return "+Inf"
+        return repr(round(value, 6))
+    return str(value)
+
+
+def _store_gauges(conn, now):
+    samples = []
+    for status, count in conn.execute("SELECT status, COUNT(*) FROM web_commands GROUP BY status").fetchall():
+        samples.append(("probot_web_commands", [("status", status)], count))
+    row = conn.execute(
+        "SELECT MIN(CAST(strftime('%s', created_at) AS REAL)) FROM web_commands WHERE status = 'pending'"
+    ).fetchone()
+    # created_at با CURRENT_TIMESTAMP (UTC) ثبت می‌شود
+    oldest = row[0] if row else None
+    samples.append(("probot_web_command_oldest_pending_seconds", [], max(0.0, now - oldest) if oldest else 0.0))
+    for status, count in conn.execute("SELECT status, COUNT(*) FROM token_states GROUP BY status").fetchall():
+        samples.append(("probot_token_states", [("status", status)], count))
+    return samples
+
+
+def render_metrics():
+    """متن Prometheus از snapshot پروسه‌ها و gaugeهای دیتابیس"""
+    now = time.time()
+    series = {}
+
+    def add(name, line):
+        series.setdefault(name, []).append(line)
+
+    conn = _get_connection()
+    rows = conn.execute("SELECT process, updated_at, payload FROM metrics_snapshots ORDER BY process").fetchall()
+    store_samples = _store_gauges(conn, now)
+    conn.close()
+
+    for process, updated_at, payload in rows:
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            continue
+        proc = [("process", process)]
+        add("probot_metrics_snapshot_age_seconds",
+            f"probot_metrics_snapshot_age_seconds{_format_labels(proc)} {_format_value(max(0.0, now - updated_at))}")
+        for name, labels, value in data.get("counters", []):
+            add(name, f"{name}{_format_labels(proc + [tuple(l) for l in labels])} {_format_value(value)}")
+        buckets = data.get("buckets") or list(DEFAULT_BUCKETS)
+        for name, labels, counts, total, count in data.get("histograms", []):
+            base = proc + [tuple(l) for l in labels]
+            cumulative = 0
+            for bound, bucket_count in zip(list(buckets) + [float("inf")], counts):
+                cumulative += bucket_count
+                add(name, f"{name}_bucket{_format_labels(base + [('le', _format_value(float(bound)))])} {cumulative}")
+            add(name, f"{name}_sum{_format_labels(base)} {_format_value(float(total))}")
+            add(name, f"{name}_count{_format_labels(base)} {count}")
+
+    for name, labels, value in store_samples:
+        add(name, f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+    lines = []
+    for name in sorted(series):
+        kind, help_text = METRICS.get(name, ("untyped", name))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(series[name])
+    return "\n".join(lines) + "\n"
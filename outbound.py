@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+ارسال پیام‌های خروجی بله.
+اعلان‌های پشت‌سرهم یک چت (نتیجهٔ نردبان، شمارنده، ریست چرخه، «نردبان بعدی در N دقیقه») در یک پنجرهٔ
+کوتاه جمع و به صورت یک پیام (یا چند تکهٔ زیر سقف طول پیام) فرستاده می‌شوند تا تعداد فراخوانی API
+و انتظار rate limiter کم شود.
+ارسال‌ها در سه خط (interactive / operational / bulk) با سهمیهٔ جدا صف می‌شوند تا گزارش‌های حجیم
+پاسخ منوها را عقب نیندازند.
+"""
+
+import asyncio
+import html
+import time
+from collections import deque
+
+from loadConfig import get_config
+
+INTERACTIVE = "interactive"
+OPERATIONAL = "operational"
+BULK = "bulk"
+LANES = (INTERACTIVE, OPERATIONAL, BULK)
+
+# سهمیهٔ هر خط: rate پیام در ثانیه، burst حداکثر ذخیره و inflight حداکثر ارسال هم‌زمان.
+# مجموع زیر سقف کلی AIORateLimiter (۳۰ پیام در ثانیه) می‌ماند تا همیشه برای پاسخ منوها جا باشد.
+DEFAULT_LANE_QUOTAS = {
+    INTERACTIVE: {"rate": 20.0, "burst": 20, "inflight": 0},
+    OPERATIONAL: {"rate": 6.0, "burst": 6, "inflight": 4},
+    BULK: {"rate": 2.0, "burst": 2, "inflight": 1},
+}
+
+DEFAULT_COALESCE_SECONDS = 1.5
+# سقف طول پیام بله ۴۰۹۶ کاراکتر است؛ مثل _chunk_lines_for_message حاشیهٔ امن نگه داشته می‌شود
+DEFAULT_CHUNK_LIMIT = 3500
+
+
+def _coalesce_window():
+    try:
+        return max(0.0, float(get_config().get("notify_coalesce_seconds", DEFAULT_COALESCE_SECONDS)))
+    except Exception:
+        return DEFAULT_COALESCE_SECONDS
+
+
+class MessageCoalescer:
+    """
+    بافر اعلان‌های هر چت.
+    send(chat_id, text, parse_mode) ارسال واقعی است؛ chunker(lines, limit) خطوط را به تکه‌های مجاز تقسیم می‌کند.
+    flush(chat_id) قبل از هر ارسال مستقیم به همان چت صدا زده می‌شود تا ترتیب پیام‌ها حفظ شود.
+    """
+
+    def __init__(self, send, chunker, limit=DEFAULT_CHUNK_LIMIT):
+        self._send = send
+        self._chunker = chunker
+        self._limit = limit
+        self._buffers = {}
+        self._timers = {}
+        self._locks = {}
+        self.sent_messages = 0
+        self.coalesced_notices = 0
+
+    def pending(self, chat_id):
+        return bool(self._buffers.get(int(chat_id)))
+
+    async def notify(self, chat_id, text, parse_mode=None):
+        """افزودن اعلان به بافر چت؛ ارسال پس از پایان پنجره یا پر شدن بافر"""
+        chat_id = int(chat_id)
+        text = str(text or "").strip()
+        if not text:
+            return
+        window = _coalesce_window()
+        if window <= 0:
+            await self._deliver(chat_id, [(text, parse_mode)])
+            return
+        buffer = self._buffers.setdefault(chat_id, [])
+        buffer.append((text, parse_mode))
+        self.coalesced_notices += 1
+        if sum(len(t) for t, _ in buffer) >= self._limit:
+            await self.flush(chat_id)
+            return
+        timer = self._timers.get(chat_id)
+        if timer is None or timer.done():
+            self._timers[chat_id] = asyncio.create_task(self._flush_later(chat_id, window))
+
+    async def flush(self, chat_id):
+        """ارسال فوری بافر یک چت (در صورت وجود)"""
+        chat_id = int(chat_id)
+        timer = self._timers.pop(chat_id, None)
+        if timer is not None and timer is not asyncio.current_task() and not timer.done():
+            timer.cancel()
+        items = self._buffers.pop(chat_id, None)
+        if items:
+            await self._deliver(chat_id, items)
+        else:
+            # ارسال در جریانِ همین چت (از timer) باید پیش از پیام مستقیم بعدی تمام شود
+            lock = self._locks.get(chat_id)
+            if lock is not None and lock.locked():
+                async with lock:
+                    pass
+
+    async def flush_all(self):
+        for chat_id in list(self._buffers):
+            await self.flush(chat_id)
+
+    async def _flush_later(self, chat_id, window):
+        try:
+            await asyncio.sleep(window)
+        except asyncio.CancelledError:
+            return
+        await self.flush(chat_id)
+
+    async def _deliver(self, chat_id, items):
+        lock = self._locks.setdefault(chat_id, asyncio.Lock())
+        async with lock:
+            use_html = any(mode == "HTML" for _, mode in items)
+            lines = []
+            for text, mode in items:
+                if use_html and mode != "HTML":
+                    text = html.escape(text, quote=False)
+                if lines:
+                    lines.append("")
+                lines.extend(text.split("\n"))
+            for chunk in self._chunker(lines, limit=self._limit):
+                chunk = chunk.strip("\n")
+                if not chunk:
+                    continue
+                self.sent_messages += 1
+                await self._send(chat_id, chunk, "HTML" if use_html else None)
+
+
+def _lane_quota(lane):
+    quota = dict(DEFAULT_LANE_QUOTAS[lane])
+    try:
+        override = (get_config().get("send_lanes") or {}).get(lane) or {}
+        for key in quota:
+            if key in override:
+                quota[key] = float(override[key])
+    except Exception:
+        pass
+    quota["rate"] = max(0.1, float(quota["rate"]))
+    quota["burst"] = max(1.0, float(quota["burst"]))
+    return quota
+
+
+class _Lane:
+    __slots__ = ("name", "queue", "tokens", "updated", "inflight", "sent", "wait_total")
+
+    def __init__(self, name):
+        self.name = name
+        self.queue = deque()
+        self.tokens = float(DEFAULT_LANE_QUOTAS[name]["burst"])
+        self.updated = time.monotonic()
+        self.inflight = 0
+        self.sent = 0
+        self.wait_total = 0.0
+
+
+class PrioritySendQueue:
+    """
+    صف ارسال با اولویت: هر بار از بالاترین خطی که هم درخواست و هم سهمیه دارد یک ارسال برداشته می‌شود.
+    submit(lane, factory) تابع بدون آرگومانِ coroutine‌ساز را در نوبت خودش اجرا و نتیجه را برمی‌گرداند.
+    """
+
+    def __init__(self):
+        self._lanes = {name: _Lane(name) for name in LANES}
+        self._wake = None
+        self._task = None
+
+    async def submit(self, lane, factory):
+        lane_obj = self._lanes.get(lane) or self._lanes[OPERATIONAL]
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        lane_obj.queue.append((factory, future, time.monotonic()))
+        self._ensure_driver(loop)
+        self._wake.set()
+        return await future
+
+    def stats(self):
+        result = {}
+        for name, lane in self._lanes.items():
+            result[name] = {
+                "queued": len(lane.queue),
+                "inflight": lane.inflight,
+                "sent": lane.sent,
+                "avg_wait": round(lane.wait_total / lane.sent, 3) if lane.sent else 0.0,
+            }
+        return result
+
+    def _ensure_driver(self, loop):
+        if self._task is not None and not self._task.done():
+            return
+        self._wake = asyncio.Event()
+        self._task = loop.create_task(self._drive())
+
+    def _refill(self, lane, quota, now):
+        lane.tokens = min(quota["burst"], lane.tokens + (now - lane.updated) * quota["rate"])
+        lane.updated = now
+
+    async def _drive(self):
+        while True:
+            now = time.monotonic()
+            picked = None
+            wait = None
+            for name in LANES:
+                lane = self._lanes[name]
+                quota = _lane_quota(name)
+                self._refill(lane, quota, now)
+                while lane.queue and lane.queue[0][1].done():
+                    lane.queue.popleft()
+                if not lane.queue:
+                    continue
+                if quota["inflight"] and lane.inflight >= quota["inflight"]:
+                    continue
+                if lane.tokens >= 1:
+                    picked = lane
+                    break
+                need = (1 - lane.tokens) / quota["rate"]
+                wait = need if wait is None else min(wait, need)
+            if picked is None:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+                continue
+            picked.tokens -= 1
+            factory, future, queued_at = picked.queue.popleft()
+            picked.inflight += 1
+            picked.sent += 1
+            picked.wait_total += now - queued_at
+            asyncio.get_running_loop().create_task(self._run(picked, factory, future))
+
+    async def _run(self, lane, factory, future):
+        try:
+            result = await factory()
+            if not future.done():
+                future.set_result(result)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        finally:
+            lane.inflight -= 1
+            if self._wake is not None:
+                self._wake.set()
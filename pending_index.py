@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+نمایهٔ درون‌حافظه‌ای توکن‌های pending برای انتخاب نوبت نردبان.
+برای هر chatid صف توکن‌های pending هر شماره (به ترتیب ثبت)، آرایهٔ فشرده برای انتخاب تصادفی، تعداد هر شماره
+و مکان‌نمای نوبتی نگه داشته می‌شود؛ انتخاب هر نوع نردبان بدون کوئری و در O(1) (سرشکن) انجام می‌شود.
+برای نوع ۴ یک heap روی natural_flow_key (token_meta) ساخته می‌شود و انتخاب O(log n) است.
+tokens_manager پس از هر تغییر وضعیت نمایه را به‌روز می‌کند؛ افزودن توکن (استخراج) و ریست فقط نمایهٔ همان چت را
+باطل می‌کند تا در انتخاب بعدی با یک کوئری ساخته شود. هر نوشتن tokens_manager در همان تراکنش نسخهٔ چت را در
+token_store_meta یک واحد بالا می‌برد (bump_pending_version)؛ reconcile_pending_index با مقایسهٔ این نسخه تغییرات
+پروسه‌های دیگر (worker) را تشخیص می‌دهد.
+"""
+
+import heapq
+import random
+import threading
+from collections import deque
+
+from loadConfig import configBot
+from curds import get_db_connection, ensure_schema
+from token_meta import natural_flow_key
+
+_indexes = {}
+_lock = threading.RLock()
+# نسخهٔ همهٔ چت‌ها (جایگزینی/انتقال کامل جدول) و نسخهٔ هر چت در token_store_meta
+_GLOBAL_VERSION_KEY = "pending_version"
+_db_path = None
+_ready = False
+_loads = 0
+
+
+def _get_connection():
+    global _db_path, _ready
+    if _db_path is None:
+        _db_path = configBot().database
+    if not _ready:
+        ensure_schema(_db_path)
+        _ready = True
+    return get_db_connection(_db_path)
+
+
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+class _ChatIndex:
+    """
+    توکن‌های pending یک چت. حذف از صف هر شماره تنبل است: ورودی‌ای که دیگر در live نیست هنگام رسیدن به سر صف دور ریخته می‌شود.
+    """
+
+    __slots__ = ("live", "queues", "counts", "items", "positions", "cursor", "heap", "version")
+
+    def __init__(self):
+        self.version = None
+        self.live = {}
+        self.queues = {}
+        self.counts = {}
+        self.items = []
+        self.positions = {}
+        self.cursor = None
+        # (natural_flow_key, rowid, phone, token) — حذف تنبل مثل صف‌ها
+        self.heap = []
+
+    def add(self, phone, token, rowid, key=0.0):
+        self.live[token] = (phone, rowid)
+        self.heap.append((key, rowid, phone, token))
+        self.queues.setdefault(phone, deque()).append(token)
+        self.counts[phone] = self.counts.get(phone, 0) + 1
+        self.positions[token] = len(self.items)
+        self.items.append(token)
+
+    def discard(self, token):
+        entry = self.live.pop(token, None)
+        if entry is None:
+            return
+        phone = entry[0]
+        self.counts[phone] -= 1
+        if not self.counts[phone]:
+            del self.counts[phone]
+        # حذف swap-with-last از آرایهٔ انتخاب تصادفی
+        idx = self.positions.pop(token)
+        last = self.items.pop()
+        if last != token:
+            self.items[idx] = last
+            self.positions[last] = idx
+
+    def head(self, phone):
+        queue = self.queues.get(phone)
+        while queue:
+            token = queue[0]
+            entry = self.live.get(token)
+            if entry is not None and entry[0] == phone:
+                return token
+            queue.popleft()
+        return None
+
+
+def _version_key(chatid):
+    return f"{_GLOBAL_VERSION_KEY}:{chatid}"
+
+
+def bump_pending_version(cur, chatid=None):
+    """
+    افزایش نسخهٔ توکن‌های یک چت (یا نسخهٔ سراسری با chatid=None) در تراکنش نوشتن فراخواننده؛ خروجی نسخهٔ جدید.
+    """
+    key = _GLOBAL_VERSION_KEY if chatid is None else _version_key(_as_int(chatid))
+    cur.execute(
+        "INSERT INTO token_store_meta (key, value) VALUES (?, '1') "
+        "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1",
+        (key,),
+    )
+    row = cur.execute("SELECT value FROM token_store_meta WHERE key = ?", (key,)).fetchone()
+    return int(row[0])
+
+
+def _read_version(conn, chatid):
+    """(نسخهٔ سراسری، نسخهٔ چت) — قبل از خواندن ردیف‌ها گرفته می‌شود تا نوشتن هم‌زمان فقط باعث بازسازی اضافه شود"""
+    rows = dict(conn.execute(
+        "SELECT key, value FROM token_store_meta WHERE key IN (?, ?)",
+        (_GLOBAL_VERSION_KEY, _version_key(chatid)),
+    ).fetchall())
+    return int(rows.get(_GLOBAL_VERSION_KEY) or 0), int(rows.get(_version_key(chatid)) or 0)
+
+
+def _load(chatid):
+    global _loads
+    index = _ChatIndex()
+    try:
+        conn = _get_connection()
+        index.version = _read_version(conn, chatid)
+        rows = conn.execute(
+            "SELECT s.id, s.phone, s.token, m.first_seen, m.last_promoted, m.promote_count "
+            "FROM token_states s LEFT JOIN token_meta m ON m.chatid = s.chatid AND m.token = s.token "
+            "WHERE s.chatid = ? AND s.status = 'pending' ORDER BY s.id",
+            (chatid,),
+        ).fetchall()
+        conn.close()
+    except Exception as e:
+        print(f"❌ [pending_index] خطا در ساخت نمایهٔ chatid={chatid}: {e}")
+        return None
+    for rowid, phone, token, first_seen, last_promoted, promote_count in rows:
+        index.add(phone, token, rowid, natural_flow_key(first_seen, last_promoted, promote_count))
+    heapq.heapify(index.heap)
+    _loads += 1
+    return index
+
+
+def _get(chatid):
+    chatid = _as_int(chatid)
+    index = _indexes.get(chatid)
+    if index is None:
+        index = _load(chatid)
+        if index is not None:
+            _indexes[chatid] = index
+    return index
+
+
+def invalidate(chatid=None):
+    """باطل کردن نمایهٔ یک چت (یا همه)؛ مکان‌نمای نوبتی حفظ نمی‌شود و از manage خوانده خواهد شد"""
+    with _lock:
+        if chatid is None:
+            _indexes.clear()
+        else:
+            _indexes.pop(_as_int(chatid), None)
+
+
+def on_status_change(chatid, tokens, status, version=None):
+    """
+    به‌روزرسانی افزایشی پس از تغییر وضعیت توکن‌ها در token_states. version نسخهٔ چت پس از همین نوشتن است؛
+    نمایه فقط وقتی نسخهٔ جدید را می‌پذیرد که دقیقاً نسخهٔ قبلی را داشته باشد (نوشتن دیگری در این فاصله نبوده).
+    """
+    with _lock:
+        index = _indexes.get(_as_int(chatid))
+        if index is None:
+            return
+        if status == "pending":
+            # برگشت به pending نادر است و جایگاه ترتیبی توکن را باید از دیتابیس گرفت
+            _indexes.pop(_as_int(chatid), None)
+            return
+        for token in tokens:
+            index.discard(str(token))
+        if version is not None and index.version is not None and index.version[1] == version - 1:
+            index.version = (index.version[0], version)
+
+
+def reconcile_pending_index(chatid):
+    """
+    مقایسهٔ نسخهٔ نمایه با نسخهٔ token_store_meta (یک کوئری کلید اصلی در هر نوبت sendNardeban).
+    در صورت اختلاف (نوشتن پروسهٔ دیگر) نمایه بازسازی می‌شود؛ خروجی True یعنی نمایه معتبر بود.
+    """
+    with _lock:
+        index = _indexes.get(_as_int(chatid))
+        if index is None:
+            return True
+        try:
+            conn = _get_connection()
+            current = _read_version(conn, _as_int(chatid))
+            conn.close()
+        except Exception as e:
+            print(f"⚠️ [pending_index] خطا در خواندن نسخهٔ توکن‌های chatid={chatid}: {e}")
+            current = None
+        if current is not None and index.version == current:
+            return True
+        cursor = index.cursor
+        index = _load(_as_int(chatid))
+        if index is None:
+            _indexes.pop(_as_int(chatid), None)
+            return False
+        index.cursor = cursor
+        _indexes[_as_int(chatid)] = index
+        return False
+
+
+def pending_count(chatid, phone=None):
+    with _lock:
+        index = _get(chatid)
+        if index is None:
+            return 0
+        if phone is None:
+            return len(index.items)
+        return index.counts.get(_as_int(phone), 0)
+
+
+def pick_oldest_token(chatid, phone):
+    """قدیمی‌ترین توکن pending یک شماره یا None"""
+    with _lock:
+        index = _get(chatid)
+        return index.head(_as_int(phone)) if index is not None else None
+
+
+def pick_natural_flow_token(chatid, phones):
+    """
+    (phone, token) با کوچک‌ترین natural_flow_key از بین شماره‌های داده‌شده یا None.
+    سر heap فقط هنگام کهنه بودن (دیگر pending نیست) دور ریخته می‌شود؛ توکن انتخاب‌شده پس از تغییر وضعیت حذف می‌شود.
+    """
+    with _lock:
+        index = _get(chatid)
+        if index is None:
+            return None
+        allowed = {_as_int(p) for p in phones}
+        skipped = []
+        picked = None
+        while index.heap:
+            key, rowid, phone, token = index.heap[0]
+            entry = index.live.get(token)
+            if entry is None or entry[0] != phone:
+                heapq.heappop(index.heap)
+                continue
+            if phone not in allowed:
+                skipped.append(heapq.heappop(index.heap))
+                continue
+            picked = (phone, token)
+            break
+        for item in skipped:
+            heapq.heappush(index.heap, item)
+        return picked
+
+
+def pick_random_token(chatid, rng=random):
+    """(phone, token) تصادفی یکنواخت از همهٔ توکن‌های pending چت یا None"""
+    with _lock:
+        index = _get(chatid)
+        if index is None or not index.items:
+            return None
+        token = index.items[rng.randrange(len(index.items))]
+        return index.live[token][0], token
+
+
+def pick_round_robin_token(chatid, phones, last_phone=None):
+    """
+    (phone, token) از اولین شمارهٔ دارای pending پس از مکان‌نمای نوبتی در ترتیب phones.
+    مکان‌نما در نمایه نگه داشته می‌شود؛ last_phone (ستون last_round_robin_phone) فقط پس از ساخت دوبارهٔ نمایه استفاده می‌شود.
+    """
+    with _lock:
+        index = _get(chatid)
+        if index is None:
+            return None
+        phones = [_as_int(p) for p in phones]
+        if not phones:
+            return None
+        cursor = index.cursor if index.cursor is not None else _as_int(last_phone)
+        start = 0
+        if cursor is not None and cursor in phones:
+            start = (phones.index(cursor) + 1) % len(phones)
+        for step in range(len(phones)):
+            phone = phones[(start + step) % len(phones)]
+            if not index.counts.get(phone):
+                continue
+            token = index.head(phone)
+            if token is not None:
+                index.cursor = phone
+                return phone, token
+        return None
+
+
+def pending_index_stats():
+    with _lock:
+        return {
+            "chats": len(_indexes),
+            "tokens": sum(len(index.items) for index in _indexes.values()),
+            "loads": _loads,
+        }
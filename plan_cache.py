@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+کش پلن‌های هزینهٔ نردبان (/v8/payment/costs/{token}) مشترک بین dapi و dapi_async.
+پلن‌های نرمال‌شدهٔ هر آگهی تا cost_plan_ttl ثانیه معتبرند؛ آخرین پلن‌های دیده‌شدهٔ هر لاگین
+فقط وقتی درخواست به دیوار شکست بخورد و فقط برای نمایش منوی پلن‌ها تا cost_plan_fallback_ttl ثانیه
+استفاده می‌شوند؛ پلن‌های هر آگهی به دسته‌اش بستگی دارد، پس نردبان پولی هرگز با جایگزین انجام نمی‌شود.
+"""
+
+import hashlib
+import threading
+import time
+
+from loadConfig import get_config
+
+DEFAULT_PLAN_TTL = 300
+DEFAULT_FALLBACK_TTL = 1800
+
+
+class PlanFetchError(ValueError):
+    """شکست شبکه/سرور در دریافت پلن‌ها (برخلاف پاسخ معتبر «پلنی موجود نیست»)"""
+
+
+_lock = threading.Lock()
+_token_plans = {}
+_fallback_plans = {}
+_counters = {"hits": 0, "misses": 0, "fallbacks": 0}
+
+
+def _ttl(key, default):
+    try:
+        return max(0.0, float(get_config().get(key, default)))
+    except Exception:
+        return float(default)
+
+
+def login_key(cookie):
+    return hashlib.sha256(str(cookie).encode("utf-8")).hexdigest()[:16]
+
+
+def get_cached_plans(token):
+    """پلن‌های معتبر کش‌شدهٔ یک آگهی یا None (شمارندهٔ hit/miss به‌روز می‌شود)"""
+    now = time.monotonic()
+    with _lock:
+        entry = _token_plans.get(token)
+        if entry is not None and entry[0] > now:
+            _counters["hits"] += 1
+            return [dict(p) for p in entry[1]]
+        if entry is not None:
+            _token_plans.pop(token, None)
+        _counters["misses"] += 1
+        return None
+
+
+def store_plans(token, cookie, plans):
+    """ثبت پلن‌های تازهٔ یک آگهی و به‌روزرسانی جایگزین سطح لاگین"""
+    now = time.monotonic()
+    ttl = _ttl("cost_plan_ttl", DEFAULT_PLAN_TTL)
+    fallback_ttl = _ttl("cost_plan_fallback_ttl", DEFAULT_FALLBACK_TTL)
+    frozen = tuple(dict(p) for p in plans)
+    with _lock:
+        if ttl > 0:
+            _token_plans[token] = (now + ttl, frozen)
+        if fallback_ttl > 0:
+            _fallback_plans[login_key(cookie)] = (now + fallback_ttl, frozen)
+        # پاک‌سازی ورودی‌های منقضی تا کش بی‌نهایت بزرگ نشود
+        if len(_token_plans) > 2000:
+            for key in [k for k, v in _token_plans.items() if v[0] <= now]:
+                _token_plans.pop(key, None)
+    return [dict(p) for p in frozen]
+
+
+def get_fallback_plans(cookie):
+    """آخرین پلن‌های دیده‌شدهٔ لاگین (فقط برای نمایش منو هنگام شکست درخواست) یا None"""
+    now = time.monotonic()
+    with _lock:
+        entry = _fallback_plans.get(login_key(cookie))
+        if entry is None or entry[0] <= now:
+            return None
+        _counters["fallbacks"] += 1
+        return [dict(p) for p in entry[1]]
+
+
+def plan_cache_stats():
+    """شمارنده‌های کش پلن: hits / misses / fallbacks / size / hit_rate"""
+    with _lock:
+        stats = dict(_counters)
+        stats["size"] = len(_token_plans)
+    total = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] * 100.0 / total, 1) if total else 0.0
+    return stats
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+همگام‌سازی افزایشی post-list دیوار.
+برای هر (chatid, phone, brand_token) آگهی‌ها (token, label, title) با اثرانگشت و رتبهٔ فید در جدول post_index
+و وضعیت آخرین پیمایش در post_sync_cursor نگه‌داری می‌شوند. پیمایش فید وقتی به صفحه‌ای برسد که همهٔ آگهی‌هایش
+بدون تغییر شناخته‌شده‌اند متوقف می‌شود؛ هر post_full_sync_hours یک پیمایش کامل تغییرات پایین فید را هم می‌گیرد.
+توقف زودهنگام فقط برای استخراج است: تغییر برچسب آگهی‌های پایین فید (نیاز به تمدید / منقضی) در پیمایش افزایشی
+دیده نمی‌شود، پس فهرست تمدید و منقضی همیشه از پیمایش کامل ساخته می‌شود.
+نتیجهٔ هر پیمایش یک‌بار دسته‌بندی می‌شود (منتشر شده / نیاز به تمدید / منقضی) و تا post_snapshot_ttl ثانیه
+بدون درخواست دوباره به دیوار استفاده می‌شود؛ snapshot پیمایش افزایشی فقط به استخراج پاسخ می‌دهد.
+"""
+
+import hashlib
+import threading
+import time
+from datetime import datetime
+
+from loadConfig import configBot, get_config
+from curds import get_db_connection, ensure_schema
+from token_meta import upsert_post_rows
+
+PUBLISHED_LABEL = "منتشر شده"
+DEFAULT_FULL_SYNC_HOURS = 6.0
+DEFAULT_SNAPSHOT_TTL = 120
+
+
+def _normalize_label(label):
+    return str(label or "").replace("‌", "").replace("ٔ", "").replace(" ", "").lower()
+
+
+# برچسب‌های «نیاز به تمدید» و «منقضی شده» (همان کلمات کلیدی قبلی get_tokens_needing_renewal / get_expired_tokens)
+RENEWAL_KEYWORDS = tuple(_normalize_label(k) for k in ("تمدید", "نیازبهتمدید", "نیاز به تمدید", "انقضا", "expire", "renew"))
+EXPIRED_KEYWORDS = tuple(_normalize_label(k) for k in ("منقضی", "expired"))
+
+# snapshot دسته‌بندی‌شدهٔ هر لاگین در حافظه: {(chatid, phone, brand_token): (expires_at, snapshot, full)}
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+_ready_lock = threading.Lock()
+_ready = False
+_db_path = None
+
+
+def _get_connection():
+    global _db_path, _ready
+    if _db_path is None:
+        _db_path = configBot().database
+    if not _ready:
+        with _ready_lock:
+            if not _ready:
+                ensure_schema(_db_path)
+                _ready = True
+    return get_db_connection(_db_path)
+
+
+def _snapshot_ttl():
+    try:
+        return max(0.0, float(get_config().get("post_snapshot_ttl", DEFAULT_SNAPSHOT_TTL)))
+    except Exception:
+        return DEFAULT_SNAPSHOT_TTL
+
+
+def _full_sync_interval():
+    try:
+        hours = float(get_config().get("post_full_sync_hours", DEFAULT_FULL_SYNC_HOURS))
+    except Exception:
+        hours = DEFAULT_FULL_SYNC_HOURS
+    return max(0.0, hours) * 3600
+
+
+def post_fingerprint(label, title):
+    return hashlib.sha1(f"{label}\x1f{title}".encode("utf-8")).hexdigest()[:16]
+
+
+def parse_post_page(data):
+    """ردیف‌های POST_ROW یک صفحهٔ post-list به صورت (token, label, title) و last_item_identifier صفحهٔ بعد"""
+    page = (data or {}).get("page", {}) or {}
+    rows = []
+    for widget in page.get("widget_list", []) or []:
+        if widget.get("widget_type") != "POST_ROW":
+            continue
+        token = widget.get("uid")
+        if not token:
+            continue
+        wdata = widget.get("data", {}) or {}
+        rows.append((str(token), str(wdata.get("label") or ""), str(wdata.get("title") or "")))
+    next_identifier = (page.get("infinite_scroll_response", {}) or {}).get("last_item_identifier")
+    return rows, next_identifier
+
+
+def needs_full_sync(chatid, phone, brand_token):
+    """پیمایش کامل لازم است اگر هیچ‌وقت انجام نشده یا از آخرین بار post_full_sync_hours گذشته باشد"""
+    try:
+        conn = _get_connection()
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT last_full_sync FROM post_sync_cursor WHERE chatid = ? AND phone = ? AND brand_token = ?",
+            (int(chatid), int(phone), str(brand_token)),
+        )
+        row = cur.fetchone()
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"⚠️ [post_sync] خطا در خواندن cursor: {e}")
+        return True
+    if not row or row[0] is None:
+        return True
+    return time.time() - float(row[0]) >= _full_sync_interval()
+
+
+def _known_fingerprints(cur, chatid, phone, brand_token, tokens):
+    known = {}
+    tokens = list(tokens)
+    # محدودیت تعداد پارامتر SQLite
+    for i in range(0, len(tokens), 500):
+        part = tokens[i:i + 500]
+        placeholders = ",".join("?" for _ in part)
+        cur.execute(
+            f"SELECT token, fingerprint FROM post_index WHERE chatid = ? AND phone = ? AND brand_token = ? "
+            f"AND token IN ({placeholders})",
+            [int(chatid), int(phone), str(brand_token)] + part,
+        )
+        known.update(cur.fetchall())
+    return known
+
+
+def page_is_known(chatid, phone, brand_token, rows):
+    """آیا همهٔ آگهی‌های این صفحه با همان برچسب/عنوان قبلاً ثبت شده‌اند (نقطهٔ توقف پیمایش افزایشی)"""
+    if not rows:
+        return True
+    try:
+        conn = _get_connection()
+        cur = conn.cursor()
+        known = _known_fingerprints(cur, chatid, phone, brand_token, [r[0] for r in rows])
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"⚠️ [post_sync] خطا در بررسی صفحه: {e}")
+        return False
+    return all(known.get(token) == post_fingerprint(label, title) for token, label, title in rows)
+
+
+def apply_sync(chatid, phone, brand_token, rows, *, full, last_item_identifier=None):
+    """
+    ثبت نتیجهٔ پیمایش در یک تراکنش و برگرداندن همهٔ آگهی‌های لاگین به ترتیب فید.
+    full: همهٔ فید پیمایش شده — رتبه‌ها از نو و آگهی‌های حذف‌شده پاک می‌شوند.
+    در حالت افزایشی فقط آگهی‌های جدید (بالای فید) و ردیف‌های با اثرانگشت تغییرکرده نوشته می‌شوند.
+    """
+    chatid, phone, brand_token = int(chatid), int(phone), str(brand_token)
+    unique_rows = list({r[0]: r for r in reversed(rows)}.values())[::-1]
+    now = time.time()
+    now_text = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    try:
+        conn = _get_connection()
+        cur = conn.cursor()
+        known = _known_fingerprints(cur, chatid, phone, brand_token, [r[0] for r in unique_rows])
+        written = 0
+        removed = 0
+        if full:
+            cur.execute(
+                "SELECT token, rank FROM post_index WHERE chatid = ? AND phone = ? AND brand_token = ?",
+                (chatid, phone, brand_token),
+            )
+            current_ranks = dict(cur.fetchall())
+            changed = [
+                (label, title, post_fingerprint(label, title), float(i), now_text, chatid, phone, brand_token, token)
+                for i, (token, label, title) in enumerate(unique_rows)
+                if token not in known
+                or known[token] != post_fingerprint(label, title)
+                or current_ranks.get(token) != float(i)
+            ]
+            seen = {r[0] for r in unique_rows}
+            stale = [(chatid, phone, brand_token, t) for t in current_ranks if t not in seen]
+            if stale:
+                cur.executemany(
+                    "DELETE FROM post_index WHERE chatid = ? AND phone = ? AND brand_token = ? AND token = ?",
+                    stale,
+                )
+                removed = len(stale)
+        else:
+            cur.execute(
+                "SELECT MIN(rank) FROM post_index WHERE chatid = ? AND phone = ? AND brand_token = ?",
+                (chatid, phone, brand_token),
+            )
+            row = cur.fetchone()
+            top = float(row[0]) if row and row[0] is not None else 0.0
+            new_rows = [r for r in unique_rows if r[0] not in known]
+            changed = [
+                (label, title, post_fingerprint(label, title), top - len(new_rows) + i, now_text, chatid, phone, brand_token, token)
+                for i, (token, label, title) in enumerate(new_rows)
+            ]
+            cur.executemany(
+                "UPDATE post_index SET label = ?, title = ?, fingerprint = ?, updated_at = ? "
+                "WHERE chatid = ? AND phone = ? AND brand_token = ? AND token = ?",
+                [
+                    (label, title, post_fingerprint(label, title), now_text, chatid, phone, brand_token, token)
+                    for token, label, title in unique_rows
+                    if token in known and known[token] != post_fingerprint(label, title)
+                ],
+            )
+            written += max(cur.rowcount, 0)
+        if changed:
+            cur.executemany(
+                "INSERT INTO post_index (label, title, fingerprint, rank, updated_at, chatid, phone, brand_token, token) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(chatid, phone, brand_token, token) DO UPDATE SET "
+                "label = excluded.label, title = excluded.title, fingerprint = excluded.fingerprint, "
+                "rank = excluded.rank, updated_at = excluded.updated_at",
+                changed,
+            )
+            written += len(changed)
+        # فرادادهٔ آگهی‌ها (اولین مشاهده، برچسب، عنوان) برای اولویت‌بندی جریان طبیعی
+        upsert_post_rows(cur, chatid, phone, unique_rows, now)
+        cur.execute(
+            "INSERT INTO post_sync_cursor (chatid, phone, brand_token, head_token, last_item_identifier, last_sync, last_full_sync) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(chatid, phone, brand_token) DO UPDATE SET "
+            "head_token = COALESCE(excluded.head_token, post_sync_cursor.head_token), "
+            "last_item_identifier = excluded.last_item_identifier, last_sync = excluded.last_sync, "
+            "last_full_sync = COALESCE(excluded.last_full_sync, post_sync_cursor.last_full_sync)",
+            (
+                chatid, phone, brand_token,
+                unique_rows[0][0] if unique_rows else None,
+                last_item_identifier,
+                now,
+                now if full else None,
+            ),
+        )
+        conn.commit()
+        cur.close()
+        conn.close()
+        mode = "کامل" if full else "افزایشی"
+        print(f"🔄 [post_sync] همگام‌سازی {mode} phone={phone}: {len(unique_rows)} آگهی دریافت، {written} ردیف نوشته، {removed} حذف")
+    except Exception as e:
+        print(f"❌ [post_sync] خطا در ثبت همگام‌سازی: {e}")
+    return get_posts(chatid, phone, brand_token)
+
+
+def get_posts(chatid, phone, brand_token):
+    """همهٔ آگهی‌های ثبت‌شدهٔ یک لاگین به ترتیب فید: [(token, label, title), ...]"""
+    try:
+        conn = _get_connection()
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT token, label, title FROM post_index WHERE chatid = ? AND phone = ? AND brand_token = ? "
+            "ORDER BY rank, token",
+            (int(chatid), int(phone), str(brand_token)),
+        )
+        rows = cur.fetchall()
+        cur.close()
+        conn.close()
+        return rows
+    except Exception as e:
+        print(f"❌ [post_sync] خطا در خواندن آگهی‌ها: {e}")
+        return []
+
+
+def classify_posts(rows):
+    """
+    دسته‌بندی یک‌بارهٔ آگهی‌های یک پیمایش:
+    published: توکن‌های «منتشر شده»؛ renewal / expired: [{'token', 'label', 'title'}, ...]
+    """
+    snapshot = {"published": [], "renewal": [], "expired": []}
+    for token, label, title in rows:
+        if label == PUBLISHED_LABEL:
+            snapshot["published"].append(token)
+        normalized = _normalize_label(label)
+        if any(keyword in normalized for keyword in RENEWAL_KEYWORDS):
+            snapshot["renewal"].append({"token": token, "label": label, "title": title})
+        if any(keyword in normalized for keyword in EXPIRED_KEYWORDS):
+            snapshot["expired"].append({"token": token, "label": label, "title": title})
+    return snapshot
+
+
+def get_snapshot(chatid, phone, brand_token, require_full=False):
+    """snapshot معتبر (TTL) یک لاگین یا None؛ با require_full فقط snapshot ساخته‌شده از پیمایش کامل"""
+    key = (int(chatid), int(phone), str(brand_token))
+    with _snapshots_lock:
+        entry = _snapshots.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            _snapshots.pop(key, None)
+            return None
+        if require_full and not entry[2]:
+            return None
+        return entry[1]
+
+
+def store_snapshot(chatid, phone, brand_token, snapshot, full=True):
+    """full: snapshot از پیمایش کامل فید ساخته شده و برای تمدید/منقضی هم معتبر است"""
+    ttl = _snapshot_ttl()
+    if ttl > 0:
+        with _snapshots_lock:
+            _snapshots[(int(chatid), int(phone), str(brand_token))] = (time.monotonic() + ttl, snapshot, bool(full))
+    return snapshot
+
+
+def invalidate_snapshot(chatid, phone=None):
+    """باطل کردن snapshot (مثلاً پس از تمدید آگهی‌ها که برچسب‌ها را تغییر می‌دهد)"""
+    with _snapshots_lock:
+        for key in list(_snapshots.keys()):
+            if key[0] == int(chatid) and (phone is None or key[1] == int(phone)):
+                _snapshots.pop(key, None)
+
+
+def drop_post_index(chatid, phone=None):
+    """حذف فهرست، cursor و فرادادهٔ آگهی‌های یک لاگین (یا همهٔ لاگین‌های chatid) — مثلاً پس از حذف لاگین"""
+    invalidate_snapshot(chatid, phone)
+    try:
+        conn = _get_connection()
+        cur = conn.cursor()
+        for table in ("post_index", "post_sync_cursor", "token_meta"):
+            if phone is None:
+                cur.execute(f"DELETE FROM {table} WHERE chatid = ?", (int(chatid),))
+            else:
+                cur.execute(f"DELETE FROM {table} WHERE chatid = ? AND phone = ?", (int(chatid), int(phone)))
+        conn.commit()
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"❌ [post_sync] خطا در حذف فهرست آگهی‌ها: {e}")
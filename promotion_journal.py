@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+ژورنال تلاش‌های نردبان.
+هر اجرای خط لولهٔ شش‌مرحله‌ای (selectPlan → createOrderID → createFlow → createCheckOut → pay → promote)
+یک ردیف در promotion_attempts و برای هر مرحله یک ردیف در promotion_stages (شروع/پایان، آخرین HTTP status،
+تعداد درخواست‌ها با retry و کلاس خطا) ثبت می‌کند. rollupها (p50/p95 هر مرحله، نرخ شکست هر لاگین)
+در stats_info ربات و پنل وب نمایش داده می‌شوند.
+"""
+
+import contextvars
+import math
+import threading
+import time
+
+import metrics
+from loadConfig import configBot, get_config
+from curds import get_db_connection, ensure_schema
+
+STAGES = ("selectPlan", "createOrderID", "createFlow", "createCheckOut", "pay", "promote")
+DEFAULT_RETENTION_DAYS = 14
+DEFAULT_ROLLUP_HOURS = 24
+# هر چند ثبت یک‌بار رکوردهای قدیمی‌تر از promotion_journal_days پاک می‌شوند
+_PRUNE_EVERY = 200
+
+# مرحلهٔ در حال اجرای task جاری؛ _request در dapi_async وضعیت HTTP را روی آن ثبت می‌کند
+_current_stage = contextvars.ContextVar("promotion_stage", default=None)
+
+_db_path = None
+_ready = False
+_writes = 0
+_writes_lock = threading.Lock()
+
+
+def _get_connection():
+    global _db_path, _ready
+    if _db_path is None:
+        _db_path = configBot().database
+    if not _ready:
+        ensure_schema(_db_path)
+        _ready = True
+    return get_db_connection(_db_path)
+
+
+def _config_number(key, default):
+    try:
+        return max(0.0, float(get_config().get(key, default)))
+    except Exception:
+        return default
+
+
+class _StageRecord:
+    __slots__ = ("name", "started_at", "ended_at", "http_status", "requests", "error_class")
+
+    def __init__(self, name):
+        self.name = name
+        self.started_at = time.time()
+        self.ended_at = None
+        self.http_status = None
+        self.requests = 0
+        self.error_class = None
+
+
+class PromotionAttempt:
+    """رکورد یک تلاش نردبان؛ begin/end دور هر مرحله و finish با خروجی خط لوله ([1, ...] / [0, token, err])"""
+
+    def __init__(self, chatid, phone, token, mode="single"):
+        self.chatid = chatid
+        self.phone = phone
+        self.token = token
+        self.mode = mode
+        self.started_at = time.time()
+        self.stages = []
+
+    def begin(self, stage):
+        record = _StageRecord(stage)
+        self.stages.append(record)
+        return record, _current_stage.set(record)
+
+    def end(self, handle, error=None):
+        record, ctx_token = handle
+        record.ended_at = time.time()
+        if error is not None and record.error_class is None:
+            record.error_class = type(error).__name__
+        _current_stage.reset(ctx_token)
+
+    def finish(self, result):
+        success = bool(result) and result[0] == 1
+        last = self.stages[-1] if self.stages else None
+        error = None
+        if not success and result and len(result) > 2:
+            error = str(result[2])[:200]
+        outcome = "success" if success else "failed"
+        metrics.inc("probot_promotions_total", outcome=outcome, mode=self.mode)
+        for record in self.stages:
+            if record.ended_at is not None:
+                metrics.observe("probot_promotion_stage_seconds", record.ended_at - record.started_at, stage=record.name)
+            if record.error_class:
+                metrics.inc("probot_promotion_stage_failures_total", stage=record.name)
+        _write_attempt(
+            self,
+            outcome=outcome,
+            failed_stage=None if success or last is None else last.name,
+            error_class=None if success or last is None else last.error_class,
+            error=error,
+        )
+
+
+def note_http(status=None, error=None):
+    """ثبت یک درخواست HTTP (پاسخ یا خطای انتقال) روی مرحلهٔ جاری؛ خارج از خط لوله بی‌اثر است"""
+    record = _current_stage.get()
+    if record is None:
+        return
+    record.requests += 1
+    if status is not None:
+        record.http_status = int(status)
+        # خطای انتقالی که retry بعدی آن را جبران کرده شکست مرحله نیست (در requests دیده می‌شود)
+        record.error_class = None
+    if error is not None:
+        record.error_class = type(error).__name__
+
+
+def _write_attempt(attempt, *, outcome, failed_stage, error_class, error):
+    global _writes
+    try:
+        conn = _get_connection()
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT INTO promotion_attempts (chatid, phone, token, mode, started_at, finished_at, outcome, "
+            "failed_stage, error_class, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                int(attempt.chatid), int(attempt.phone), str(attempt.token), attempt.mode,
+                attempt.started_at, time.time(), outcome, failed_stage, error_class, error,
+            ),
+        )
+        attempt_id = cur.lastrowid
+        cur.executemany(
+            "INSERT OR REPLACE INTO promotion_stages (attempt_id, stage, started_at, ended_at, http_status, "
+            "requests, error_class) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (attempt_id, r.name, r.started_at, r.ended_at, r.http_status, r.requests, r.error_class)
+                for r in attempt.stages
+            ],
+        )
+        with _writes_lock:
+            _writes += 1
+            prune = _writes % _PRUNE_EVERY == 0
+        if prune:
+            _prune(cur)
+        conn.commit()
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"⚠️ [promotion_journal] ثبت تلاش نردبان ناموفق بود: {e}")
+
+
+def _prune(cur):
+    cutoff = time.time() - _config_number("promotion_journal_days", DEFAULT_RETENTION_DAYS) * 86400
+    cur.execute(
+        "DELETE FROM promotion_stages WHERE attempt_id IN (SELECT id FROM promotion_attempts WHERE started_at < ?)",
+        (cutoff,),
+    )
+    cur.execute("DELETE FROM promotion_attempts WHERE started_at < ?", (cutoff,))
+
+
+def _percentile(values, q):
+    """صدک nearest-rank از لیست مرتب"""
+    if not values:
+        return None
+    rank = max(0, min(len(values) - 1, math.ceil(q * len(values)) - 1))
+    return values[rank]
+
+
+def _window(hours):
+    if hours is None:
+        hours = _config_number("promotion_rollup_hours", DEFAULT_ROLLUP_HOURS)
+    return time.time() - hours * 3600
+
+
+def stage_latency_rollup(chatid=None, hours=None):
+    """
+    {stage: {"count", "failed", "p50", "p95"}} برای مراحل اجراشده در پنجرهٔ promotion_rollup_hours (ثانیه)،
+    به ترتیب خط لوله.
+    """
+    query = (
+        "SELECT s.stage, s.ended_at - s.started_at, s.error_class FROM promotion_stages s "
+        "JOIN promotion_attempts a ON a.id = s.attempt_id "
+        "WHERE a.started_at >= ? AND s.ended_at IS NOT NULL"
+    )
+    params = [_window(hours)]
+    if chatid is not None:
+        query += " AND a.chatid = ?"
+        params.append(int(chatid))
+    try:
+        conn = _get_connection()
+        rows = conn.execute(query, params).fetchall()
+        conn.close()
+    except Exception as e:
+        print(f"❌ [promotion_journal] خطا در خواندن زمان مراحل: {e}")
+        return {}
+    durations = {}
+    failures = {}
+    for stage, duration, error_class in rows:
+        durations.setdefault(stage, []).append(max(0.0, float(duration)))
+        if error_class:
+            failures[stage] = failures.get(stage, 0) + 1
+    result = {}
+    for stage in sorted(durations, key=lambda s: STAGES.index(s) if s in STAGES else len(STAGES)):
+        values = sorted(durations[stage])
+        result[stage] = {
+            "count": len(values),
+            "failed": failures.get(stage, 0),
+            "p50": round(_percentile(values, 0.50), 3),
+            "p95": round(_percentile(values, 0.95), 3),
+        }
+    return result
+
+
+def login_failure_rollup(chatid=None, hours=None):
+    """[{"phone", "attempts", "failed", "failure_rate"}] در پنجرهٔ rollup، بیشترین نرخ شکست اول"""
+    query = (
+        "SELECT phone, COUNT(*), SUM(CASE WHEN outcome = 'success' THEN 0 ELSE 1 END) "
+        "FROM promotion_attempts WHERE started_at >= ?"
+    )
+    params = [_window(hours)]
+    if chatid is not None:
+        query += " AND chatid = ?"
+        params.append(int(chatid))
+    query += " GROUP BY phone"
+    try:
+        conn = _get_connection()
+        rows = conn.execute(query, params).fetchall()
+        conn.close()
+    except Exception as e:
+        print(f"❌ [promotion_journal] خطا در خواندن نرخ شکست لاگین‌ها: {e}")
+        return []
+    result = [
+        {
+            "phone": phone,
+            "attempts": attempts,
+            "failed": failed or 0,
+            "failure_rate": round(100.0 * (failed or 0) / attempts, 1) if attempts else 0.0,
+        }
+        for phone, attempts, failed in rows
+    ]
+    result.sort(key=lambda r: (-r["failure_rate"], -r["attempts"]))
+    return result
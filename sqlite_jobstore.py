@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+jobstore پایدار APScheduler روی جدول scheduler_jobs در bot.db (بدون وابستگی به SQLAlchemy).
+هر پروسه (ربات / worker) با owner جدا jobهای خودش را نگه می‌دارد تا دو scheduler یک job را اجرا نکنند.
+"""
+
+import pickle
+import sqlite3
+
+from apscheduler.job import Job
+from apscheduler.jobstores.base import BaseJobStore, ConflictingIdError, JobLookupError
+from apscheduler.util import datetime_to_utc_timestamp, utc_timestamp_to_datetime
+
+from curds import ensure_schema, get_db_connection
+
+
+class SqliteJobStore(BaseJobStore):
+    def __init__(self, db_path, owner, pickle_protocol=pickle.HIGHEST_PROTOCOL):
+        super().__init__()
+        self.db_path = db_path
+        self.owner = owner
+        self.pickle_protocol = pickle_protocol
+
+    def start(self, scheduler, alias):
+        super().start(scheduler, alias)
+        ensure_schema(self.db_path)
+
+    def _conn(self):
+        return get_db_connection(self.db_path)
+
+    def lookup_job(self, job_id):
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT job_state FROM scheduler_jobs WHERE owner = ? AND id = ?",
+            (self.owner, job_id),
+        ).fetchone()
+        return self._reconstitute_job(row[0]) if row else None
+
+    def get_due_jobs(self, now):
+        timestamp = datetime_to_utc_timestamp(now)
+        return self._get_jobs("next_run_time <= ?", (timestamp,))
+
+    def get_next_run_time(self):
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT next_run_time FROM scheduler_jobs WHERE owner = ? AND next_run_time IS NOT NULL "
+            "ORDER BY next_run_time LIMIT 1",
+            (self.owner,),
+        ).fetchone()
+        return utc_timestamp_to_datetime(row[0]) if row else None
+
+    def get_all_jobs(self):
+        jobs = self._get_jobs()
+        self._fix_paused_jobs_sorting(jobs)
+        return jobs
+
+    def add_job(self, job):
+        conn = self._conn()
+        try:
+            conn.execute(
+                "INSERT INTO scheduler_jobs (owner, id, next_run_time, job_state) VALUES (?, ?, ?, ?)",
+                (self.owner, job.id, datetime_to_utc_timestamp(job.next_run_time), self._serialize(job)),
+            )
+            conn.commit()
+        except sqlite3.IntegrityError:
+            conn.close()
+            raise ConflictingIdError(job.id)
+
+    def update_job(self, job):
+        conn = self._conn()
+        cur = conn.execute(
+            "UPDATE scheduler_jobs SET next_run_time = ?, job_state = ? WHERE owner = ? AND id = ?",
+            (datetime_to_utc_timestamp(job.next_run_time), self._serialize(job), self.owner, job.id),
+        )
+        conn.commit()
+        if cur.rowcount == 0:
+            raise JobLookupError(job.id)
+
+    def remove_job(self, job_id):
+        conn = self._conn()
+        cur = conn.execute(
+            "DELETE FROM scheduler_jobs WHERE owner = ? AND id = ?",
+            (self.owner, job_id),
+        )
+        conn.commit()
+        if cur.rowcount == 0:
+            raise JobLookupError(job_id)
+
+    def remove_all_jobs(self):
+        conn = self._conn()
+        conn.execute("DELETE FROM scheduler_jobs WHERE owner = ?", (self.owner,))
+        conn.commit()
+
+    def _serialize(self, job):
+        return pickle.dumps(job.__getstate__(), self.pickle_protocol)
+
+    def _reconstitute_job(self, job_state):
+        job_state = pickle.loads(job_state)
+        job_state["jobstore"] = self
+        job = Job.__new__(Job)
+        job.__setstate__(job_state)
+        job._scheduler = self._scheduler
+        job._jobstore_alias = self._alias
+        return job
+
+    def _get_jobs(self, condition=None, params=()):
+        conn = self._conn()
+        query = "SELECT id, job_state FROM scheduler_jobs WHERE owner = ?"
+        if condition:
+            query += f" AND {condition}"
+        # jobهای متوقف (next_run_time خالی) در انتها
+        query += " ORDER BY next_run_time IS NULL, next_run_time"
+        rows = conn.execute(query, (self.owner, *params)).fetchall()
+        jobs = []
+        failed_ids = []
+        for job_id, job_state in rows:
+            try:
+                jobs.append(self._reconstitute_job(job_state))
+            except Exception as e:
+                # مرجع تابع دیگر قابل بارگذاری نیست (مثلاً تغییر نام)؛ job خراب حذف می‌شود
+                print(f"⚠️ بازیابی job «{job_id}» از jobstore ناموفق بود و حذف شد: {e}")
+                failed_ids.append(job_id)
+        if failed_ids:
+            conn.executemany(
+                "DELETE FROM scheduler_jobs WHERE owner = ? AND id = ?",
+                [(self.owner, job_id) for job_id in failed_ids],
+            )
+            conn.commit()
+        return jobs
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} (owner={self.owner})>"
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pending_index  # noqa: E402
+import tokens_manager  # noqa: E402
+
+
+@pytest.fixture
+def token_store(tmp_path, monkeypatch):
+    """دیتابیس موقت برای tokens_manager و pending_index؛ tokens.json و configs.json پروژه خوانده نمی‌شوند"""
+    monkeypatch.chdir(tmp_path)
+    db_path = str(tmp_path / "bot.db")
+    monkeypatch.setattr(tokens_manager, "_db_path", db_path)
+    monkeypatch.setattr(tokens_manager, "_store_ready", False)
+    monkeypatch.setattr(pending_index, "_db_path", db_path)
+    monkeypatch.setattr(pending_index, "_ready", False)
+    pending_index.invalidate()
+    yield db_path
+    pending_index.invalidate()
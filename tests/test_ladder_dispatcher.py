@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+
+import ladder_dispatcher
+from ladder_dispatcher import LADDER, STOP, LadderDispatcher
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_cancel_is_lazy_and_cancelled_entries_never_fire():
+    fired = []
+
+    async def callback(chatid):
+        fired.append(chatid)
+
+    async def main():
+        d = LadderDispatcher()
+        now = time.time()
+        for chatid in (1, 2, 3):
+            d.schedule(chatid, LADDER, callback, now + 0.02)
+        assert d.cancel(2) == 1
+        # حذف از heap تنبل است
+        assert d.stats()["heap"] == 3
+        assert d.get(2) is None
+        await asyncio.sleep(0.1)
+        d.shutdown()
+        return d
+
+    d = _run(main())
+    assert sorted(fired) == [1, 3]
+    assert d.stats()["heap"] == 0
+
+
+def test_compaction_after_mass_cancel(monkeypatch):
+    monkeypatch.setattr(ladder_dispatcher, "_COMPACT_MIN_STALE", 4)
+    d = LadderDispatcher()
+    due = time.time() + 3600
+
+    async def callback(chatid):
+        pass
+
+    for chatid in range(6):
+        d.schedule(chatid, LADDER, callback, due)
+    for chatid in range(3):
+        d.cancel(chatid)
+    assert d.stats()["heap"] == 6
+    d.cancel(3)
+    assert d.stats()["heap"] == 2
+    assert d._stale == 0
+    assert sorted(d.chats()) == [4, 5]
+
+
+def test_schedule_reschedule_cancel_fire_in_due_order():
+    fired = []
+
+    def make(name):
+        async def callback(chatid):
+            fired.append(name)
+        return callback
+
+    async def main():
+        d = LadderDispatcher()
+        now = time.time()
+        d.schedule(1, LADDER, make("a"), now + 0.06)
+        d.schedule(2, LADDER, make("b"), now + 0.02)
+        d.schedule(3, LADDER, make("c"), now + 0.04)
+        d.schedule(4, LADDER, make("d"), now + 0.03)
+        # جایگزینی نوبت یک چت نوبت قبلی را لغو می‌کند
+        d.schedule(2, LADDER, make("b2"), now + 0.05)
+        assert d.reschedule(1, LADDER, now + 0.01)
+        assert not d.reschedule(9, LADDER, now)
+        d.cancel(4)
+        await asyncio.sleep(0.15)
+        d.shutdown()
+
+    _run(main())
+    assert fired == ["a", "c", "b2"]
+
+
+def test_missed_interval_ticks_are_coalesced():
+    fired = []
+    dues = []
+
+    async def callback(chatid):
+        fired.append(chatid)
+
+    async def main():
+        d = LadderDispatcher(on_due_change=lambda chatid, kind, due: dues.append(due))
+        now = time.time()
+        d.schedule(7, LADDER, callback, now - 100, interval=10)
+        await asyncio.sleep(0.05)
+        entry = d.get(7)
+        d.shutdown()
+        return now, entry
+
+    now, entry = _run(main())
+    # ده نوبت ازدست‌رفته فقط یک اجرا دارد و نوبت بعدی یک interval بعد از الان است
+    assert fired == [7]
+    assert entry.due >= now + 10
+    assert dues[-1] == entry.due
+    assert len(dues) == 2
+
+
+def test_overlapping_ladder_run_is_skipped():
+    started = []
+    lags = []
+
+    async def main():
+        release = asyncio.Event()
+
+        async def slow(chatid):
+            started.append(chatid)
+            await release.wait()
+
+        d = LadderDispatcher(on_lag=lambda chatid, kind, lag: lags.append(kind))
+        d.schedule(5, LADDER, slow, time.time(), interval=0.02)
+        await asyncio.sleep(0.12)
+        # نوبت‌های بعدی تا تمام شدن اجرای قبلی رد شدند (max_instances=1)
+        assert started == [5]
+        assert d.stats()["running"] == 1
+        release.set()
+        await asyncio.sleep(0.05)
+        d.shutdown()
+
+    _run(main())
+    assert len(started) >= 2
+    assert len(lags) > len(started)
+
+
+def test_stop_entry_is_one_shot_and_not_blocked_by_running_ladder():
+    fired = []
+
+    async def main():
+        release = asyncio.Event()
+
+        async def ladder(chatid):
+            await release.wait()
+
+        async def stop(chatid):
+            fired.append(("stop", chatid))
+
+        d = LadderDispatcher()
+        d.schedule(8, LADDER, ladder, time.time())
+        d.schedule(8, STOP, stop, time.time() + 0.02)
+        await asyncio.sleep(0.08)
+        assert d.get(8, STOP) is None
+        assert d.get(8, LADDER) is None
+        release.set()
+        await asyncio.sleep(0)
+        d.shutdown()
+
+    _run(main())
+    assert fired == [("stop", 8)]
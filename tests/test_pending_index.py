@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import random
+
+from curds import get_db_connection
+
+import pending_index
+import tokens_manager
+
+CHAT = 1
+
+
+def _seed():
+    tokens_manager.add_tokens_batch(CHAT, {100: ["a", "b", "c"], 200: ["d", "e"]})
+
+
+def _index():
+    return pending_index._indexes[CHAT]
+
+
+def _external_write(db_path, sql, params):
+    """نوشتن پروسهٔ دیگر (مثلاً worker): token_states و نسخهٔ چت بدون خبر دادن به نمایهٔ این پروسه"""
+    conn = get_db_connection(db_path)
+    cur = conn.cursor()
+    cur.execute(sql, params)
+    pending_index.bump_pending_version(cur, CHAT)
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+def test_pick_oldest_follows_status_changes_without_reload(token_store):
+    _seed()
+    assert pending_index.pick_oldest_token(CHAT, 100) == "a"
+    loads = pending_index._loads
+    tokens_manager.update_token_status(CHAT, 100, "a", "success")
+    assert pending_index.pick_oldest_token(CHAT, 100) == "b"
+    tokens_manager.set_tokens_status(CHAT, ["b", "c"], "failed")
+    assert pending_index.pick_oldest_token(CHAT, 100) is None
+    assert pending_index.pending_count(CHAT) == 2
+    assert pending_index._loads == loads
+
+
+def test_discard_swap_removes_from_random_array(token_store):
+    _seed()
+    assert pending_index.pending_count(CHAT) == 5
+    tokens_manager.update_token_status(CHAT, 100, "b", "success")
+    index = _index()
+    assert sorted(index.items) == ["a", "c", "d", "e"]
+    assert all(index.items[pos] == token for token, pos in index.positions.items())
+    assert index.counts == {100: 2, 200: 2}
+    picks = {pending_index.pick_random_token(CHAT, rng=random.Random(seed)) for seed in range(50)}
+    assert picks == {(100, "a"), (100, "c"), (200, "d"), (200, "e")}
+
+
+def test_round_robin_cursor_rotates_and_skips_empty_phones(token_store):
+    _seed()
+    phones = [100, 200, 300]
+    assert pending_index.pick_round_robin_token(CHAT, phones) == (100, "a")
+    assert pending_index.pick_round_robin_token(CHAT, phones) == (200, "d")
+    assert pending_index.pick_round_robin_token(CHAT, phones) == (100, "a")
+    tokens_manager.set_tokens_status(CHAT, ["a", "b", "c"], "success")
+    assert pending_index.pick_round_robin_token(CHAT, phones) == (200, "d")
+    assert pending_index.pick_round_robin_token(CHAT, phones) == (200, "d")
+
+
+def test_round_robin_uses_stored_phone_only_for_a_fresh_index(token_store):
+    _seed()
+    assert pending_index.pick_round_robin_token(CHAT, [100, 200], last_phone=100) == (200, "d")
+    assert pending_index.pick_round_robin_token(CHAT, [100, 200], last_phone=100) == (100, "a")
+
+
+def test_natural_flow_heap_orders_by_key_and_filters_phones(token_store):
+    _seed()
+    conn = get_db_connection(token_store)
+    conn.executemany(
+        "INSERT INTO token_meta (chatid, token, phone, first_seen, last_promoted, promote_count) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (CHAT, "a", 100, 500.0, None, 0),
+            (CHAT, "b", 100, 100.0, None, 0),
+            (CHAT, "c", 100, 300.0, None, 0),
+            (CHAT, "d", 200, 200.0, None, 0),
+            (CHAT, "e", 200, 50.0, 10_000.0, 1),
+        ],
+    )
+    conn.commit()
+    conn.close()
+    assert pending_index.pick_natural_flow_token(CHAT, [100, 200]) == (100, "b")
+    tokens_manager.update_token_status(CHAT, 100, "b", "success")
+    assert pending_index.pick_natural_flow_token(CHAT, [100, 200]) == (200, "d")
+    # شمارهٔ غیرمجاز رد می‌شود ولی ورودی‌هایش در heap می‌مانند
+    assert pending_index.pick_natural_flow_token(CHAT, [100]) == (100, "c")
+    assert pending_index.pick_natural_flow_token(CHAT, [200]) == (200, "d")
+
+
+def test_own_writes_keep_index_version_current(token_store):
+    _seed()
+    pending_index.pick_oldest_token(CHAT, 100)
+    tokens_manager.update_token_status(CHAT, 100, "a", "success")
+    tokens_manager.set_tokens_status(CHAT, ["d"], "failed")
+    loads = pending_index._loads
+    assert pending_index.reconcile_pending_index(CHAT) is True
+    assert pending_index._loads == loads
+
+
+def test_external_write_is_reconciled_and_cursor_kept(token_store):
+    _seed()
+    assert pending_index.pick_round_robin_token(CHAT, [100, 200]) == (100, "a")
+    _external_write(
+        token_store,
+        "UPDATE token_states SET status = 'success' WHERE chatid = ? AND token = ?",
+        (CHAT, "d"),
+    )
+    assert pending_index.reconcile_pending_index(CHAT) is False
+    assert pending_index.reconcile_pending_index(CHAT) is True
+    # مکان‌نما پس از بازسازی حفظ شده است
+    assert pending_index.pick_round_robin_token(CHAT, [100, 200]) == (200, "e")
+
+
+def test_missed_version_forces_reload(token_store):
+    _seed()
+    pending_index.pick_oldest_token(CHAT, 100)
+    _external_write(token_store, "UPDATE token_states SET status = 'failed' WHERE token = ?", ("c",))
+    # نوشتن این پروسه بعد از نوشتن خارجی؛ نسخه یک واحد جلوتر از نمایه نیست و پذیرفته نمی‌شود
+    tokens_manager.update_token_status(CHAT, 100, "a", "success")
+    assert pending_index.reconcile_pending_index(CHAT) is False
+    assert pending_index.pending_count(CHAT, 100) == 1
+
+
+def test_additions_and_resets_invalidate_the_chat(token_store):
+    _seed()
+    assert pending_index.pending_count(CHAT, 200) == 2
+    tokens_manager.add_tokens_to_json(CHAT, 200, ["f"])
+    assert CHAT not in pending_index._indexes
+    assert pending_index.pending_count(CHAT, 200) == 3
+    tokens_manager.reset_tokens_for_phone(CHAT, 100)
+    assert pending_index.pick_oldest_token(CHAT, 100) is None
+    assert pending_index.pick_oldest_token(CHAT, 200) == "d"
+
+
+def test_status_back_to_pending_drops_index(token_store):
+    _seed()
+    tokens_manager.update_token_status(CHAT, 100, "a", "success")
+    assert pending_index.pick_oldest_token(CHAT, 100) == "b"
+    tokens_manager.update_token_status(CHAT, 100, "a", "pending")
+    assert CHAT not in pending_index._indexes
+    assert pending_index.pick_oldest_token(CHAT, 100) == "a"
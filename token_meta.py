@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+فرادادهٔ هر آگهی در جدول token_meta: برچسب و عنوان (از ردیف‌های post-list هنگام همگام‌سازی)، زمان اولین مشاهده،
+زمان آخرین نردبان موفق و تعداد نردبان‌ها (جدول با مهاجرت ۸ curds ساخته می‌شود و نوشتن‌ها در تراکنش فراخواننده است).
+ردیف‌های post-list زمان انتشار، بازدید یا دسته‌بندی ندارند؛ پس first_seen سن واقعی آگهی نیست، بلکه اولین باری است
+که همگام‌سازی ربات آن را دیده است.
+نردبان نوع ۴ (جریان طبیعی) آگهی با کوچک‌ترین natural_flow_key را برمی‌دارد: آگهی‌ای که مدت بیشتری است
+نه تازه دیده شده و نه نردبان شده، با جریمه برای آگهی‌هایی که بارها نردبان شده‌اند.
+"""
+
+import time
+
+from loadConfig import get_config
+
+DEFAULT_PROMOTE_PENALTY_HOURS = 6.0
+
+
+def _promote_penalty():
+    try:
+        hours = float(get_config().get("natural_flow_promote_penalty_hours", DEFAULT_PROMOTE_PENALTY_HOURS))
+    except Exception:
+        hours = DEFAULT_PROMOTE_PENALTY_HOURS
+    return max(0.0, hours) * 3600
+
+
+def natural_flow_key(first_seen, last_promoted, promote_count, penalty=None):
+    """
+    کلید اولویت جریان طبیعی (کوچک‌تر = زودتر): آخرین «تازه شدن» آگهی (اولین مشاهده یا آخرین نردبان)
+    به‌علاوهٔ جریمهٔ هر نردبان. کلید به زمان فعلی وابسته نیست، پس heap ساخته‌شده تا تغییر خود آگهی معتبر می‌ماند.
+    """
+    if penalty is None:
+        penalty = _promote_penalty()
+    touched = max(float(first_seen or 0), float(last_promoted or 0))
+    return touched + int(promote_count or 0) * penalty
+
+
+def upsert_post_rows(cur, chatid, phone, rows, now=None):
+    """
+    ثبت (token, label, title) ردیف‌های post-list در همان تراکنش همگام‌سازی.
+    first_seen فقط بار اول نوشته می‌شود و زمان مشاهده است، نه زمان انتشار. آگهی‌هایی که در یک همگام‌سازی
+    با هم دیده می‌شوند به ترتیب فید یک ثانیه فاصله می‌گیرند تا ترتیبشان در heap ثابت بماند؛ این فاصله فقط
+    جای ترتیب فید را می‌گیرد و سن آگهی را نشان نمی‌دهد. ردیف‌های بدون تغییر بازنویسی نمی‌شوند.
+    """
+    if not rows:
+        return
+    now = time.time() if now is None else now
+    cur.executemany(
+        "INSERT INTO token_meta (chatid, token, phone, label, title, first_seen) VALUES (?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT(chatid, token) DO UPDATE SET "
+        "phone = excluded.phone, label = excluded.label, title = excluded.title "
+        "WHERE token_meta.label IS NOT excluded.label OR token_meta.title IS NOT excluded.title "
+        "OR token_meta.phone IS NOT excluded.phone",
+        [
+            (int(chatid), str(token), int(phone), label, title, now - i)
+            for i, (token, label, title) in enumerate(rows)
+        ],
+    )
+
+
+def record_promotions(cur, chatid, tokens, now=None):
+    """ثبت نردبان موفق توکن‌ها (زمان آخرین نردبان و شمارنده) در تراکنش جاری"""
+    tokens = [str(t) for t in tokens or [] if t]
+    if not tokens:
+        return
+    now = time.time() if now is None else now
+    cur.executemany(
+        "INSERT INTO token_meta (chatid, token, last_promoted, promote_count) VALUES (?, ?, ?, 1) "
+        "ON CONFLICT(chatid, token) DO UPDATE SET "
+        "last_promoted = excluded.last_promoted, promote_count = token_meta.promote_count + 1",
+        [(int(chatid), t, now) for t in tokens],
+    )
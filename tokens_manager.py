@@ -1,37 +1,66 @@
 # -*- coding: utf-8 -*-
 """
-ماژول مدیریت توکن‌ها در فایل JSON
-ساختار جدید: هر توکن با وضعیت (pending, success, failed) ذخیره می‌شود
+ماژول مدیریت وضعیت توکن‌ها (pending, success, failed)
+داده‌ها در جدول token_states دیتابیس bot.db نگه‌داری می‌شوند (هر توکن یک ردیف، یکتا روی chatid+token)
+تا هر تغییر وضعیت فقط همان ردیف را به‌روزرسانی کند و bot/worker روی یک فایل JSON با هم رقابت نکنند.
+نام توابع (…_json) برای سازگاری با کد قبلی حفظ شده است؛ tokens.json فقط یک‌بار به دیتابیس منتقل می‌شود.
 """
 
 import json
 import os
 import threading
-import copy
-from datetime import datetime, timedelta
+from datetime import datetime
+from types import MappingProxyType
+
+from loadConfig import configBot
+from curds import get_db_connection, ensure_schema, notify_state_change
+import pending_index
+from token_meta import record_promotions
 
 TOKENS_JSON_FILE = "tokens.json"
 
-# Cache برای JSON - بهبود performance
-_tokens_cache = {}
-_cache_lock = threading.Lock()
-_cache_last_modified = None
-_cache_ttl = timedelta(seconds=5)  # Cache برای 5 ثانیه معتبر است
 _STATUS_ORDER = ("pending", "success", "failed")
 _STATUS_PRIORITY = {"pending": 1, "failed": 2, "success": 3}
 
+_store_lock = threading.Lock()
+_store_ready = False
+_db_path = None
+
+
+def _get_db_path():
+    global _db_path
+    if _db_path is None:
+        _db_path = configBot().database
+    return _db_path
+
+
+def _get_connection():
+    """اتصال ماندگار thread جاری به bot.db (همان مدیر اتصال curds: WAL + busy_timeout)"""
+    return get_db_connection(_get_db_path())
+
+
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
 
-def _deepcopy_tokens_data(tokens_data):
-    """کپی عمیق امن از داده‌های توکن"""
-    return copy.deepcopy(tokens_data)
+def _now_text():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
 
-def _write_json_file(data):
-    """نوشتن اتمیک JSON برای کاهش ریسک خراب شدن فایل"""
-    temp_file = f"{TOKENS_JSON_FILE}.tmp"
-    with open(temp_file, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-    os.replace(temp_file, TOKENS_JSON_FILE)
+def _ensure_store():
+    """اطمینان از مهاجرت schema (یک‌بار در هر پروسه) و انتقال یک‌بارهٔ tokens.json قدیمی"""
+    global _store_ready
+    if _store_ready:
+        return
+    with _store_lock:
+        if _store_ready:
+            return
+        ensure_schema(_get_db_path())
+        _store_ready = True
+    import_tokens_json_to_db()
 
 
 def _normalize_tokens_data(tokens_data):
@@ -87,365 +116,484 @@ def _normalize_tokens_data(tokens_data):
 
     return normalized, changed
 
-def _create_empty_json_file():
-    """ایجاد فایل JSON خالی"""
-    try:
-        data = {}
-        _write_json_file(data)
-        print(f"✅ فایل {TOKENS_JSON_FILE} ایجاد شد.")
-        return True
-    except Exception as e:
-        print(f"❌ خطا در ایجاد فایل {TOKENS_JSON_FILE}: {e}")
-        import traceback
-        traceback.print_exc()
-        return False
 
 def _migrate_old_format_to_new(data):
-    """تبدیل ساختار قدیمی به ساختار جدید"""
+    """تبدیل ساختار قدیمی (لیست ساده) به ساختار وضعیت‌دار"""
     try:
         migrated = {}
         for chatid_str, phones in data.items():
             chatid_int = int(chatid_str)
             migrated[chatid_int] = {}
-            
+
             for phone_str, tokens in phones.items():
                 phone_int = int(phone_str)
-                
+
                 # اگر tokens یک لیست ساده است (ساختار قدیمی)
                 if isinstance(tokens, list):
-                    # همه توکن‌های قدیمی را به pending تبدیل می‌کنیم
                     migrated[chatid_int][phone_int] = {
                         "pending": tokens,
                         "success": [],
                         "failed": []
                     }
-                # اگر tokens یک دیکشنری است (ساختار جدید)
                 elif isinstance(tokens, dict):
-                    # اطمینان از وجود همه کلیدها
                     migrated[chatid_int][phone_int] = {
                         "pending": tokens.get("pending", []),
                         "success": tokens.get("success", []),
                         "failed": tokens.get("failed", [])
                     }
-        
+
         return migrated
     except Exception as e:
         print(f"⚠️ خطا در تبدیل ساختار قدیمی: {e}")
         return data
 
+
+def _insert_tokens_data(cur, tokens_data):
+    """درج ساختار تو در تو {chatid: {phone: {status: [tokens]}}} در جدول؛ خروجی: تعداد ردیف جدید"""
+    now = _now_text()
+    rows = []
+    for chatid, phones in tokens_data.items():
+        for phone, status_dict in phones.items():
+            for status in _STATUS_ORDER:
+                for token in status_dict.get(status, []):
+                    rows.append((int(chatid), int(phone), str(token), status, now))
+    if not rows:
+        return 0
+    cur.executemany(
+        "INSERT OR IGNORE INTO token_states (chatid, phone, token, status, updated_at) VALUES (?, ?, ?, ?, ?)",
+        rows,
+    )
+    return cur.rowcount if cur.rowcount is not None and cur.rowcount >= 0 else len(rows)
+
+
+def import_tokens_json_to_db(force=False):
+    """
+    انتقال یک‌بارهٔ tokens.json به جدول token_states.
+    پس از انتقال، پرچم tokens_json_imported در token_store_meta ثبت می‌شود و فایل دست‌نخورده باقی می‌ماند.
+    """
+    try:
+        ensure_schema(_get_db_path())
+        conn = _get_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT value FROM token_store_meta WHERE key = 'tokens_json_imported'")
+        row = cur.fetchone()
+        if row and not force:
+            cur.close()
+            conn.close()
+            return 0
+
+        imported = 0
+        if os.path.exists(TOKENS_JSON_FILE):
+            with open(TOKENS_JSON_FILE, 'r', encoding='utf-8') as f:
+                data = json.load(f) or {}
+            data = _migrate_old_format_to_new(data)
+            data, _ = _normalize_tokens_data(data)
+            imported = _insert_tokens_data(cur, data)
+            if imported:
+                pending_index.bump_pending_version(cur)
+            print(f"✅ {imported} توکن از {TOKENS_JSON_FILE} به دیتابیس منتقل شد.")
+
+        cur.execute(
+            "INSERT OR REPLACE INTO token_store_meta (key, value) VALUES ('tokens_json_imported', ?)",
+            (_now_text(),),
+        )
+        conn.commit()
+        cur.close()
+        conn.close()
+        if imported:
+            pending_index.invalidate()
+        return imported
+    except Exception as e:
+        print(f"❌ خطا در انتقال {TOKENS_JSON_FILE} به دیتابیس: {e}")
+        import traceback
+        traceback.print_exc()
+        return 0
+
+
 def load_tokens_json(force_reload=False):
-    """بارگذاری توکن‌ها از فایل JSON با cache"""
-    global _tokens_cache, _cache_last_modified
-    
-    with _cache_lock:
-        # بررسی cache
-        if not force_reload and _tokens_cache and _cache_last_modified:
-            # بررسی اینکه آیا فایل تغییر کرده است
-            try:
-                file_mtime = os.path.getmtime(TOKENS_JSON_FILE) if os.path.exists(TOKENS_JSON_FILE) else 0
-                file_modified = datetime.fromtimestamp(file_mtime)
-                
-                # اگر cache معتبر است و فایل تغییر نکرده
-                if datetime.now() - _cache_last_modified < _cache_ttl and file_modified <= _cache_last_modified:
-                    return _deepcopy_tokens_data(_tokens_cache)  # برگرداندن کپی عمیق برای جلوگیری از تغییر cache
-            except:
-                pass  # در صورت خطا، از دیسک بخوان
-        
-        # بارگذاری از دیسک
-        try:
-            if os.path.exists(TOKENS_JSON_FILE):
-                with open(TOKENS_JSON_FILE, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    
-                    # تبدیل کلیدهای string به int برای سازگاری
-                    result = {}
-                    for chatid_str, phones in data.items():
-                        chatid_int = int(chatid_str)
-                        result[chatid_int] = {}
-                        for phone_str, tokens in phones.items():
-                            phone_int = int(phone_str)
-                            result[chatid_int][phone_int] = tokens
-                    
-                    # تبدیل ساختار قدیمی به جدید (اگر لازم باشد)
-                    result = _migrate_old_format_to_new(result)
-                    # نرمال‌سازی برای جلوگیری از تداخل وضعیت‌ها/تکراری‌ها
-                    result, changed = _normalize_tokens_data(result)
-                    if changed:
-                        # ذخیرهٔ خودکار نسخهٔ نرمال‌شده روی دیسک
-                        serializable = {
-                            str(cid): {str(ph): sd for ph, sd in phones.items()}
-                            for cid, phones in result.items()
-                        }
-                        _write_json_file(serializable)
-                    
-                    # به‌روزرسانی cache
-                    _tokens_cache = result
-                    _cache_last_modified = datetime.now()
-                    
-                    return _deepcopy_tokens_data(result)  # برگرداندن کپی عمیق
-            else:
-                # اگر فایل وجود ندارد، یک فایل خالی ایجاد کن
-                print(f"ℹ️ فایل {TOKENS_JSON_FILE} وجود ندارد. فایل خالی ایجاد می‌شود.")
-                _create_empty_json_file()
-                _tokens_cache = {}
-                _cache_last_modified = datetime.now()
-                return {}
-        except Exception as e:
-            print(f"❌ خطا در بارگذاری tokens.json: {e}")
-            import traceback
-            traceback.print_exc()
-            # در صورت خطا، یک فایل خالی ایجاد کن
-            _create_empty_json_file()
-            _tokens_cache = {}
-            _cache_last_modified = datetime.now()
-            return {}
+    """
+    خواندن همهٔ توکن‌ها به ساختار قدیمی {chatid: {phone: {"pending": [], "success": [], "failed": []}}}
+    (force_reload فقط برای سازگاری امضا نگه داشته شده است)
+    """
+    _ensure_store()
+    result = {}
+    try:
+        conn = _get_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT chatid, phone, token, status FROM token_states ORDER BY id")
+        for chatid, phone, token, status in cur.fetchall():
+            phones = result.setdefault(chatid, {})
+            status_dict = phones.setdefault(phone, {"pending": [], "success": [], "failed": []})
+            status_dict.setdefault(status, []).append(token)
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"❌ خطا در بارگذاری توکن‌ها از دیتابیس: {e}")
+        import traceback
+        traceback.print_exc()
+    return result
+
 
 def save_tokens_json(tokens_data):
-    """ذخیره توکن‌ها در فایل JSON - اگر فایل وجود نداشت، ایجاد می‌شود"""
-    global _tokens_cache, _cache_last_modified
-    
-    with _cache_lock:
-        try:
-            # نرمال‌سازی برای جلوگیری از تداخل وضعیت‌ها قبل از ذخیره
-            tokens_data, _ = _normalize_tokens_data(tokens_data)
-
-            # تبدیل کلیدهای int به string برای JSON
-            data = {}
-            for chatid, phones in tokens_data.items():
-                data[str(chatid)] = {}
-                for phone, status_dict in phones.items():
-                    data[str(chatid)][str(phone)] = status_dict
-            
-            # اگر data خالی است، یک ساختار خالی ایجاد کن
-            if not data:
-                data = {}
-            
-            # ایجاد فایل JSON (حتی اگر خالی باشد) - اگر وجود نداشت، خودکار ایجاد می‌شود
-            _write_json_file(data)
-            
-            # به‌روزرسانی cache
-            _tokens_cache = _deepcopy_tokens_data(tokens_data)
-            _cache_last_modified = datetime.now()
-            
-            # بررسی اینکه فایل واقعاً ایجاد شده است
-            if os.path.exists(TOKENS_JSON_FILE):
-                print(f"✅ فایل {TOKENS_JSON_FILE} با موفقیت ذخیره شد.")
-            else:
-                print(f"⚠️ فایل {TOKENS_JSON_FILE} ایجاد نشد!")
-        except Exception as e:
-            print(f"❌ خطا در ذخیره tokens.json: {e}")
-            import traceback
-            traceback.print_exc()
-            # در صورت خطا، سعی کن فایل خالی ایجاد کنی
-            try:
-                _create_empty_json_file()
-            except:
-                pass
+    """جایگزینی کامل وضعیت توکن‌ها با ساختار داده‌شده (در یک تراکنش)"""
+    _ensure_store()
+    try:
+        tokens_data, _ = _normalize_tokens_data(tokens_data)
+        conn = _get_connection()
+        cur = conn.cursor()
+        cur.execute("DELETE FROM token_states")
+        _insert_tokens_data(cur, tokens_data)
+        pending_index.bump_pending_version(cur)
+        conn.commit()
+        cur.close()
+        conn.close()
+        notify_state_change()
+        pending_index.invalidate()
+    except Exception as e:
+        print(f"❌ خطا در ذخیره توکن‌ها: {e}")
+        import traceback
+        traceback.print_exc()
+
 
 def invalidate_cache():
-    """باطل کردن cache - برای استفاده در صورت نیاز به reload فوری"""
-    global _tokens_cache, _cache_last_modified
-    with _cache_lock:
-        _tokens_cache = {}
-        _cache_last_modified = None
+    """سازگاری با کد قبلی — داده مستقیم از دیتابیس خوانده می‌شود و cache جداگانه‌ای وجود ندارد"""
+    return None
+
 
 def add_tokens_to_json(chatid, phone, tokens):
-    """اضافه کردن توکن‌ها به JSON با وضعیت pending"""
+    """اضافه کردن توکن‌های جدید با وضعیت pending؛ توکن‌های موجود در همان chatid نادیده گرفته می‌شوند"""
+    _ensure_store()
     try:
-        print(f"📝 [add_tokens_to_json] شروع: chatid={chatid}, phone={phone}, تعداد توکن‌ها={len(tokens)}")
-        
-        tokens_data = load_tokens_json()
-        print(f"📝 [add_tokens_to_json] داده‌های موجود: {len(tokens_data)} chatid")
-        
-        if chatid not in tokens_data:
-            tokens_data[chatid] = {}
-            print(f"📝 [add_tokens_to_json] chatid جدید اضافه شد: {chatid}")
-        
-        if phone not in tokens_data[chatid]:
-            tokens_data[chatid][phone] = {
-                "pending": [],
-                "success": [],
-                "failed": []
-            }
-            print(f"📝 [add_tokens_to_json] phone جدید اضافه شد: {phone}")
-        
-        # دریافت تمام توکن‌های موجود (از همه وضعیت‌ها)
-        all_existing = set(tokens_data[chatid][phone]["pending"] + 
-                          tokens_data[chatid][phone]["success"] + 
-                          tokens_data[chatid][phone]["failed"])
-        
-        # اضافه کردن فقط توکن‌های جدید (غیر تکراری) به pending
-        new_tokens = [t for t in tokens if t not in all_existing]
-        tokens_data[chatid][phone]["pending"].extend(new_tokens)
-        
-        print(f"📝 [add_tokens_to_json] {len(new_tokens)} توکن جدید اضافه شد (از {len(tokens)} توکن)")
-        
-        save_tokens_json(tokens_data)
-        print(f"✅ [add_tokens_to_json] توکن‌ها با موفقیت ذخیره شدند")
-        
-        return len(new_tokens)
+        chatid = _as_int(chatid)
+        phone = _as_int(phone)
+        unique_tokens = []
+        seen = set()
+        for t in tokens or []:
+            if t and t not in seen:
+                seen.add(t)
+                unique_tokens.append(str(t))
+        if not unique_tokens:
+            return 0
+
+        now = _now_text()
+        conn = _get_connection()
+        cur = conn.cursor()
+        cur.executemany(
+            "INSERT OR IGNORE INTO token_states (chatid, phone, token, status, updated_at) VALUES (?, ?, ?, 'pending', ?)",
+            [(chatid, phone, t, now) for t in unique_tokens],
+        )
+        new_count = cur.rowcount if cur.rowcount is not None and cur.rowcount >= 0 else 0
+        if new_count:
+            pending_index.bump_pending_version(cur, chatid)
+        conn.commit()
+        cur.close()
+        conn.close()
+        notify_state_change(chatid)
+        if new_count:
+            pending_index.invalidate(chatid)
+        print(f"📝 [add_tokens_to_json] {new_count} توکن جدید اضافه شد (از {len(unique_tokens)} توکن) chatid={chatid}, phone={phone}")
+        return new_count
     except Exception as e:
         print(f"❌ [add_tokens_to_json] خطا: {e}")
         import traceback
         traceback.print_exc()
         return 0
 
+
+def add_tokens_batch(chatid, tokens_by_phone):
+    """نسخهٔ دسته‌ای add_tokens_to_json برای چند شماره در یک تراکنش؛ خروجی: {phone: تعداد جدید}"""
+    _ensure_store()
+    counts = {}
+    try:
+        chatid = _as_int(chatid)
+        now = _now_text()
+        conn = _get_connection()
+        cur = conn.cursor()
+        for phone, tokens in (tokens_by_phone or {}).items():
+            phone = _as_int(phone)
+            unique_tokens = list(dict.fromkeys(str(t) for t in tokens or [] if t))
+            if not unique_tokens:
+                counts[phone] = 0
+                continue
+            cur.executemany(
+                "INSERT OR IGNORE INTO token_states (chatid, phone, token, status, updated_at) VALUES (?, ?, ?, 'pending', ?)",
+                [(chatid, phone, t, now) for t in unique_tokens],
+            )
+            counts[phone] = cur.rowcount if cur.rowcount is not None and cur.rowcount >= 0 else 0
+        if any(counts.values()):
+            pending_index.bump_pending_version(cur, chatid)
+        conn.commit()
+        cur.close()
+        conn.close()
+        notify_state_change(chatid)
+        if any(counts.values()):
+            pending_index.invalidate(chatid)
+        print(f"📝 [add_tokens_batch] {sum(counts.values())} توکن جدید برای {len(counts)} شماره اضافه شد chatid={chatid}")
+        return counts
+    except Exception as e:
+        print(f"❌ [add_tokens_batch] خطا: {e}")
+        import traceback
+        traceback.print_exc()
+        return {}
+
+
 def update_token_status(chatid, phone, token, new_status):
-    """به‌روزرسانی وضعیت یک توکن (pending -> success/failed)"""
+    """به‌روزرسانی وضعیت یک توکن (pending -> success/failed) — فقط همان ردیف"""
+    if new_status not in _STATUS_ORDER:
+        print(f"❌ وضعیت نامعتبر: {new_status}")
+        return False
+    _ensure_store()
     try:
-        tokens_data = load_tokens_json()
-        
-        if chatid not in tokens_data or phone not in tokens_data[chatid]:
-            print(f"⚠️ توکن {token} یافت نشد برای به‌روزرسانی")
-            return False
-        
-        status_dict = tokens_data[chatid][phone]
-        
-        # حذف توکن از وضعیت قبلی
-        removed = False
-        for status in ["pending", "success", "failed"]:
-            if token in status_dict[status]:
-                status_dict[status].remove(token)
-                removed = True
-                break
-        
-        if not removed:
+        conn = _get_connection()
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE token_states SET status = ?, updated_at = ? WHERE chatid = ? AND phone = ? AND token = ?",
+            (new_status, _now_text(), _as_int(chatid), _as_int(phone), token),
+        )
+        updated = cur.rowcount or 0
+        version = None
+        if updated:
+            if new_status == "success":
+                record_promotions(cur, chatid, [token])
+            version = pending_index.bump_pending_version(cur, chatid)
+        conn.commit()
+        cur.close()
+        conn.close()
+        notify_state_change(chatid)
+        if updated:
+            pending_index.on_status_change(chatid, [token], new_status, version)
+        if not updated:
             print(f"⚠️ توکن {token} در هیچ وضعیتی یافت نشد")
             return False
-        
-        # اضافه کردن توکن به وضعیت جدید
-        if new_status in ["pending", "success", "failed"]:
-            status_dict[new_status].append(token)
-            save_tokens_json(tokens_data)
-            print(f"✅ توکن {token} به وضعیت {new_status} تغییر یافت")
-            return True
-        else:
-            print(f"❌ وضعیت نامعتبر: {new_status}")
-            return False
-            
+        print(f"✅ توکن {token} به وضعیت {new_status} تغییر یافت")
+        return True
     except Exception as e:
         print(f"❌ خطا در به‌روزرسانی وضعیت توکن: {e}")
         import traceback
         traceback.print_exc()
         return False
 
+
+def set_tokens_status(chatid, tokens, new_status):
+    """به‌روزرسانی دسته‌ای وضعیت توکن‌های موجود یک chatid در یک تراکنش (برای نردبان گروهی)"""
+    if new_status not in _STATUS_ORDER:
+        print(f"❌ وضعیت نامعتبر: {new_status}")
+        return 0
+    tokens = [str(t) for t in tokens or [] if t]
+    if not tokens:
+        return 0
+    _ensure_store()
+    try:
+        chatid = _as_int(chatid)
+        now = _now_text()
+        conn = _get_connection()
+        cur = conn.cursor()
+        # فقط توکن‌هایی که واقعاً در token_states این چت بودند در token_meta نردبان‌شده ثبت می‌شوند
+        matched = []
+        for t in tokens:
+            cur.execute(
+                "UPDATE token_states SET status = ?, updated_at = ? WHERE chatid = ? AND token = ?",
+                (new_status, now, chatid, t),
+            )
+            if cur.rowcount and cur.rowcount > 0:
+                matched.append(t)
+        updated = len(matched)
+        version = None
+        if updated:
+            if new_status == "success":
+                record_promotions(cur, chatid, matched)
+            version = pending_index.bump_pending_version(cur, chatid)
+        conn.commit()
+        cur.close()
+        conn.close()
+        notify_state_change(chatid)
+        pending_index.on_status_change(chatid, tokens, new_status, version)
+        return updated
+    except Exception as e:
+        print(f"❌ خطا در به‌روزرسانی دسته‌ای وضعیت توکن‌ها: {e}")
+        return 0
+
+
 def remove_token_from_json(chatid, phone, token):
-    """حذف یک توکن از JSON - DEPRECATED: استفاده از update_token_status به جای این"""
+    """حذف یک توکن - DEPRECATED: استفاده از update_token_status به جای این"""
     # برای سازگاری با کد قدیمی، این تابع وضعیت را به success تغییر می‌دهد
     return update_token_status(chatid, phone, token, "success")
 
-def get_tokens_from_json(chatid, phone, status="pending"):
-    """دریافت توکن‌ها از JSON با وضعیت مشخص - اگر فایل وجود نداشت، ایجاد می‌شود"""
-    tokens_data = load_tokens_json()
-    if chatid in tokens_data and phone in tokens_data[chatid]:
-        status_dict = tokens_data[chatid][phone]
-        if isinstance(status_dict, dict) and status in status_dict:
-            return status_dict[status]
-        # سازگاری با ساختار قدیمی
-        elif isinstance(status_dict, list):
-            return status_dict if status == "pending" else []
-    return []
 
-def get_all_pending_tokens_from_json(chatid):
-    """دریافت تمام توکن‌های pending از JSON - اگر فایل وجود نداشت، ایجاد می‌شود"""
-    tokens_data = load_tokens_json()
-    if chatid not in tokens_data:
+def get_tokens_from_json(chatid, phone, status="pending"):
+    """دریافت توکن‌های یک شماره با وضعیت مشخص (به ترتیب ثبت)"""
+    _ensure_store()
+    try:
+        conn = _get_connection()
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT token FROM token_states WHERE chatid = ? AND phone = ? AND status = ? ORDER BY id",
+            (_as_int(chatid), _as_int(phone), status),
+        )
+        tokens = [row[0] for row in cur.fetchall()]
+        cur.close()
+        conn.close()
+        return tokens
+    except Exception as e:
+        print(f"❌ خطا در دریافت توکن‌ها: {e}")
         return []
-    
-    all_pending = []
-    for phone, status_dict in tokens_data[chatid].items():
-        if isinstance(status_dict, dict):
-            pending_tokens = status_dict.get("pending", [])
-        else:
-            # سازگاری با ساختار قدیمی
-            pending_tokens = status_dict if isinstance(status_dict, list) else []
-        
-        for token in pending_tokens:
-            all_pending.append((phone, token))
-    return all_pending
+
 
 def get_all_tokens_by_status(chatid, status="pending"):
-    """دریافت تمام توکن‌ها با وضعیت مشخص از JSON"""
-    tokens_data = load_tokens_json()
-    if chatid not in tokens_data:
+    """دریافت تمام توکن‌های یک chatid با وضعیت مشخص به صورت [(phone, token)]"""
+    _ensure_store()
+    try:
+        conn = _get_connection()
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT phone, token FROM token_states WHERE chatid = ? AND status = ? ORDER BY phone, id",
+            (_as_int(chatid), status),
+        )
+        rows = [(row[0], row[1]) for row in cur.fetchall()]
+        cur.close()
+        conn.close()
+        return rows
+    except Exception as e:
+        print(f"❌ خطا در دریافت توکن‌ها با وضعیت {status}: {e}")
         return []
-    
-    all_tokens = []
-    for phone, status_dict in tokens_data[chatid].items():
-        if isinstance(status_dict, dict):
-            tokens = status_dict.get(status, [])
-        else:
-            # سازگاری با ساختار قدیمی
-            tokens = status_dict if isinstance(status_dict, list) and status == "pending" else []
-        
-        for token in tokens:
-            all_tokens.append((phone, token))
-    return all_tokens
+
+
+def get_all_pending_tokens_from_json(chatid):
+    """دریافت تمام توکن‌های pending یک chatid به صورت [(phone, token)]"""
+    return get_all_tokens_by_status(chatid, status="pending")
+
 
 def has_pending_tokens_in_json(chatid):
-    """بررسی اینکه آیا توکن pending در JSON وجود دارد - اگر فایل وجود نداشت، ایجاد می‌شود"""
-    tokens_data = load_tokens_json()
-    if chatid not in tokens_data:
+    """بررسی اینکه آیا توکن pending برای chatid وجود دارد"""
+    _ensure_store()
+    try:
+        conn = _get_connection()
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT 1 FROM token_states WHERE chatid = ? AND status = 'pending' LIMIT 1",
+            (_as_int(chatid),),
+        )
+        found = cur.fetchone() is not None
+        cur.close()
+        conn.close()
+        return found
+    except Exception as e:
+        print(f"❌ خطا در بررسی توکن‌های pending: {e}")
         return False
-    
-    for phone, status_dict in tokens_data[chatid].items():
-        if isinstance(status_dict, dict):
-            if status_dict.get("pending", []):
-                return True
-        else:
-            # سازگاری با ساختار قدیمی
-            if isinstance(status_dict, list) and status_dict:
-                return True
-    return False
+
+
+def get_tokens_snapshot(chatid):
+    """
+    نمای فقط‌خواندنی از توکن‌های یک chatid با یک کوئری:
+    {phone: {"pending": (..), "success": (..), "failed": (..)}} — tupleها و MappingProxyType قابل تغییر نیستند
+    و برخلاف load_tokens_json فقط دادهٔ همان chatid خوانده می‌شود.
+    """
+    _ensure_store()
+    by_phone = {}
+    try:
+        conn = _get_connection()
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT phone, token, status FROM token_states WHERE chatid = ? ORDER BY id",
+            (_as_int(chatid),),
+        )
+        for phone, token, status in cur.fetchall():
+            lists = by_phone.setdefault(phone, {"pending": [], "success": [], "failed": []})
+            lists.setdefault(status, []).append(token)
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"❌ خطا در دریافت snapshot توکن‌ها: {e}")
+    return MappingProxyType({
+        phone: MappingProxyType({status: tuple(tokens) for status, tokens in lists.items()})
+        for phone, lists in by_phone.items()
+    })
+
+
+def get_chat_token_set(chatid):
+    """مجموعهٔ فقط‌خواندنی همهٔ توکن‌های یک chatid (همهٔ وضعیت‌ها) برای فیلتر توکن‌های تکراری"""
+    _ensure_store()
+    try:
+        conn = _get_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT token FROM token_states WHERE chatid = ?", (_as_int(chatid),))
+        tokens = frozenset(row[0] for row in cur.fetchall())
+        cur.close()
+        conn.close()
+        return tokens
+    except Exception as e:
+        print(f"❌ خطا در دریافت توکن‌های chatid={chatid}: {e}")
+        return frozenset()
+
+
+def get_status_counts(chatid):
+    """آمار همهٔ شماره‌های یک chatid با یک کوئری: {phone: {"pending", "success", "failed", "total"}}"""
+    _ensure_store()
+    counts = {}
+    try:
+        conn = _get_connection()
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT phone, status, COUNT(*) FROM token_states WHERE chatid = ? GROUP BY phone, status",
+            (_as_int(chatid),),
+        )
+        for phone, status, count in cur.fetchall():
+            stats = counts.setdefault(phone, {"pending": 0, "success": 0, "failed": 0, "total": 0})
+            if status in stats:
+                stats[status] = count
+                stats["total"] += count
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"❌ خطا در دریافت آمار توکن‌ها: {e}")
+    return counts
+
+
+def get_pending_counts(chatid):
+    """تعداد توکن‌های pending هر شماره: {phone: count} (شماره‌های بدون pending حذف می‌شوند)"""
+    return {
+        phone: stats["pending"]
+        for phone, stats in get_status_counts(chatid).items()
+        if stats["pending"] > 0
+    }
+
 
 def get_token_stats(chatid, phone=None):
     """دریافت آمار توکن‌ها برای یک chatid یا phone خاص"""
-    tokens_data = load_tokens_json()
-    if chatid not in tokens_data:
-        return {
-            "pending": 0,
-            "success": 0,
-            "failed": 0,
-            "total": 0
-        }
-    
     stats = {
         "pending": 0,
         "success": 0,
         "failed": 0,
         "total": 0
     }
-    
-    if phone:
-        # آمار برای یک phone خاص
-        if phone in tokens_data[chatid]:
-            status_dict = tokens_data[chatid][phone]
-            if isinstance(status_dict, dict):
-                stats["pending"] = len(status_dict.get("pending", []))
-                stats["success"] = len(status_dict.get("success", []))
-                stats["failed"] = len(status_dict.get("failed", []))
-            else:
-                # سازگاری با ساختار قدیمی
-                stats["pending"] = len(status_dict) if isinstance(status_dict, list) else 0
-            stats["total"] = stats["pending"] + stats["success"] + stats["failed"]
-    else:
-        # آمار برای تمام phone ها
-        for phone_key, status_dict in tokens_data[chatid].items():
-            if isinstance(status_dict, dict):
-                stats["pending"] += len(status_dict.get("pending", []))
-                stats["success"] += len(status_dict.get("success", []))
-                stats["failed"] += len(status_dict.get("failed", []))
-            else:
-                # سازگاری با ساختار قدیمی
-                stats["pending"] += len(status_dict) if isinstance(status_dict, list) else 0
-        
-        stats["total"] = stats["pending"] + stats["success"] + stats["failed"]
-    
+    _ensure_store()
+    try:
+        conn = _get_connection()
+        cur = conn.cursor()
+        if phone:
+            cur.execute(
+                "SELECT status, COUNT(*) FROM token_states WHERE chatid = ? AND phone = ? GROUP BY status",
+                (_as_int(chatid), _as_int(phone)),
+            )
+        else:
+            cur.execute(
+                "SELECT status, COUNT(*) FROM token_states WHERE chatid = ? GROUP BY status",
+                (_as_int(chatid),),
+            )
+        for status, count in cur.fetchall():
+            if status in stats:
+                stats[status] = count
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"❌ خطا در دریافت آمار توکن‌ها: {e}")
+    stats["total"] = stats["pending"] + stats["success"] + stats["failed"]
     return stats
 
+
 def reset_tokens_for_phone(chatid, phone):
     """
-    حذف تمام توکن‌های یک شماره برای یک chatid از JSON.
+    حذف تمام توکن‌های یک شماره برای یک chatid.
     خروجی: (موفقیت، لیست توکن‌های حذف‌شده) برای پاک‌سازی جدول sents و غیره.
     """
     removed_tokens = []
@@ -456,23 +604,19 @@ def reset_tokens_for_phone(chatid, phone):
         except (TypeError, ValueError):
             return False, removed_tokens
 
-        tokens_data = load_tokens_json()
-        if chatid not in tokens_data or phone not in tokens_data[chatid]:
-            return True, removed_tokens
-
-        status_dict = tokens_data[chatid][phone]
-        if isinstance(status_dict, dict):
-            for key in ("pending", "success", "failed"):
-                removed_tokens.extend(status_dict.get(key, []))
-        elif isinstance(status_dict, list):
-            removed_tokens.extend(status_dict)
-
-        del tokens_data[chatid][phone]
-        if not tokens_data[chatid]:
-            del tokens_data[chatid]
-
-        save_tokens_json(tokens_data)
-        print(f"♻️ توکن‌های chatid={chatid} phone={phone} از JSON حذف شد ({len(removed_tokens)} توکن).")
+        _ensure_store()
+        conn = _get_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT token FROM token_states WHERE chatid = ? AND phone = ?", (chatid, phone))
+        removed_tokens = [row[0] for row in cur.fetchall()]
+        cur.execute("DELETE FROM token_states WHERE chatid = ? AND phone = ?", (chatid, phone))
+        pending_index.bump_pending_version(cur, chatid)
+        conn.commit()
+        cur.close()
+        conn.close()
+        notify_state_change(chatid)
+        pending_index.invalidate(chatid)
+        print(f"♻️ توکن‌های chatid={chatid} phone={phone} حذف شد ({len(removed_tokens)} توکن).")
         return True, removed_tokens
     except Exception as e:
         print(f"❌ خطا در reset_tokens_for_phone chatid={chatid} phone={phone}: {e}")
@@ -482,23 +626,28 @@ def reset_tokens_for_phone(chatid, phone):
 
 
 def reset_tokens_for_chat(chatid):
-    """حذف کامل تمام توکن‌های مربوط به یک chatid از فایل JSON"""
+    """حذف کامل تمام توکن‌های مربوط به یک chatid"""
     try:
         try:
             chatid = int(chatid)
         except (TypeError, ValueError):
             pass
-        tokens_data = load_tokens_json()
-        if chatid in tokens_data:
-            del tokens_data[chatid]
-            save_tokens_json(tokens_data)
-            print(f"♻️ تمام توکن‌های chatid={chatid} از JSON حذف شد.")
-            return True
-        # بدون داده هم «ریست موفق» — جلوگیری از گیر کردن auto_reset در حالت JSON خالی/هم‌زمان
-        print(f"ℹ️ توکنی برای chatid={chatid} در JSON یافت نشد (ریست بدون تغییر).")
+        _ensure_store()
+        conn = _get_connection()
+        cur = conn.cursor()
+        cur.execute("DELETE FROM token_states WHERE chatid = ?", (chatid,))
+        deleted = cur.rowcount or 0
+        pending_index.bump_pending_version(cur, chatid)
+        conn.commit()
+        cur.close()
+        conn.close()
+        notify_state_change(chatid)
+        pending_index.invalidate(chatid)
+        # بدون داده هم «ریست موفق» — جلوگیری از گیر کردن auto_reset در حالت خالی/هم‌زمان
+        print(f"♻️ تمام توکن‌های chatid={chatid} حذف شد ({deleted} توکن).")
         return True
     except Exception as e:
         print(f"❌ خطا در reset_tokens_for_chat برای chatid={chatid}: {e}")
         import traceback
         traceback.print_exc()
-        return False
\ No newline at end of file
+        return False
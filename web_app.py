@@ -1,3 +1,4 @@
+import hmac
 import io
 import json
 import os
@@ -8,9 +9,13 @@ from zoneinfo import ZoneInfo
 
 from flask import Flask, flash, get_flashed_messages, make_response, redirect, render_template_string, request, session, url_for
 
-from curds import CreateDB, curdCommands
+from curds import curdCommands
 from dapi import api as DivarApi
-from loadConfig import configBot
+from loadConfig import configBot, get_config, update_config
+from metrics import render_metrics
+from loop_monitor import worst_offenders
+from promotion_journal import stage_latency_rollup, login_failure_rollup
+from worker_signal import notify_worker
 
 # Windows console encoding
 if sys.platform == "win32":
@@ -18,18 +23,8 @@ if sys.platform == "win32":
     sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding="utf-8")
 
 Datas = configBot()
-db = CreateDB(Datas)
-db.create()
 curd = curdCommands(Datas)
-curd.cTable_manage()
-curd.cTable_adminp()
-curd.cTable_logins()
-curd.cTable_sents()
-curd.cTable_admins()
-curd.cTable_jobs()
-curd.cTable_tokens()
-curd.cTable_web_commands()
-curd.cTable_web_panel_auth()
+curd.migrate()
 
 DEFAULT_ADMIN_ID = int(Datas.admin) if Datas.admin is not None else 0
 divar_api = DivarApi()
@@ -38,25 +33,23 @@ app = Flask(__name__)
 app.secret_key = f"web-panel-{Datas.token[:20]}"
 app.config["JSON_AS_ASCII"] = False
 
-# for passenger_wsgi compatibility
-scheduler = None
-
-
 def restore_jobs():
-    return
+    """
+    پنل وب scheduler ندارد؛ نردبان‌ها را پروسه‌های ربات و worker هنگام شروع از jobstore پایدار bot.db
+    بازیابی می‌کنند. اینجا فقط worker بیدار می‌شود تا فرمان‌های معوق بلافاصله پردازش شوند.
+    """
+    notify_worker()
 
 
 def _load_raw_config():
     try:
-        with open("configs.json", "r", encoding="utf-8") as f:
-            return json.load(f)
+        return get_config()
     except Exception:
         return {}
 
 
 def _save_raw_config(config):
-    with open("configs.json", "w", encoding="utf-8") as f:
-        json.dump(config, f, ensure_ascii=False, indent=2)
+    update_config(config, replace=True)
 
 
 def _load_bale_status():
@@ -68,35 +61,16 @@ def _load_bale_status():
 
 
 def _load_web_message_logs(limit=30, panel_chatid=None):
-    try:
-        with open("web_message_logs.json", "r", encoding="utf-8") as f:
-            rows = json.load(f)
-        if not isinstance(rows, list):
-            return []
-        rows = rows[-800:][::-1]
-        cleaned = []
-        for r in rows:
-            if not isinstance(r, dict):
-                continue
-            if panel_chatid is not None:
-                try:
-                    cid = r.get("chat_id")
-                    if cid is None or int(cid) != int(panel_chatid):
-                        continue
-                except (TypeError, ValueError):
-                    continue
-            raw_text = str(r.get("text", "")).replace("\x00", "").strip()
-            cleaned.append(
-                {
-                    "ts": str(r.get("ts", "-")).replace("\x00", "") or "-",
-                    "text": raw_text or "-",
-                }
-            )
-            if len(cleaned) >= limit:
-                break
-        return cleaned
-    except Exception:
-        return []
+    cleaned = []
+    for ts, text in curd.getMessageLogs(limit=limit, chatid=panel_chatid):
+        raw_text = str(text or "").replace("\x00", "").strip()
+        cleaned.append(
+            {
+                "ts": str(ts or "-").replace("\x00", "") or "-",
+                "text": raw_text or "-",
+            }
+        )
+    return cleaned
 
 
 def _panel_chatid() -> int:
@@ -119,7 +93,11 @@ def login_required(fn):
 
 def _enqueue_command(command_type, payload=None):
     payload_json = json.dumps(payload or {}, ensure_ascii=False)
-    return curd.addWebCommand(chatid=_panel_chatid(), command_type=command_type, payload_json=payload_json)
+    command_id = curd.addWebCommand(chatid=_panel_chatid(), command_type=command_type, payload_json=payload_json)
+    if command_id:
+        # worker بلافاصله بیدار می‌شود (polling فقط پشتیبان است)
+        notify_worker()
+    return command_id
 
 
 def _normalize_phone(raw_phone: str):
@@ -298,6 +276,9 @@ def panel():
     bale_status = _load_bale_status()
     message_logs = _load_web_message_logs(limit=40, panel_chatid=cid)
     nardeban_runtime = _get_nardeban_runtime_status()
+    stage_stats = stage_latency_rollup(chatid=cid)
+    login_failures = login_failure_rollup(chatid=cid)
+    loop_offenders = worst_offenders(limit=10)
     otp_phone = session.get("otp_phone", "")
     open_otp_for_modal = bool(session.pop("open_otp_modal", False))
     otp_pending_norm = _normalize_phone(otp_phone) if otp_phone else ""
@@ -635,6 +616,81 @@ def panel():
 
         </div>
 
+        <details class="panel-details">
+          <summary>
+            <span>⏱️ زمان مراحل نردبان <span style="font-weight:400;color:#94a3b8;font-size:13px;">({{ cfg.get("promotion_rollup_hours", 24) }} ساعت اخیر)</span></span>
+            <span class="chev">◀</span>
+          </summary>
+          <div class="panel-details-inner">
+            {% if stage_stats %}
+            <div class="table-wrap">
+            <table>
+              <tr><th>مرحله</th><th>تعداد</th><th>p50 (ثانیه)</th><th>p95 (ثانیه)</th><th>ناموفق</th></tr>
+              {% for stage, v in stage_stats.items() %}
+              <tr>
+                <td>{{ stage }}</td>
+                <td>{{ v.count }}</td>
+                <td>{{ v.p50 }}</td>
+                <td>{{ v.p95 }}</td>
+                <td>{{ v.failed }}</td>
+              </tr>
+              {% endfor %}
+            </table>
+            </div>
+            {% else %}
+            <div class="item">هنوز تلاش نردبانی در این بازه ثبت نشده است.</div>
+            {% endif %}
+            {% if login_failures %}
+            <div class="table-wrap">
+            <table>
+              <tr><th>شماره</th><th>تلاش</th><th>ناموفق</th><th>نرخ شکست</th></tr>
+              {% for r in login_failures %}
+              <tr>
+                <td>{{ r.phone }}</td>
+                <td>{{ r.attempts }}</td>
+                <td>{{ r.failed }}</td>
+                <td>{{ r.failure_rate }}%</td>
+              </tr>
+              {% endfor %}
+            </table>
+            </div>
+            {% endif %}
+          </div>
+        </details>
+
+        <details class="panel-details">
+          <summary>
+            <span>🐢 کندی event loop <span style="font-weight:400;color:#94a3b8;font-size:13px;">(۲۴ ساعت اخیر)</span></span>
+            <span class="chev">◀</span>
+          </summary>
+          <div class="panel-details-inner">
+            {% if loop_offenders %}
+            <div class="table-wrap">
+            <table>
+              <tr><th>نوع</th><th>پروسه</th><th>محل</th><th>تعداد</th><th>حداکثر (ثانیه)</th><th>جمع (ثانیه)</th></tr>
+              {% for o in loop_offenders %}
+              <tr>
+                <td>{{ "مسدود" if o.kind == "block" else "دیرکرد" }}</td>
+                <td>{{ o.process }}</td>
+                <td>
+                  <code>{{ o.site }}</code>
+                  {% if o.stack %}
+                  <details><summary>stack</summary><pre style="direction:ltr;text-align:left;white-space:pre-wrap;font-size:12px;">{{ o.stack }}</pre></details>
+                  {% endif %}
+                </td>
+                <td>{{ o.count }}</td>
+                <td>{{ o.max }}</td>
+                <td>{{ o.total }}</td>
+              </tr>
+              {% endfor %}
+            </table>
+            </div>
+            {% else %}
+            <div class="item">در این بازه مسدود شدن یا دیرکرد زمان‌بند ثبت نشده است.</div>
+            {% endif %}
+          </div>
+        </details>
+
         <details class="panel-details">
           <summary>
             <span>🧾 صف فرمان‌ها <span style="font-weight:400;color:#94a3b8;font-size:13px;">({{ recent_commands|length }} مورد اخیر)</span></span>
@@ -992,6 +1048,9 @@ def panel():
             bale_status=bale_status,
             message_logs=message_logs,
             nardeban_runtime=nardeban_runtime,
+            stage_stats=stage_stats,
+            login_failures=login_failures,
+            loop_offenders=loop_offenders,
             weekdays_text=weekdays_text,
             weekday_names=weekday_names,
             active_weekdays=active_weekdays,
@@ -1158,6 +1217,34 @@ def api_command():
     return redirect(url_for("panel"), code=303)
 
 
+def _metrics_authorized():
+    if session.get("web_auth") and _panel_chatid() > 0:
+        return True
+    expected = str(get_config().get("metrics_token") or "").strip()
+    auth = request.headers.get("Authorization", "")
+    if not expected or not auth.startswith("Bearer "):
+        return False
+    return hmac.compare_digest(auth[7:].strip().encode("utf-8"), expected.encode("utf-8"))
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """
+    متریک‌های ربات و worker در قالب متنی Prometheus؛ فقط برای نشست واردشدهٔ پنل یا درخواستی با
+    هدر Authorization: Bearer <metrics_token> (توکن در query string پذیرفته نمی‌شود تا در لاگ‌ها نماند).
+    """
+    if not _metrics_authorized():
+        return make_response("unauthorized\n", 401)
+    try:
+        body = render_metrics()
+    except Exception as e:
+        print(f"❌ [metrics] خطا در ساخت خروجی متریک‌ها: {e}")
+        return make_response("metrics unavailable\n", 503)
+    response = make_response(body, 200)
+    response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    return response
+
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", "5000"))
     app.run(host="0.0.0.0", port=port, debug=False)
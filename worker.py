@@ -1,12 +1,34 @@
 import asyncio
 import json
 import os
+from collections import deque
 from datetime import timedelta
 
 import bot
+import metrics
+from loop_monitor import stop_loop_monitor
+from loadConfig import get_config, refresh_config, subscribe_config
+from worker_signal import open_wakeup_listener
 
 WORKER_LOCK_FILE = ".worker.lock"
 
+# کلیدهایی از configs.json که تغییرشان نیاز به بازتنظیم auto start دارد
+RESCHEDULE_CONFIG_KEYS = frozenset(
+    {"start_hour", "start_minute", "repeat_days", "repeat_start_date", "active_weekdays"}
+)
+_reschedule_pending = False
+_reschedule_task = None
+
+# polling پشتیبان در صورت از دست رفتن بیدارباش (یا نبودن listener)
+POLL_FALLBACK_SECONDS = 3
+PENDING_FETCH_LIMIT = 30
+DEFAULT_COMMAND_CONCURRENCY = 4
+
+# صف جداگانه برای هر چت: فرمان‌های یک چت به ترتیب، چت‌های مختلف هم‌زمان
+_chat_queues = {}
+_chat_tasks = {}
+_command_slots = None
+
 
 def _pid_alive(pid: int) -> bool:
     """بررسی زنده بودن یک PID به صورت سبک و بدون وابستگی خارجی"""
@@ -104,6 +126,29 @@ async def apply_settings_reschedule_if_needed():
             print(f"⚠️ خطا در بروزرسانی auto start برای ادمین پیش‌فرض: {e}")
 
 
+async def _run_pending_reschedule():
+    global _reschedule_pending
+    # چند تغییر پشت‌سرهم (مثلاً ساعت و دقیقه) فقط یک بازتنظیم اضافه ایجاد می‌کنند
+    while _reschedule_pending:
+        _reschedule_pending = False
+        try:
+            await apply_settings_reschedule_if_needed()
+        except Exception as e:
+            print(f"⚠️ خطا در بازتنظیم پس از تغییر تنظیمات: {e}")
+
+
+def _on_config_changed(changed, config):
+    """listener تغییر configs.json (از همین worker یا پنل وب/ویرایش دستی)؛ loadConfig آن را روی loop worker اجرا می‌کند"""
+    global _reschedule_pending, _reschedule_task
+    if not (changed & RESCHEDULE_CONFIG_KEYS):
+        return
+    loop = asyncio.get_running_loop()
+    print(f"🔄 تغییر تنظیمات: {', '.join(sorted(changed))}")
+    _reschedule_pending = True
+    if _reschedule_task is None or _reschedule_task.done():
+        _reschedule_task = loop.create_task(_run_pending_reschedule())
+
+
 async def start_job(chatid: int):
     job_id = bot.curd.getJob(chatid=chatid)
     if job_id:
@@ -137,49 +182,8 @@ async def start_job(chatid: int):
 
 
 async def remove_job(chatid: int):
-    job_id = bot.curd.getJob(chatid=chatid)
-    if job_id:
-        try:
-            bot.scheduler.remove_job(job_id=job_id)
-        except Exception:
-            pass
-
-        try:
-            stop_job_id = f"auto_stop_{chatid}_{job_id}"
-            bot.scheduler.remove_job(stop_job_id)
-        except Exception:
-            pass
-
-    # حذف همه auto_stopهای مرتبط با چت (پوشش نوع 4 و حالت‌های مانده)
-    try:
-        for j in bot.scheduler.get_jobs():
-            try:
-                jid = str(getattr(j, "id", "") or "")
-                if jid.startswith(f"auto_stop_{chatid}"):
-                    bot.scheduler.remove_job(jid)
-            except Exception:
-                continue
-    except Exception:
-        pass
-
-    # پاکسازی jobهای باقیمانده sendNardeban برای این چت (خصوصاً type 4/date jobs)
-    try:
-        for j in bot.scheduler.get_jobs():
-            try:
-                j_args = list(getattr(j, "args", []) or [])
-                if not j_args:
-                    continue
-                if int(j_args[0]) != int(chatid):
-                    continue
-                func_ref = str(getattr(j, "func_ref", "") or "")
-                if "sendNardeban" in func_ref:
-                    bot.scheduler.remove_job(j.id)
-            except Exception:
-                continue
-    except Exception:
-        pass
-
-    bot.curd.removeJob(chatid=chatid)
+    # لغو نوبت‌های نردبان و توقف خودکار در dispatcher مرکزی (بدون پیمایش jobهای scheduler)
+    bot.cancel_ladder(chatid)
     bot.refreshUsed(chatid=chatid)
 
 
@@ -224,7 +228,6 @@ async def execute_command(command_row):
         ok = bot.set_start_time_in_config(hour, minute)
         if not ok:
             raise ValueError("ذخیره زمان شروع ناموفق بود")
-        await apply_settings_reschedule_if_needed()
         return True, f"start={hour:02d}:{minute:02d}"
 
     if command_type == "setStopTime":
@@ -243,7 +246,6 @@ async def execute_command(command_row):
         ok = bot.set_repeat_days_in_config(days, reset_start_date=True)
         if not ok:
             raise ValueError("ذخیره روزهای تکرار ناموفق بود")
-        await apply_settings_reschedule_if_needed()
         return True, f"repeat_days={days}"
 
     if command_type == "setWeekdays":
@@ -252,7 +254,6 @@ async def execute_command(command_row):
         ok = bot.set_active_weekdays_in_config(weekdays)
         if not ok:
             raise ValueError("ذخیره روزهای هفته ناموفق بود")
-        await apply_settings_reschedule_if_needed()
         return True, f"weekdays={weekdays}"
 
     if command_type == "setLoginActive":
@@ -331,26 +332,61 @@ async def execute_command(command_row):
     raise ValueError(f"command_type ناشناخته: {command_type}")
 
 
+def _command_concurrency():
+    try:
+        return max(1, int(get_config().get("worker_concurrency", DEFAULT_COMMAND_CONCURRENCY)))
+    except Exception:
+        return DEFAULT_COMMAND_CONCURRENCY
+
+
+async def _run_command(row):
+    command_id = row[0]
+    try:
+        ok, result = await execute_command(row)
+        bot.curd.completeWebCommand(command_id, success=ok, result_text=str(result))
+    except Exception as e:
+        bot.curd.completeWebCommand(command_id, success=False, result_text=str(e))
+
+
+async def _drain_chat_queue(chatid: int):
+    """اجرای ترتیبی فرمان‌های یک چت؛ سقف هم‌زمانی کل با _command_slots"""
+    queue = _chat_queues.get(chatid)
+    try:
+        while queue:
+            row = queue.popleft()
+            async with _command_slots:
+                await _run_command(row)
+    finally:
+        _chat_tasks.pop(chatid, None)
+        if not queue:
+            _chat_queues.pop(chatid, None)
+
+
 async def process_pending_commands():
-    pending = bot.curd.getPendingWebCommands(limit=30)
+    """قفل فرمان‌های pending و سپردن آن‌ها به صف چت مربوطه؛ تعداد فرمان‌های سپرده‌شده را برمی‌گرداند"""
+    global _command_slots
+    if _command_slots is None:
+        _command_slots = asyncio.Semaphore(_command_concurrency())
+    pending = bot.curd.getPendingWebCommands(limit=PENDING_FETCH_LIMIT)
     if not pending:
-        return
+        return 0
+    dispatched = 0
     for row in pending:
         command_id = row[0]
         if not bot.curd.lockWebCommand(command_id):
             continue
-        try:
-            ok, result = await execute_command(row)
-            bot.curd.completeWebCommand(command_id, success=ok, result_text=str(result))
-        except Exception as e:
-            bot.curd.completeWebCommand(command_id, success=False, result_text=str(e))
+        dispatched += 1
+        chatid = int(row[1])
+        _chat_queues.setdefault(chatid, deque()).append(row)
+        task = _chat_tasks.get(chatid)
+        if task is None or task.done():
+            _chat_tasks[chatid] = asyncio.create_task(_drain_chat_queue(chatid))
+    return dispatched
 
 
 async def bootstrap_scheduler():
-    loop = asyncio.get_running_loop()
-    bot.scheduler.configure(event_loop=loop)
-    if not bot.scheduler.running:
-        bot.scheduler.start()
+    # jobstore پایدار با مالک جدا از پروسهٔ ربات؛ نردبان‌های در جریان همین پروسه ادامه می‌یابند
+    await bot.start_scheduler("worker")
 
     # تنظیم jobهای شروع خودکار مشابه startup ربات
     try:
@@ -377,19 +413,41 @@ async def main():
     print("🚀 Web Worker started (independent from Telegram)")
     print("==================================================")
 
-    # تضمین ایجاد جدول صف فرمان‌ها
-    bot.curd.cTable_web_commands()
+    # تضمین ایجاد جداول (مهاجرت‌های نسخه‌دار؛ در شروع گرم فقط بررسی نسخه)
+    bot.curd.migrate()
     # ردیف‌های processing مانده از کرش/توقف قبلی باعث می‌شد پنل همیشه «در حال شروع» بماند
     bot.curd.reset_abandoned_processing_web_commands()
 
     await bootstrap_scheduler()
+    # بازتنظیم auto start با رویداد تغییر تنظیمات (به جای خواندن مجدد فایل بعد از هر دستور)
+    subscribe_config(_on_config_changed)
 
-    while True:
-        try:
-            await process_pending_commands()
-        except Exception as e:
-            print(f"❌ خطا در حلقه worker: {e}")
-        await asyncio.sleep(3)
+    # پنل وب پس از ثبت فرمان یک datagram می‌فرستد؛ timeout فقط پشتیبان است
+    wakeup = asyncio.Event()
+    wakeup_transport = await open_wakeup_listener(wakeup)
+
+    try:
+        while True:
+            dispatched = 0
+            try:
+                # تغییرات configs.json از فرایندهای دیگر فقط با stat تشخیص داده می‌شود
+                refresh_config()
+                dispatched = await process_pending_commands()
+            except Exception as e:
+                print(f"❌ خطا در حلقه worker: {e}")
+            if dispatched >= PENDING_FETCH_LIMIT:
+                # صف هنوز پر است؛ دور بعد بدون انتظار
+                continue
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=POLL_FALLBACK_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            wakeup.clear()
+    finally:
+        if wakeup_transport is not None:
+            wakeup_transport.close()
+        stop_loop_monitor()
+        metrics.stop_metrics_export("worker")
 
 
 if __name__ == "__main__":
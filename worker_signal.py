@@ -0,0 +1,51 @@
+import asyncio
+import socket
+
+from loadConfig import get_config
+
+# پورت UDP محلی برای بیدار کردن worker بلافاصله پس از ثبت فرمان در پنل وب
+DEFAULT_WAKEUP_PORT = 47831
+WAKEUP_HOST = "127.0.0.1"
+
+
+def _wakeup_address():
+    try:
+        port = int(get_config().get("worker_wakeup_port", DEFAULT_WAKEUP_PORT))
+    except Exception:
+        port = DEFAULT_WAKEUP_PORT
+    return (WAKEUP_HOST, port)
+
+
+def notify_worker():
+    """ارسال datagram بیدارباش به worker — بدون انتظار؛ خطا فقط False برمی‌گرداند"""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.sendto(b"wake", _wakeup_address())
+        return True
+    except OSError as e:
+        print(f"⚠️ ارسال بیدارباش به worker ناموفق بود: {e}")
+        return False
+
+
+class _WakeupProtocol(asyncio.DatagramProtocol):
+    def __init__(self, event):
+        self.event = event
+
+    def datagram_received(self, data, addr):
+        self.event.set()
+
+
+async def open_wakeup_listener(event):
+    """گوش دادن روی پورت بیدارباش؛ در صورت خطا None (worker به polling برمی‌گردد)"""
+    loop = asyncio.get_running_loop()
+    address = _wakeup_address()
+    try:
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: _WakeupProtocol(event),
+            local_addr=address,
+        )
+        print(f"✅ Worker wakeup listener on {address[0]}:{address[1]}")
+        return transport
+    except OSError as e:
+        print(f"⚠️ راه‌اندازی wakeup listener ناموفق بود ({e}) - فقط polling فعال است")
+        return None